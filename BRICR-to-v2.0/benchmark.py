@@ -0,0 +1,340 @@
+"""Benchmarks the transformations on a synthetic corpus
+
+Generates a corpus with generate_corpus.py and runs each stage of the workflow on it,
+in the order of the README:
+- validate: validate.py on the original files, writing the error files
+- summarize_errors: parse_errors.py on the error files
+- fix_2_0: fix_2_0.fix_file with the rules for the corpus' defects
+- fix_ATT: fix_ATT.fix_file on the output of fix_2_0
+- add_ids: add-required-ids/main.py on the output of fix_ATT
+
+Each stage runs in a fresh process so its peak memory (max RSS, which includes
+libxml2's allocations) isn't inflated by the previous stages. The time taken by each
+file is recorded, the one-off setup of a stage (e.g. loading the schema) is reported
+separately. Results are written as JSON, and can be compared against a baseline from
+a previous run.
+
+Run it from this directory, with schema_2_0.xsd downloaded as described in the README.
+"""
+import os
+import sys
+import argparse
+import importlib.util
+import json
+import platform
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from lxml import etree
+
+from generate_corpus import DEFECTS, SCALES, generate_corpus
+
+RESULTS_VERSION = 1
+
+ADD_IDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'add-required-ids', 'main.py')
+
+STAGES = ('validate', 'summarize_errors', 'fix_2_0', 'fix_ATT', 'add_ids')
+
+
+def get_peak_rss():
+    """Returns the peak resident set size of the current process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _timed(paths, func):
+    seconds = []
+    for path in paths:
+        start = time.perf_counter()
+        func(path)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def run_validate(paths, work_dir, schema_path, stream):
+    from validate import format_errors, init_worker, validate_file
+
+    start = time.perf_counter()
+    init_worker(schema_path)
+    setup_seconds = time.perf_counter() - start
+
+    errors_dir = os.path.join(work_dir, 'errors')
+    os.makedirs(errors_dir, exist_ok=True)
+
+    def validate(path):
+        _, errors, _, _ = validate_file(path)
+        if errors is not None:
+            with open(os.path.join(errors_dir, os.path.basename(path)), 'w') as f:
+                f.write(format_errors(path, errors))
+
+    return setup_seconds, _timed(paths, validate)
+
+
+def run_summarize_errors(paths, work_dir, schema_path, stream):
+    # the same steps as parse_errors.summarize_errors, timed per error file
+    from parse_errors import get_errors, update_errors
+
+    errors_dir = os.path.join(work_dir, 'errors')
+    error_files = [os.path.join(errors_dir, os.path.basename(path)) for path in paths]
+    errors = {}
+
+    def summarize(error_file):
+        for error in get_errors(error_file):
+            update_errors(errors, error)
+
+    return 0.0, _timed([path for path in error_files if os.path.exists(path)], summarize)
+
+
+def run_fix_2_0(paths, work_dir, schema_path, stream):
+    start = time.perf_counter()
+    import fix_2_0
+    fix_2_0.init_worker(schema_path)
+    setup_seconds = time.perf_counter() - start
+
+    fixed_dir = os.path.join(work_dir, 'fixed')
+    os.makedirs(fixed_dir, exist_ok=True)
+    for path in paths:
+        shutil.copy(path, fixed_dir)
+    defects = read_corpus_options(work_dir)['defects']
+    rules = [rule for key, rule in fix_2_0.error_fixes_map.items() if key in defects]
+
+    return setup_seconds, _timed(
+        [os.path.basename(path) for path in paths],
+        lambda file: fix_2_0.fix_file(file, fixed_dir, rules, stream=stream)
+    )
+
+
+def run_fix_ATT(paths, work_dir, schema_path, stream):
+    import fix_ATT
+
+    start = time.perf_counter()
+    fix_ATT.init_worker(schema_path)
+    setup_seconds = time.perf_counter() - start
+
+    fixed_dir = os.path.join(work_dir, 'fixed')
+    att_dir = os.path.join(work_dir, 'ATT')
+    os.makedirs(att_dir, exist_ok=True)
+
+    return setup_seconds, _timed(
+        [os.path.join(fixed_dir, os.path.basename(path)) for path in paths],
+        lambda path: fix_ATT.fix_file(path, att_dir, stream=stream)
+    )
+
+
+def run_add_ids(paths, work_dir, schema_path, stream):
+    start = time.perf_counter()
+    spec = importlib.util.spec_from_file_location('add_required_ids', ADD_IDS_PATH)
+    add_required_ids = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(add_required_ids)
+    ids_index = add_required_ids.index_elements_requiring_ids(
+        add_required_ids.load_elements_requiring_ids(schema_path)
+    )
+    add_required_ids.init_worker(ids_index)
+    setup_seconds = time.perf_counter() - start
+
+    # add_ids rewrites the files in place
+    ids_dir = os.path.join(work_dir, 'ids')
+    os.makedirs(ids_dir, exist_ok=True)
+    files = []
+    for path in paths:
+        shutil.copy(os.path.join(work_dir, 'ATT', os.path.basename(path)), ids_dir)
+        files.append(os.path.join(ids_dir, os.path.basename(path)))
+
+    return setup_seconds, _timed(files, lambda file: add_required_ids.add_ids(file, ids_index))
+
+
+STAGE_RUNNERS = {
+    'validate': run_validate,
+    'summarize_errors': run_summarize_errors,
+    'fix_2_0': run_fix_2_0,
+    'fix_ATT': run_fix_ATT,
+    'add_ids': run_add_ids,
+}
+
+
+def run_stage(stage, paths, work_dir, schema_path, stream):
+    """Runs a stage in the current process
+
+    :return: dict, with the setup time, the time taken by each file and the peak RSS
+    """
+    setup_seconds, seconds = STAGE_RUNNERS[stage](paths, work_dir, schema_path, stream)
+    return {
+        'setup_seconds': setup_seconds,
+        'file_seconds': seconds,
+        'peak_rss': get_peak_rss(),
+    }
+
+
+def read_corpus_options(work_dir):
+    with open(os.path.join(work_dir, 'corpus.json')) as f:
+        return json.load(f)
+
+
+def summarize_stage(result, n_bytes):
+    """Turns the raw result of a stage into the statistics stored in the results"""
+    seconds = result['file_seconds']
+    total_seconds = sum(seconds)
+    return {
+        'files': len(seconds),
+        'megabytes': n_bytes / 1e6,
+        'setup_seconds': result['setup_seconds'],
+        'total_seconds': total_seconds,
+        'files_per_second': len(seconds) / total_seconds if total_seconds else None,
+        'megabytes_per_second': n_bytes / 1e6 / total_seconds if total_seconds else None,
+        'median_file_seconds': statistics.median(seconds) if seconds else None,
+        'max_file_seconds': max(seconds) if seconds else None,
+        'peak_rss_megabytes': result['peak_rss'] / 1e6,
+    }
+
+
+def run_benchmarks(work_dir, schema_path, corpus_options, stages=STAGES, stream=False):
+    """Generates a corpus in work_dir and runs the stages on it
+
+    :param work_dir: str, directory for the corpus and the outputs of the stages
+    :param schema_path: str, path to the v2.0 XSD
+    :param corpus_options: dict, passed to generate_corpus
+    :param stages: iterable, names of the stages to run, see STAGES. A stage reads
+        the output of the previous stages, so only trailing stages can be left out
+    :param stream: bool, run fix_2_0 and fix_ATT in streaming mode
+    :return: dict, the results
+    """
+    paths = generate_corpus(os.path.join(work_dir, 'corpus'), **corpus_options)
+    with open(os.path.join(work_dir, 'corpus.json'), 'w') as f:
+        json.dump(corpus_options, f)
+    n_bytes = sum(os.path.getsize(path) for path in paths)
+
+    results = {}
+    for stage in stages:
+        print(f'Running {stage} on {len(paths)} files', flush=True)
+        # a fresh process per stage, so the peak RSS is the stage's own
+        with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as executor:
+            result = executor.submit(run_stage, stage, paths, work_dir, schema_path, stream).result()
+        results[stage] = summarize_stage(result, n_bytes)
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'lxml': '.'.join(str(part) for part in etree.LXML_VERSION),
+        'stream': stream,
+        'corpus': dict(corpus_options, megabytes=n_bytes / 1e6),
+        'stages': results,
+    }
+
+
+def compare_results(results, baseline, tolerance):
+    """Compares results against a baseline
+
+    A stage regressed if its throughput dropped, or its peak memory grew, by more than
+    tolerance (relative to the baseline)
+
+    :return: list, descriptions of the regressions
+    """
+    if results['corpus'] != baseline['corpus'] or results['stream'] != baseline['stream']:
+        print('Warning: the baseline was run on a different corpus or mode, the comparison may not be meaningful')
+
+    regressions = []
+    print(f'\n{"stage":<18}{"files/s":>12}{"baseline":>12}{"ratio":>8}{"peak MB":>12}{"baseline":>12}{"ratio":>8}')
+    for stage, stats in results['stages'].items():
+        baseline_stats = baseline['stages'].get(stage)
+        if baseline_stats is None:
+            print(f'{stage:<18}{"(not in baseline)":>24}')
+            continue
+
+        speed, baseline_speed = stats['files_per_second'], baseline_stats['files_per_second']
+        memory, baseline_memory = stats['peak_rss_megabytes'], baseline_stats['peak_rss_megabytes']
+        speed_ratio = speed / baseline_speed if speed and baseline_speed else None
+        memory_ratio = memory / baseline_memory if baseline_memory else None
+        print(
+            f'{stage:<18}{speed or 0:>12.2f}{baseline_speed or 0:>12.2f}{speed_ratio or 0:>8.2f}'
+            f'{memory:>12.1f}{baseline_memory:>12.1f}{memory_ratio or 0:>8.2f}'
+        )
+
+        if speed_ratio is not None and speed_ratio < 1 - tolerance:
+            regressions.append(f'{stage}: throughput is {speed_ratio:.2f}x the baseline')
+        if memory_ratio is not None and memory_ratio > 1 + tolerance:
+            regressions.append(f'{stage}: peak memory is {memory_ratio:.2f}x the baseline')
+    return regressions
+
+
+def print_results(results):
+    print(f'\n{"stage":<18}{"files":>8}{"total s":>10}{"setup s":>10}{"files/s":>10}{"MB/s":>10}{"max s":>10}{"peak MB":>10}')
+    for stage, stats in results['stages'].items():
+        print(
+            f'{stage:<18}{stats["files"]:>8}{stats["total_seconds"]:>10.3f}{stats["setup_seconds"]:>10.3f}'
+            f'{stats["files_per_second"] or 0:>10.2f}{stats["megabytes_per_second"] or 0:>10.2f}'
+            f'{stats["max_file_seconds"] or 0:>10.3f}{stats["peak_rss_megabytes"]:>10.1f}'
+        )
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Benchmark the transformations on a synthetic corpus')
+    arg_parser.add_argument('--schema', default='schema_2_0.xsd', help='path to the local v2.0 xsd')
+    arg_parser.add_argument('--scale', choices=sorted(SCALES), default='small', help='preset for the corpus options below')
+    for option in ('files', 'measures', 'scenarios', 'duplicates', 'readings'):
+        arg_parser.add_argument(f'--{option}', type=int, help=f'number of {option}, overrides the scale preset')
+    arg_parser.add_argument(
+        '--defects', default=','.join(DEFECTS),
+        help=f'comma separated BRICR defects to include (default: all), any of {",".join(DEFECTS)}'
+    )
+    arg_parser.add_argument('--seed', type=int, default=0, help='seed for the generated corpus')
+    arg_parser.add_argument(
+        '--stages', default=','.join(STAGES),
+        help=f'comma separated stages to run (default: all), a prefix of {",".join(STAGES)}'
+    )
+    arg_parser.add_argument('--stream', action='store_true', help='run fix_2_0 and fix_ATT in streaming mode')
+    arg_parser.add_argument('--output', default='benchmark_results.json', help='where to write the results')
+    arg_parser.add_argument('--baseline', help='results of a previous run to compare against')
+    arg_parser.add_argument(
+        '--tolerance', type=float, default=0.2,
+        help='relative slowdown or memory growth compared to the baseline that counts as a regression'
+    )
+    arg_parser.add_argument('--update-baseline', action='store_true', help='overwrite the baseline with the results')
+    arg_parser.add_argument('--keep', help='directory to keep the corpus and the outputs in, instead of a temporary one')
+    args = arg_parser.parse_args()
+
+    corpus_options = dict(SCALES[args.scale])
+    for option in corpus_options:
+        if getattr(args, option) is not None:
+            corpus_options[option] = getattr(args, option)
+    corpus_options['defects'] = [defect for defect in args.defects.split(',') if defect]
+    corpus_options['seed'] = args.seed
+
+    stages = [stage for stage in args.stages.split(',') if stage]
+    if stages != list(STAGES[:len(stages)]):
+        raise Exception(f'Stages must be a prefix of {",".join(STAGES)}, since each stage reads the output of the previous ones')
+
+    if args.keep:
+        if os.path.exists(args.keep):
+            raise Exception(f'Remove the directory before running the benchmarks: {args.keep}')
+        os.makedirs(args.keep)
+        results = run_benchmarks(args.keep, os.path.abspath(args.schema), corpus_options, stages, args.stream)
+    else:
+        with tempfile.TemporaryDirectory(prefix='bsync-benchmark-') as work_dir:
+            results = run_benchmarks(work_dir, os.path.abspath(args.schema), corpus_options, stages, args.stream)
+
+    print_results(results)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nResults saved to {args.output}')
+
+    if args.baseline and os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.tolerance)
+        if regressions:
+            print('\nRegressions compared to the baseline:')
+            for regression in regressions:
+                print(f'  {regression}')
+            sys.exit(1)
+        print('\nNo regressions compared to the baseline')
+    elif args.baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Baseline saved to {args.baseline}')
@@ -0,0 +1,145 @@
+"""Classifies BuildingSync files by reading only the start of each file
+
+Only the first header_size bytes of a file are parsed, up to the root element's start
+tag, which is enough to tell the namespace of the document and its schemaLocation.
+Files are put into one of BUCKETS:
+- 2.0: a BuildingSync v2.0 document, its schemaLocation references the v2.0 schema
+- bricr: a BuildingSync document in the 2019 namespace, which fix_2_0.py can fix
+- v0.3: a legacy document in the 2014 namespace, which can't be fixed and should be
+  removed (see README)
+- unparseable: not well formed, not a BuildingSync document, or no root element
+  in the header
+
+The classification is written to a json manifest, keyed by the basename of the files,
+which fix_2_0.py and fix_ATT.py read with --manifest to skip the files they can't fix.
+"""
+import os
+import re
+import argparse
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from lxml import etree
+
+from file_io import write_atomic
+from utils import BUILDINGSYNC_URI
+
+HEADER_SIZE = 8192
+
+BUCKETS = ('2.0', 'bricr', 'v0.3', 'unparseable')
+# buckets of the files which can't be fixed
+UNFIXABLE_BUCKETS = ('v0.3', 'unparseable')
+
+LEGACY_URI = 'http://nrel.gov/schemas/bedes-auc/2014'
+XSI_URI = 'http://www.w3.org/2001/XMLSchema-instance'
+# e.g. https://raw.githubusercontent.com/BuildingSync/schema/v2.0/BuildingSync.xsd
+V2_0_SCHEMA_LOCATION_RE = re.compile(r'/v2\.0(?:\.\d+)*/')
+
+
+def classify_header(header):
+    """Classifies a document from its first bytes
+
+    :param header: bytes, the start of the document
+    :return: dict, with the bucket, and the namespace and schemaLocation of the root
+        element, whether it declares the auc and xsi prefixes and, for unparseable
+        files, the reason
+    """
+    parser = etree.XMLPullParser(events=('start',), resolve_entities=False, no_network=True)
+    root = None
+    try:
+        parser.feed(header)
+        for _, root in parser.read_events():
+            break
+    except etree.XMLSyntaxError as e:
+        return {'bucket': 'unparseable', 'reason': str(e)}
+    if root is None:
+        return {'bucket': 'unparseable', 'reason': f'No root element in the first {len(header)} bytes'}
+
+    tag = etree.QName(root)
+    schema_location = root.get(f'{{{XSI_URI}}}schemaLocation')
+    entry = {
+        'bucket': None,
+        'namespace': tag.namespace,
+        'schema_location': schema_location,
+        'prefixes_declared': root.nsmap.get('auc') is not None and root.nsmap.get('xsi') is not None,
+    }
+    if tag.namespace == LEGACY_URI:
+        # whatever the root element, e.g. v0.3 documents are Audits
+        entry['bucket'] = 'v0.3'
+    elif tag.localname != 'BuildingSync':
+        entry.update(bucket='unparseable', reason=f'Unexpected root element {tag.text}')
+    elif tag.namespace == BUILDINGSYNC_URI:
+        is_v2_0 = schema_location is not None and V2_0_SCHEMA_LOCATION_RE.search(schema_location)
+        entry['bucket'] = '2.0' if is_v2_0 else 'bricr'
+    else:
+        entry.update(bucket='unparseable', reason=f'Unknown namespace {tag.namespace}')
+    return entry
+
+
+def classify_file(path, header_size=HEADER_SIZE):
+    """Classifies a file from its first header_size bytes, see classify_header"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(header_size)
+    except OSError as e:
+        return {'bucket': 'unparseable', 'reason': str(e)}
+    return classify_header(header)
+
+
+def classify_files(paths, header_size=HEADER_SIZE, threads=8):
+    """Classifies files, reading them from a pool of threads
+
+    :param paths: list, paths to the files
+    :param header_size: int, number of bytes read from each file
+    :param threads: int, number of reader threads
+    :return: dict, classification of each file, by basename
+    """
+    with ThreadPoolExecutor(threads) as executor:
+        entries = executor.map(lambda path: classify_file(path, header_size), paths)
+        return {os.path.basename(path): entry for path, entry in zip(paths, entries)}
+
+
+def write_manifest(path, files, header_size=HEADER_SIZE):
+    """Writes the classification of files, as returned by classify_files, to a json manifest"""
+    manifest = {'header_size': header_size, 'files': files}
+    write_atomic(path, json.dumps(manifest, indent=2, sort_keys=True).encode())
+
+
+def load_manifest(path):
+    """Returns the classification of each file in a manifest, by basename"""
+    with open(path) as f:
+        return json.load(f)['files']
+
+
+def is_unfixable(manifest, file):
+    """Returns True if the manifest puts the file in one of UNFIXABLE_BUCKETS
+
+    :param manifest: dict, from load_manifest
+    :param file: str, path to the file
+    """
+    entry = manifest.get(os.path.basename(file))
+    return entry is not None and entry['bucket'] in UNFIXABLE_BUCKETS
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Classify BuildingSync files by reading only their start')
+    arg_parser.add_argument('data_dir', help='directory of BuildingSync files')
+    arg_parser.add_argument('manifest', help='json file to write the classification to')
+    arg_parser.add_argument('--header-size', type=int, default=HEADER_SIZE, help='number of bytes read from each file')
+    arg_parser.add_argument('--threads', type=int, default=8, help='number of threads reading files')
+    args = arg_parser.parse_args()
+
+    paths = sorted(
+        os.path.join(args.data_dir, name) for name in os.listdir(args.data_dir) if name.endswith('.xml')
+    )
+    files = classify_files(paths, header_size=args.header_size, threads=args.threads)
+    write_manifest(args.manifest, files, header_size=args.header_size)
+
+    for bucket in BUCKETS:
+        names = sorted(name for name, entry in files.items() if entry['bucket'] == bucket)
+        print(f'{bucket}: {len(names)} files')
+        if bucket in UNFIXABLE_BUCKETS:
+            for name in names:
+                reason = files[name].get('reason')
+                print(f'  {name}' + (f' ({reason})' if reason else ''))
+    print(f'Manifest saved to {args.manifest}')
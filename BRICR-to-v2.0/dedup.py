@@ -0,0 +1,140 @@
+"""Removal of duplicated subtrees, e.g. a Measure repeated with a different ID
+
+utils.remove_dupes only compares a child with the one before it, by tag and text, so it
+misses duplicated structures like a ResourceUse repeated further down its ResourceUses.
+Here the hash of every subtree under a parent is computed bottom-up in one walk, from
+its tag, its attributes other than ID, its text and the hashes of its children, so
+subtrees have the same hash if they only differ in their IDs (or in the whitespace
+between elements).
+
+Under each parent matched by the parent paths (DEFAULT_PARENT_PATHS unless others are
+given), the children with the same hash as an earlier child are removed. IDrefs
+pointing at a removed element, or at one of its descendants, are changed to point at
+the matching element of the copy that was kept. An element whose IDref was changed is
+removed too if it then duplicates an earlier sibling, e.g. the MeasureIDs of two
+Measures which were duplicates.
+
+fix_ATT.py only deduplicates with --dedup: two Measures (or ResourceUses) which only
+differ in their IDs can be distinct, e.g. the same measure applied to two systems, and
+merging them changes what the Scenarios refer to.
+"""
+import hashlib
+import json
+
+from lxml import etree
+
+import instrumentation
+import xpaths
+
+# XPaths of the parents whose children are deduplicated. Measures come first, so
+# subtrees referring to removed Measures hash the same as those referring to the kept ones
+DEFAULT_PARENT_PATHS = (
+    f'{xpaths.FACILITY_PATH}/auc:Measures',
+    f'{xpaths.SCENARIO_PATH}/auc:ResourceUses',
+    f'{xpaths.PACKAGE_OF_MEASURES_PATH}/auc:AnnualSavingsByFuels',
+)
+
+
+def compile_parent_paths(paths):
+    """Returns the compiled XPaths of parent paths, for deduplicate
+
+    :param paths: iterable, XPaths using the auc prefix, e.g. DEFAULT_PARENT_PATHS
+    :return: list
+    """
+    return [xpaths.compile_xpath(path) for path in paths]
+
+
+def _resolve(id_map, idref):
+    # the kept copy can itself be removed later, as part of a duplicate of its ancestor. A
+    # document which reuses IDs can map them in a cycle, which is followed only once
+    seen = set()
+    while idref in id_map and idref not in seen:
+        seen.add(idref)
+        idref = id_map[idref]
+    return idref
+
+
+def subtree_hashes(element, id_map=None):
+    """Returns the hashes of the element and each of its descendants, see the module docstring
+
+    :param element: Element
+    :param id_map: dict, optional, IDs of removed elements -> IDs of the kept copies, so
+        that IDrefs to either hash the same
+    :return: dict, Element -> bytes
+    """
+    id_map = id_map or {}
+    hashes = {}
+    for _, descendant in etree.iterwalk(element, events=('end',)):
+        if not isinstance(descendant.tag, str):
+            # comments and processing instructions
+            continue
+        attributes = sorted(
+            (name, _resolve(id_map, value) if name == 'IDref' else value)
+            for name, value in descendant.attrib.items() if name != 'ID'
+        )
+        children = list(descendant.iterchildren(etree.Element))
+        text = descendant.text or ''
+        if children and not text.strip():
+            text = ''
+        subtree_hash = hashlib.blake2b(json.dumps([descendant.tag, attributes, text]).encode(), digest_size=16)
+        for child in children:
+            subtree_hash.update(hashes[child])
+        hashes[descendant] = subtree_hash.digest()
+    return hashes
+
+
+@instrumentation.timed('dedup.deduplicate')
+def deduplicate(tree, parent_xpaths, changes=None):
+    """Removes the children of parents which duplicate an earlier child, see the module docstring
+
+    :param tree: ElementTree
+    :param parent_xpaths: list, compiled XPaths of the parents, see compile_parent_paths
+    :param changes: ChangeTracker, optional, records the parents and the elements whose
+        IDrefs or IDs were changed
+    :return: int, number of subtrees removed
+    """
+    # ID of a removed element -> ID of the matching element of the kept copy
+    id_map = {}
+    n_removed = 0
+    for parent_xpath in parent_xpaths:
+        for parent in parent_xpath(tree):
+            hashes = subtree_hashes(parent, id_map)
+            kept = {}
+            for child in list(parent.iterchildren(etree.Element)):
+                original = kept.setdefault(hashes[child], child)
+                if original is child:
+                    continue
+                # the hashes are equal, so the two subtrees have the same structure
+                for removed_element, kept_element in zip(child.iter(etree.Element), original.iter(etree.Element)):
+                    removed_id = removed_element.get('ID')
+                    if removed_id is None:
+                        continue
+                    if kept_element.get('ID') is None:
+                        kept_element.set('ID', removed_id)
+                        if changes is not None:
+                            changes.element_changed(kept_element)
+                    elif kept_element.get('ID') != removed_id and _resolve(id_map, kept_element.get('ID')) != removed_id:
+                        id_map[removed_id] = kept_element.get('ID')
+                parent.remove(child)
+                n_removed += 1
+                if changes is not None:
+                    changes.element_changed(parent)
+
+    if id_map:
+        for element in xpaths.ALL_IDREFS(tree):
+            idref = element.get('IDref')
+            if idref not in id_map:
+                continue
+            element.set('IDref', _resolve(id_map, idref))
+            # e.g. the MeasureIDs of a PackageOfMeasures which referred to duplicated Measures
+            if len(element) == 0 and any(
+                sibling.tag == element.tag and sibling.get('IDref') == element.get('IDref') and len(sibling) == 0
+                for sibling in element.itersiblings(preceding=True)
+            ):
+                parent = element.getparent()
+                parent.remove(element)
+                if changes is not None:
+                    changes.element_changed(parent)
+            elif changes is not None:
+                changes.element_changed(element)
+    return n_removed
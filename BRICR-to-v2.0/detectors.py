@@ -0,0 +1,191 @@
+"""Cheap detection of the BRICR defects fixed by fix_2_0.py, without validating the files
+
+Each fix in fix_2_0.error_fixes_map has a detector, so the fixes a file needs can be
+found with a single scan of the file instead of a validation pass over the corpus
+(validation is then only needed afterwards, to check the fixed files). Most defects
+are detected by searching the raw bytes of the file for a pattern, e.g. a start tag
+containing TimeStamp.
+
+The patterns accept any namespace prefix, and can match in comments or CDATA. That is
+harmless for the fixes which don't change elements without the defect, but the report
+and primarylightingsystemtype fixes fail if there is no element to move, so files
+matching their patterns are checked for an element at the paths in RULE_PATHS. The
+calculationmethod defect (children of Scenario or PackageOfMeasures out of schema
+order, or duplicated) depends on the structure of the file, so files matching its
+pattern are parsed and the children of those elements are checked against the schema.
+"""
+import mmap
+import re
+from io import BytesIO
+
+from lxml import etree
+
+from utils import BUILDINGSYNC_URI
+
+# start tag of an element whose local name is name, with any prefix
+_START_TAG = rb'<(?:[\w.-]+:)?%s(?=[\s/>])'
+
+# fixer key -> pattern of the bytes of the files which need the fix
+PATTERNS = {
+    'starttimestamp': re.compile(rb'<[\w.:-]*TimeStamp'),
+    'subsections': re.compile(rb'<(?:[\w.-]+:)?Subsection'),
+    # Report isn't nested in Reports if there is a Report but no Reports
+    'report': re.compile(_START_TAG % rb'Report'),
+    'primarylightingsystemtype': re.compile(_START_TAG % rb'PrimaryLightingSystemType'),
+    'occupancyclassification': re.compile(_START_TAG % rb'OccupancyClassification' + rb'[^>]*>[^<]*Hotel'),
+    # only the files which have Scenarios are parsed and checked, see is_out_of_order
+    'calculationmethod': re.compile(_START_TAG % rb'(?:Scenario|PackageOfMeasures)'),
+}
+
+_REPORTS = re.compile(_START_TAG % rb'Reports')
+
+
+def _tag(name):
+    return f'{{{BUILDINGSYNC_URI}}}{name}'
+
+
+# fixer key -> paths of the elements the fix moves, which are only there in files with the defect
+RULE_PATHS = {
+    'report': [('BuildingSync', 'Facilities', 'Facility', 'Report')],
+    'primarylightingsystemtype': [
+        ('BuildingSync', 'Facilities', 'Facility', 'Systems', 'LightingSystems', 'LightingSystem',
+         'PrimaryLightingSystemType'),
+    ],
+}
+
+# paths of the elements whose children are sorted and deduplicated by fix_calculationmethod
+CALCULATION_METHOD_PATHS = (
+    ('BuildingSync', 'Facilities', 'Facility', 'Reports', 'Report', 'Scenarios', 'Scenario'),
+    ('BuildingSync', 'Facilities', 'Facility', 'Reports', 'Report', 'Scenarios', 'Scenario', 'ScenarioType',
+     'PackageOfMeasures'),
+)
+
+
+def is_out_of_order(element, ordered_children):
+    """Returns True if fix_calculationmethod would change the element's children: they
+    aren't in schema order, or consecutive children have the same tag and text (or are
+    both AnnualSavingsSourceEnergy), see utils.remove_dupes. Children which aren't in the
+    schema are skipped, since the fix can't sort them and they aren't a CalculationMethod
+    ordering error
+
+    :param element: Element
+    :param ordered_children: dict, positions of the children of the element's type, from
+        SchemaIndex.children
+    """
+    previous = None
+    previous_position = -1
+    for child in element.iterchildren(etree.Element):
+        position = ordered_children.get(child.tag)
+        if position is None:
+            continue
+        if position[0] < previous_position:
+            return True
+        if previous is not None and child.tag == previous.tag and (
+            child.text == previous.text or 'AnnualSavingsSourceEnergy' in child.tag
+        ):
+            return True
+        previous = child
+        previous_position = position[0]
+    return False
+
+
+def detect_calculationmethod(tree, schema_index):
+    """Returns True if any Scenario or PackageOfMeasures would be changed by fix_calculationmethod
+
+    The elements are found wherever they are (e.g. in a Report which isn't in Reports
+    yet) and checked against the types of the elements at CALCULATION_METHOD_PATHS
+    """
+    for path in CALCULATION_METHOD_PATHS:
+        type_id = schema_index.get_path_type_id([_tag(name) for name in path])
+        if type_id is None:
+            raise Exception(f'Unable to find path in schema: "{"/".join(path)}"')
+        ordered_children = schema_index.children[type_id]
+        for element in tree.iter(_tag(path[-1])):
+            if is_out_of_order(element, ordered_children):
+                return True
+    return False
+
+
+def has_element_at_paths(source, paths):
+    """Returns True if the document has an element at one of the paths
+
+    :param source: ElementTree, or bytes or str, the path to a file, which are parsed
+        incrementally, keeping only the ancestors of the current element
+    :param paths: list, tuples of the local names of the elements from the root
+    """
+    qualified_paths = {tuple(_tag(name) for name in path) for path in paths}
+    if isinstance(source, etree._ElementTree):
+        for path in qualified_paths:
+            for element in source.iter(path[-1]):
+                if tuple(ancestor.tag for ancestor in element.iterancestors())[::-1] + (element.tag,) == path:
+                    return True
+        return False
+
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    tags = []
+    for event, element in etree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            tags.append(element.tag)
+            if tuple(tags) in qualified_paths:
+                return True
+            continue
+        tags.pop()
+        element.clear()
+        # the finished siblings aren't needed either
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+    return False
+
+
+def detect(source, schema_index, check_tree=True, keep_tree=False):
+    """Returns the keys in fix_2_0.error_fixes_map of the fixes a document needs
+
+    :param source: bytes, the document, str, the path to the file, which is memory
+        mapped rather than read, or ElementTree, which is checked instead of parsing it
+    :param schema_index: SchemaIndex, of the v2.0 schema
+    :param check_tree: bool, if False files matching the calculationmethod pattern aren't
+        parsed and are assumed to need the fix (which doesn't change elements without the
+        defect), e.g. for files too large to parse. The RULE_PATHS are then checked by
+        parsing the file incrementally
+    :param keep_tree: bool, if True the tree parsed to check the document is returned
+        too, so that it can be fixed without parsing the document again
+    :return: set, or a tuple (set, ElementTree or None) if keep_tree
+    """
+    if isinstance(source, etree._ElementTree):
+        result = _detect(etree.tostring(source), None, source, schema_index, check_tree)
+    elif isinstance(source, str):
+        with open(source, 'rb') as f:
+            if not f.seek(0, 2):
+                result = set(), None
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    result = _detect(data, source, None, schema_index, check_tree)
+    else:
+        result = _detect(source, None, None, schema_index, check_tree)
+    return result if keep_tree else result[0]
+
+
+def _detect(data, path, tree, schema_index, check_tree):
+    """Returns the fixer keys and the tree of the document, if it was given or parsed"""
+    fixer_keys = {key for key, pattern in PATTERNS.items() if pattern.search(data)}
+    if 'report' in fixer_keys and _REPORTS.search(data):
+        fixer_keys.remove('report')
+    to_check = [key for key in RULE_PATHS if key in fixer_keys]
+    if 'calculationmethod' in fixer_keys and check_tree:
+        to_check.append('calculationmethod')
+    if not to_check:
+        return fixer_keys, tree
+
+    if check_tree and tree is None:
+        tree = etree.parse(path) if path is not None else etree.parse(BytesIO(data))
+    for key in to_check:
+        if key == 'calculationmethod':
+            needed = detect_calculationmethod(tree, schema_index)
+        elif tree is not None:
+            needed = has_element_at_paths(tree, RULE_PATHS[key])
+        else:
+            needed = has_element_at_paths(path if path is not None else data, RULE_PATHS[key])
+        if not needed:
+            fixer_keys.remove(key)
+    return fixer_keys, tree
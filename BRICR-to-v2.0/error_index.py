@@ -0,0 +1,181 @@
+import argparse
+import glob
+import os
+import json
+import sqlite3
+
+from parse_errors import iter_errors, split_error, split_filename
+
+SCHEMA_VALIDITY_ERROR = 'Schemas validity error '
+
+
+class ErrorIndex:
+    """Incremental index of the errors in a directory of error files, stored in SQLite
+
+    The files named in the errors are interned into integer ids, and each error is
+    stored as a row of (short_error, element_tag, details, file_id, line). Error files
+    are only re-read when their mtime or size changes, so updating the index after
+    another validation run only reads the new error files.
+
+    :param db_path: str, path to the SQLite database
+    """
+    def __init__(self, db_path):
+        self.connection = sqlite3.connect(db_path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS error_files (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS errors (
+                short_error TEXT NOT NULL,
+                element_tag TEXT NOT NULL,
+                details TEXT NOT NULL,
+                file_id INTEGER NOT NULL REFERENCES files (id),
+                line INTEGER,
+                error_file_id INTEGER NOT NULL REFERENCES error_files (id)
+            );
+            CREATE INDEX IF NOT EXISTS errors_by_element ON errors (short_error, element_tag);
+            CREATE INDEX IF NOT EXISTS errors_by_error_file ON errors (error_file_id);
+        ''')
+        self._file_ids = dict(self.connection.execute('SELECT name, id FROM files'))
+
+    def _get_file_id(self, name):
+        file_id = self._file_ids.get(name)
+        if file_id is None:
+            file_id = self.connection.execute('INSERT INTO files (name) VALUES (?)', (name,)).lastrowid
+            self._file_ids[name] = file_id
+        return file_id
+
+    def _read_error_file(self, error_file_id, path):
+        rows = []
+        for error in iter_errors(path):
+            filename, short_error, element_tag, error_details = split_error(error)
+            name, line = split_filename(filename)
+            rows.append((short_error, element_tag, error_details, self._get_file_id(name), line, error_file_id))
+        return rows
+
+    def update(self, directory):
+        """Indexes the error files in directory which are new or have changed since
+        they were last indexed, and forgets error files which no longer exist
+
+        :param directory: str, directory of error files
+        :return: int, number of error files that were (re)indexed
+        """
+        directory = os.path.join(os.path.abspath(directory), '')
+        indexed = {
+            path: (error_file_id, mtime, size)
+            for error_file_id, path, mtime, size in self.connection.execute(
+                'SELECT id, path, mtime, size FROM error_files WHERE substr(path, 1, ?) = ?',
+                (len(directory), directory)
+            )
+        }
+
+        n_indexed = 0
+        with self.connection:
+            for path in glob.glob(os.path.join(directory, '*.xml')):
+                stat = os.stat(path)
+                error_file_id, mtime, size = indexed.pop(path, (None, None, None))
+                if mtime == stat.st_mtime and size == stat.st_size:
+                    continue
+
+                if error_file_id is None:
+                    error_file_id = self.connection.execute(
+                        'INSERT INTO error_files (path, mtime, size) VALUES (?, ?, ?)',
+                        (path, stat.st_mtime, stat.st_size)
+                    ).lastrowid
+                else:
+                    self.connection.execute('DELETE FROM errors WHERE error_file_id = ?', (error_file_id,))
+                    self.connection.execute(
+                        'UPDATE error_files SET mtime = ?, size = ? WHERE id = ?',
+                        (stat.st_mtime, stat.st_size, error_file_id)
+                    )
+                self.connection.executemany(
+                    'INSERT INTO errors (short_error, element_tag, details, file_id, line, error_file_id) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    self._read_error_file(error_file_id, path)
+                )
+                n_indexed += 1
+
+            # the remaining error files were removed from the directory
+            for error_file_id, _, _ in indexed.values():
+                self.connection.execute('DELETE FROM errors WHERE error_file_id = ?', (error_file_id,))
+                self.connection.execute('DELETE FROM error_files WHERE id = ?', (error_file_id,))
+
+        return n_indexed
+
+    def element_tags(self, short_error=SCHEMA_VALIDITY_ERROR):
+        """Returns the element tags which had errors of the type short_error
+
+        :return: list, e.g. ['element Report', ...]
+        """
+        return [row[0] for row in self.connection.execute(
+            'SELECT DISTINCT element_tag FROM errors WHERE short_error = ? ORDER BY element_tag',
+            (short_error,)
+        )]
+
+    def files_with_element_errors(self, element_tag, short_error=SCHEMA_VALIDITY_ERROR):
+        """Returns the names of the files that had errors for an element
+
+        :param element_tag: str, as returned by element_tags, e.g. 'element Report'
+        :return: list, the file names as they appear in the errors (without line numbers)
+        """
+        return [row[0] for row in self.connection.execute(
+            'SELECT DISTINCT files.name FROM errors JOIN files ON files.id = errors.file_id '
+            'WHERE errors.short_error = ? AND errors.element_tag = ?',
+            (short_error, element_tag)
+        )]
+
+    def rows(self):
+        """Returns an iterator over the errors, in the order they were indexed
+
+        :return: iterator, tuples of (short_error, element_tag, details, file name, line)
+            where line is None if the error had no line number
+        """
+        return self.connection.execute(
+            'SELECT errors.short_error, errors.element_tag, errors.details, files.name, errors.line '
+            'FROM errors JOIN files ON files.id = errors.file_id ORDER BY errors.rowid'
+        )
+
+    def summarize(self):
+        """Returns the errors as the same nested dict as parse_errors.summarize_errors"""
+        errors = {}
+        for short_error, element_tag, details, name, line in self.rows():
+            filename = f'{name}:{line}' if line is not None else name
+            errors.setdefault(short_error, {}).setdefault(element_tag, {}).setdefault(
+                details, {'files': []}
+            )['files'].append(filename)
+        return errors
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    # update the index of errors and save the summary as json, or as a compact summary
+    # usage: error_index.py <errors_dir> <index_db> [<json_filename>] [--compact]
+    arg_parser = argparse.ArgumentParser(description='Index a directory of validation errors')
+    arg_parser.add_argument('errors_dir', help='directory of validation errors')
+    arg_parser.add_argument('index_db', help='path to the SQLite index')
+    arg_parser.add_argument('summary', nargs='?', help='file to write the summary of the errors to')
+    arg_parser.add_argument(
+        '--compact', action='store_true',
+        help='write a compact summary which can be queried without loading it, see error_summary.py'
+    )
+    args = arg_parser.parse_args()
+    error_index = ErrorIndex(args.index_db)
+    n_indexed = error_index.update(args.errors_dir)
+    print(f'Indexed {n_indexed} new or changed error files')
+    if args.summary and args.compact:
+        from error_summary import write_summary
+
+        write_summary(args.summary, error_index.rows())
+    elif args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(error_index.summarize(), f)
+    error_index.close()
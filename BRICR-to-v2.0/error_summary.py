@@ -0,0 +1,280 @@
+"""Compact summary of validation errors, which can be queried without loading the errors
+
+The json summary written by parse_errors.py repeats the name of a file in every error
+it had, and has to be loaded into nested dicts to answer any question about it. In a
+compact summary the file names, short errors, element tags and details are each
+stored once in a table, and the errors are integer arrays of ids into those tables:
+
+- header: MAGIC, then the length and content of a zlib compressed json header with
+  the tables, the groups (the range of errors for each short error and element tag)
+  and the offset, typecode and length of each array
+- arrays: the details id, file id and line (0 if none) of each error, sorted by group,
+  and the index of the errors sorted by file (by_file) with the offset of each file's
+  errors in it (file_offsets)
+
+Each array uses the smallest of 1, 2, 4 or 8 bytes per item that fits its values. The
+file is memory mapped. Opening a summary decompresses the header, so it loads the
+tables (the distinct file names, errors and details, not one entry per error), and
+a query only reads the part of the arrays it needs, e.g.
+
+    with ErrorSummary('errors.summary') as summary:
+        for element_tag in summary.element_tags():
+            files = summary.files_with_element_errors(element_tag)
+
+ErrorSummary has the same element_tags and files_with_element_errors methods as
+error_index.ErrorIndex, so fix_2_0.py can read the errors from either.
+"""
+import bisect
+import glob
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from error_index import SCHEMA_VALIDITY_ERROR
+from file_io import write_atomic
+from parse_errors import iter_errors, split_error, split_filename
+
+MAGIC = b'BSYNCES1'
+# length of the json header
+HEADER_LENGTH = struct.Struct('<Q')
+# the arrays start at multiples of this
+ALIGNMENT = 8
+
+ARRAYS = ('details', 'files', 'lines', 'by_file', 'file_offsets')
+
+
+def iter_error_rows(directory):
+    """Yields the errors in a directory of error files
+
+    :param directory: str, directory of error files
+    :return: iterator, tuples of (short_error, element_tag, details, file name, line)
+        where line is None if the error had no line number
+    """
+    for path in glob.glob(os.path.join(directory, '*.xml')):
+        for error in iter_errors(path):
+            filename, short_error, element_tag, error_details = split_error(error)
+            name, line = split_filename(filename)
+            yield short_error, element_tag, error_details, name, line
+
+
+def _intern(table, ids, value):
+    value_id = ids.get(value)
+    if value_id is None:
+        value_id = ids[value] = len(table)
+        table.append(value)
+    return value_id
+
+
+def _smallest_array(values):
+    max_value = max(values, default=0)
+    for typecode in 'BHIQ':
+        if max_value < 1 << (8 * array(typecode).itemsize):
+            return array(typecode, values)
+    raise Exception('Too many errors for a compact summary')
+
+
+def write_summary(path, rows):
+    """Writes a compact summary of errors
+
+    :param path: str, path to the summary file
+    :param rows: iterable, tuples of (short_error, element_tag, details, file name, line),
+        e.g. from iter_error_rows or ErrorIndex.rows
+    :return: int, number of errors written
+    """
+    tables = {'short_errors': [], 'element_tags': [], 'details': [], 'files': []}
+    ids = {name: {} for name in tables}
+    errors = []
+    for short_error, element_tag, details, name, line in rows:
+        errors.append((
+            _intern(tables['short_errors'], ids['short_errors'], short_error),
+            _intern(tables['element_tags'], ids['element_tags'], element_tag),
+            _intern(tables['details'], ids['details'], details),
+            _intern(tables['files'], ids['files'], name),
+            line or 0,
+        ))
+
+    # the errors of each group are consecutive, in the order they were read
+    errors.sort(key=lambda error: (error[0], error[1]))
+    groups = []
+    for index, error in enumerate(errors):
+        if not groups or groups[-1][:2] != [error[0], error[1]]:
+            groups.append([error[0], error[1], index, index])
+        groups[-1][3] = index + 1
+
+    by_file = sorted(range(len(errors)), key=lambda index: errors[index][3])
+    file_offsets = [0] * (len(tables['files']) + 1)
+    for error in errors:
+        file_offsets[error[3] + 1] += 1
+    for file_id in range(len(tables['files'])):
+        file_offsets[file_id + 1] += file_offsets[file_id]
+
+    arrays = {
+        'details': _smallest_array([error[2] for error in errors]),
+        'files': _smallest_array([error[3] for error in errors]),
+        'lines': _smallest_array([error[4] for error in errors]),
+        'by_file': _smallest_array(by_file),
+        'file_offsets': _smallest_array(file_offsets),
+    }
+
+    # the offsets of the arrays depend on the length of the header, which depends on the
+    # offsets, so the header is built until they stop changing
+    array_offsets = dict.fromkeys(ARRAYS, 0)
+    while True:
+        header = zlib.compress(json.dumps({
+            'byteorder': sys.byteorder,
+            'n_errors': len(errors),
+            'tables': tables,
+            'groups': groups,
+            'arrays': {name: [array_offsets[name], values.typecode, len(values)] for name, values in arrays.items()},
+        }).encode())
+        offset = len(MAGIC) + HEADER_LENGTH.size + len(header)
+        new_array_offsets = {}
+        for name in ARRAYS:
+            offset += -offset % ALIGNMENT
+            new_array_offsets[name] = offset
+            offset += len(arrays[name]) * arrays[name].itemsize
+        if new_array_offsets == array_offsets:
+            break
+        array_offsets = new_array_offsets
+
+    chunks = [MAGIC, HEADER_LENGTH.pack(len(header)), header]
+    offset = len(MAGIC) + HEADER_LENGTH.size + len(header)
+    for name in ARRAYS:
+        chunks.append(b'\0' * (array_offsets[name] - offset))
+        chunks.append(arrays[name].tobytes())
+        offset = array_offsets[name] + len(arrays[name]) * arrays[name].itemsize
+    write_atomic(path, b''.join(chunks))
+    return len(errors)
+
+
+class ErrorSummary:
+    """Read only view of a compact summary, see the module docstring
+
+    :param path: str, path to the summary file
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise Exception(f'Not a compact error summary: {path}')
+            header_length, = HEADER_LENGTH.unpack(f.read(HEADER_LENGTH.size))
+            header = json.loads(zlib.decompress(f.read(header_length)))
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._byteswap = header['byteorder'] != sys.byteorder
+        self._array_layout = header['arrays']
+        self.n_errors = header['n_errors']
+        self.short_errors = header['tables']['short_errors']
+        self.element_tags_table = header['tables']['element_tags']
+        self.details = header['tables']['details']
+        self.files = header['tables']['files']
+        # (short_error, element_tag) -> (start, end) of its errors
+        self.groups = {
+            (self.short_errors[short_error_id], self.element_tags_table[element_tag_id]): (start, end)
+            for short_error_id, element_tag_id, start, end in header['groups']
+        }
+        self._group_starts = [start for _, _, start, _ in header['groups']]
+        self._group_keys = [
+            (self.short_errors[short_error_id], self.element_tags_table[element_tag_id])
+            for short_error_id, element_tag_id, _, _ in header['groups']
+        ]
+        self._file_ids = {name: file_id for file_id, name in enumerate(self.files)}
+
+    def _read(self, name, start=0, end=None):
+        """Returns the items start to end of an array, only reading them from the file"""
+        offset, typecode, length = self._array_layout[name]
+        itemsize = array(typecode).itemsize
+        end = length if end is None else min(end, length)
+        values = array(typecode)
+        values.frombytes(self._mmap[offset + start * itemsize:offset + max(start, end) * itemsize])
+        if self._byteswap:
+            values.byteswap()
+        return values
+
+    def element_tags(self, short_error=SCHEMA_VALIDITY_ERROR):
+        """Returns the element tags which had errors of the type short_error
+
+        :return: list, e.g. ['element Report', ...]
+        """
+        return sorted(element_tag for group_short_error, element_tag in self.groups if group_short_error == short_error)
+
+    def files_with_element_errors(self, element_tag, short_error=SCHEMA_VALIDITY_ERROR):
+        """Returns the names of the files that had errors for an element
+
+        :param element_tag: str, as returned by element_tags, e.g. 'element Report'
+        :return: list, the file names as they appear in the errors (without line numbers)
+        """
+        start, end = self.groups.get((short_error, element_tag), (0, 0))
+        # the file ids in the order they first appear
+        file_ids = dict.fromkeys(self._read('files', start, end))
+        return [self.files[file_id] for file_id in file_ids]
+
+    def errors_by_file(self, name):
+        """Returns the errors of a file
+
+        :param name: str, the file name as it appears in the errors
+        :return: list, tuples of (short_error, element_tag, details, line) where line is
+            None if the error had no line number
+        """
+        file_id = self._file_ids.get(name)
+        if file_id is None:
+            return []
+        start, end = self._read('file_offsets', file_id, file_id + 2)
+        errors = []
+        for index in self._read('by_file', start, end):
+            short_error, element_tag = self._group_keys[bisect.bisect_right(self._group_starts, index) - 1]
+            details_id, = self._read('details', index, index + 1)
+            line, = self._read('lines', index, index + 1)
+            errors.append((short_error, element_tag, self.details[details_id], line or None))
+        return errors
+
+    def counts_by_short_error(self):
+        """Returns the number of errors of each type
+
+        :return: dict, short error -> number of errors
+        """
+        counts = {}
+        for (short_error, _), (start, end) in self.groups.items():
+            counts[short_error] = counts.get(short_error, 0) + end - start
+        return counts
+
+    def rows(self):
+        """Yields the errors, see write_summary"""
+        details = self._read('details')
+        files = self._read('files')
+        lines = self._read('lines')
+        for (short_error, element_tag), (start, end) in self.groups.items():
+            for index in range(start, end):
+                yield (
+                    short_error, element_tag, self.details[details[index]], self.files[files[index]], lines[index] or None
+                )
+
+    def summarize(self):
+        """Returns the errors as the same nested dict as parse_errors.summarize_errors"""
+        errors = {}
+        for short_error, element_tag, details, name, line in self.rows():
+            filename = f'{name}:{line}' if line is not None else name
+            errors.setdefault(short_error, {}).setdefault(element_tag, {}).setdefault(
+                details, {'files': []}
+            )['files'].append(filename)
+        return errors
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def is_summary(path):
+    """Returns True if path is a compact summary file"""
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
@@ -0,0 +1,195 @@
+"""Overlapped reading and atomic writing of the files the scripts transform
+
+The corpus can live on network storage, where reading and writing a file can take as
+long as transforming it. prefetch reads the next files in background threads while
+the current one is transformed, and a BackgroundWriter writes the results from a pool
+of threads, so disk latency overlaps with the CPU work.
+
+Every file is written to a temporary file in the same directory which is flushed to
+disk and then renamed over the destination, so a crash never leaves a partially written
+(or, after a power loss, empty) file behind (which the skip logic of the scripts would
+treat as done). Since files are never written in
+place, an output directory can start as links to the source files (see link_tree):
+writing a file replaces its link and leaves the source file untouched.
+"""
+import errno
+import fcntl
+import itertools
+import os
+import shutil
+import stat
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from uuid import uuid4
+
+
+@contextmanager
+def open_atomic(path):
+    """Opens a temporary file for writing bytes, which replaces path if the block exits
+    without an exception and is removed otherwise
+
+    The file gets the permissions of the file it replaces, or the default ones if it is new.
+    Its data is synced to disk before the rename, and the directory after it, so the rename
+    can't be persisted before the data is
+    """
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f'.{name}.{uuid4().hex}.tmp')
+    f = open(tmp_path, 'xb')
+    try:
+        with f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    _fsync_directory(directory or '.')
+
+
+def _fsync_directory(directory):
+    """Syncs a directory's entries to disk, where the platform supports opening directories"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # e.g. some network filesystems don't support syncing directories
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path, data):
+    """Writes bytes to path through a temporary file so readers never see a partial file"""
+    with open_atomic(path) as f:
+        f.write(data)
+
+
+# modes of link_tree
+LINK_MODES = ('copy', 'hardlink', 'reflink')
+
+# ioctl cloning a file's extents into another file, on the filesystems which support it
+# (e.g. btrfs, XFS), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+def _reflink(source, destination):
+    with open(source, 'rb') as src, open(destination, 'xb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL):
+                raise
+            shutil.copyfileobj(src, dst)
+    shutil.copystat(source, destination)
+
+
+def _hardlink(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError as e:
+        # e.g. the directories are on different filesystems
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(source, destination)
+
+
+def link_tree(source_dir, destination_dir, mode='copy'):
+    """Recreates a directory tree like shutil.copytree, with its files copied or linked
+
+    - copy: the files are copied
+    - hardlink: the files are hard links to the source files, so creating the tree takes
+      no time and no space. Files in it must only be replaced (e.g. with write_atomic),
+      never written in place, or the source files would be changed too
+    - reflink: the files are copy-on-write clones of the source files, on filesystems
+      which support it. They are safe to write in place, and only the changed blocks
+      take space
+
+    Files which can't be linked (e.g. across filesystems) are copied.
+
+    :param source_dir: str
+    :param destination_dir: str, must not exist
+    :param mode: str, one of LINK_MODES
+    """
+    copy_function = {'copy': shutil.copy2, 'hardlink': _hardlink, 'reflink': _reflink}[mode]
+    shutil.copytree(source_dir, destination_dir, copy_function=copy_function)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def prefetch(paths, depth=8, threads=4):
+    """Reads files ahead of their use in background threads
+
+    Yields (path, future) in the order of paths, future.result() returns the content of
+    the file or raises the exception raised reading it. At most depth files are read
+    ahead, so at most depth files are held in memory.
+
+    :param paths: iterable, paths to the files to read
+    :param depth: int, number of files read ahead
+    :param threads: int, number of reader threads
+    """
+    paths = iter(paths)
+    with ThreadPoolExecutor(threads) as executor:
+        pending = deque((path, executor.submit(_read, path)) for path in itertools.islice(paths, depth))
+        while pending:
+            path, future = pending.popleft()
+            for next_path in itertools.islice(paths, 1):
+                pending.append((next_path, executor.submit(_read, next_path)))
+            yield path, future
+
+
+class BackgroundWriter:
+    """Writes files atomically from a pool of threads
+
+    write blocks when max_pending writes are already queued, so results don't pile up in
+    memory when the disk is slower than the transformations. Failed writes are collected
+    in errors, a traceback for each path, once close returns.
+
+    :param threads: int, number of writer threads
+    :param max_pending: int, number of writes which can be queued
+    """
+    def __init__(self, threads=4, max_pending=16):
+        self._executor = ThreadPoolExecutor(threads)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.errors = {}
+
+    def write(self, path, data):
+        """Queues writing bytes to path"""
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._write, path, data)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+    def _write(self, path, data):
+        try:
+            write_atomic(path, data)
+        except Exception:
+            with self._lock:
+                self.errors[path] = traceback.format_exc()
+
+    def close(self):
+        """Waits for the queued writes to finish"""
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
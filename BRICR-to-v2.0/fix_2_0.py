@@ -1,169 +1,110 @@
 import os
-import shutil
+import argparse
 import json
 import glob
+from io import BytesIO
 
 from lxml import etree
-import xmlschema
 
-from parse_errors import summarize_errors
-from utils import sort_element, remove_dupes, fix_namespaces, BUILDINGSYNC_URI, NAMESPACES
-
-
-def fix_timestamp(file, directory):
-    """Turn TimeStamp into Timestamp"""
-    filepath = os.path.join(directory, file)
-    with open(filepath, 'r') as f:
-        filedata = f.read()
-
-    # Replace the target string
-    filedata = filedata.replace('TimeStamp', 'Timestamp')
-
-    # Write the file out again
-    with open(filepath, 'w') as f:
-        f.write(filedata)
-
-
-package_of_measures_xpath = '/'.join([
-    'auc:Facilities',
-    'auc:Facility',
-    'auc:Reports',
-    'auc:Report',
-    'auc:Scenarios',
-    'auc:Scenario',
-    'auc:ScenarioType',
-    'auc:PackageOfMeasures'
-])
-
-scenarios_xpath = '/'.join([
-    'auc:Facilities',
-    'auc:Facility',
-    'auc:Reports',
-    'auc:Report',
-    'auc:Scenarios',
-    'auc:Scenario',
-])
-schema_2_0_instance = xmlschema.XMLSchema('./schema_2_0.xsd')
-
-
-def fix_calculationmethod(file, directory):
-    """Does a couple of fixes
-    - sort elements at PackageOfMeasures
-    - remove duplicated elements in PackageOfMeasures
-    - sort elements at Scenario
-    - remove duplicated elements in Scenario
+import classify
+import detectors
+import instrumentation
+import streaming
+from error_index import ErrorIndex, SCHEMA_VALIDITY_ERROR
+from error_summary import ErrorSummary, is_summary
+from file_io import LINK_MODES, BackgroundWriter, link_tree, open_atomic, prefetch, write_atomic
+from rules import Rule, RuleSet
+from text_rewriter import TextRewriter, UnsupportedDocument
+from schema_cache import load_schema
+from utils import sort_element, remove_dupes, fix_namespaces, BUILDINGSYNC_URI
+
+
+def rename_element(element, old, new, anchored=False):
+    """Replaces old with new in the local name of the element, or only at the start of
+    the local name if anchored
     """
+    # cheap check first, since this is called for every element
+    if old not in element.tag:
+        return
+    qname = etree.QName(element)
+    if anchored:
+        if qname.localname.startswith(old):
+            element.tag = etree.QName(qname.namespace, new + qname.localname[len(old):]).text
+    elif old in qname.localname:
+        element.tag = etree.QName(qname.namespace, qname.localname.replace(old, new)).text
+
+
+def fix_timestamp(element):
+    """Turn TimeStamp into Timestamp"""
+    rename_element(element, 'TimeStamp', 'Timestamp')
 
-    filepath = os.path.join(directory, file)
-    # get the calculation method parent, PackageOfMeasures, and sort its children
-    tree = etree.parse(filepath)
-    elements = tree.xpath(package_of_measures_xpath, namespaces=NAMESPACES)
-    for element in elements:
-        sort_element(schema_2_0_instance, tree, element)
-
-        # remove duplicate children in PackageOfMeasures
-        remove_dupes(element)
-
-    # sort the scenario children (ResourceUses in wrong position)
-    elements = tree.xpath(scenarios_xpath, namespaces=NAMESPACES)
-    for element in elements:
-        sort_element(schema_2_0_instance, tree, element)
-
-        # remove duplicates
-        remove_dupes(element)
 
-    filedata = etree.tostring(tree).decode()
+SCHEMA_PATH = 'schema_2_0.xsd'
 
-    # Write the file out again
-    with open(filepath, 'w') as f:
-        f.write(filedata)
+# loaded once per process by init_worker
+schema_2_0_index = None
 
 
-def fix_subsections(file, directory):
-    """Replaces Subsection(s) with Section(s)"""
-    filepath = os.path.join(directory, file)
-    with open(filepath, 'r') as f:
-        filedata = f.read()
+def init_worker(schema_path=SCHEMA_PATH):
+    """Loads the schema the children of elements are sorted with for the current process"""
+    global schema_2_0_index
+    schema_2_0_index = load_schema(schema_path).index
 
-    # Replace the target string
-    filedata = filedata.replace('auc:Subsection', 'auc:Section')
 
-    # Write the file out again
-    with open(filepath, 'w') as f:
-        f.write(filedata)
+def fix_calculationmethod(element):
+    """Does a couple of fixes, to PackageOfMeasures (the calculation method parent) and Scenario
+    - sort the element's children (e.g. ResourceUses in wrong position in Scenario)
+    - remove the element's duplicated children
+    """
+    sort_element(schema_2_0_index, element.getroottree(), element)
+    remove_dupes(element)
 
 
-report_xpath = 'auc:Facilities/auc:Facility/auc:Report'
+def fix_subsections(element):
+    """Replaces Subsection(s) with Section(s)"""
+    rename_element(element, 'Subsection', 'Section', anchored=True)
 
 
-def fix_report(file, directory):
+def fix_report(report):
     """nest Report in Reports"""
-    filepath = os.path.join(directory, file)
-    tree = etree.parse(filepath)
-
-    report = tree.xpath(report_xpath, namespaces=NAMESPACES)
-    assert len(report) == 1
-    report = report[0]
-
     facility = report.getparent()
     facility.remove(report)
     reports = etree.SubElement(facility, f'{{{BUILDINGSYNC_URI}}}Reports')
     reports.append(report)
 
-    filedata = etree.tostring(tree).decode()
-
-    # Write the file out again
-    with open(filepath, 'w') as f:
-        f.write(filedata)
-
-
-light_xpath = 'auc:Facilities/auc:Facility/auc:Systems/auc:LightingSystems/auc:LightingSystem/auc:PrimaryLightingSystemType'
 
-
-def fix_primarylightingsystemtype(file, directory):
+def fix_primarylightingsystemtype(element):
     """turns PrimaryLightingSystemType into a user defined field"""
-    filepath = os.path.join(directory, file)
-
-    tree = etree.parse(filepath)
-    elements = tree.xpath(light_xpath, namespaces=NAMESPACES)
-    assert len(elements) > 0
-    for element in elements:
-        lighting_type = element.text
+    lighting_type = element.text
 
-        parent_element = element.getparent()
-        parent_element.remove(element)
+    parent_element = element.getparent()
+    parent_element.remove(element)
 
-        udfs = etree.SubElement(parent_element, f'{{{BUILDINGSYNC_URI}}}UserDefinedFields')
-        udf = etree.SubElement(udfs, f'{{{BUILDINGSYNC_URI}}}UserDefinedField')
-        etree.SubElement(udf, f'{{{BUILDINGSYNC_URI}}}FieldName').text = 'PrimaryLightingSystemType'
-        etree.SubElement(udf, f'{{{BUILDINGSYNC_URI}}}FieldValue').text = lighting_type
+    udfs = etree.SubElement(parent_element, f'{{{BUILDINGSYNC_URI}}}UserDefinedFields')
+    udf = etree.SubElement(udfs, f'{{{BUILDINGSYNC_URI}}}UserDefinedField')
+    etree.SubElement(udf, f'{{{BUILDINGSYNC_URI}}}FieldName').text = 'PrimaryLightingSystemType'
+    etree.SubElement(udf, f'{{{BUILDINGSYNC_URI}}}FieldValue').text = lighting_type
 
-    filedata = etree.tostring(tree).decode()
 
-    # Write the file out again
-    with open(filepath, 'w') as f:
-        f.write(filedata)
+OCCUPANCY_CLASSIFICATION = f'{{{BUILDINGSYNC_URI}}}OccupancyClassification'
 
 
-def fix_occupancyclassification(file, directory):
-    """Replace Hotel with Lodging"""
-    filepath = os.path.join(directory, file)
-    with open(filepath, 'r') as f:
-        filedata = f.read()
+def fix_occupancyclassification(element):
+    """Replace Hotel with Lodging in OccupancyClassification"""
+    if element.tag == OCCUPANCY_CLASSIFICATION and element.text and 'Hotel' in element.text:
+        element.text = element.text.replace('Hotel', 'Lodging')
 
-    # Replace the target string
-    filedata = filedata.replace('Hotel', 'Lodging')
 
-    # Write the file out again
-    with open(filepath, 'w') as f:
-        f.write(filedata)
+XSI_SCHEMA_LOCATION = '{http://www.w3.org/2001/XMLSchema-instance}schemaLocation'
+SCHEMA_LOCATION = 'http://buildingsync.net/schemas/bedes-auc/2019 https://raw.githubusercontent.com/BuildingSync/schema/v2.0/BuildingSync.xsd'
 
 
-def fix_schemalocation(file, directory):
-    """Makes sure that the schemaLocation is properly set"""
-    filepath = os.path.join(directory, file)
-    tree = etree.parse(filepath)
+@instrumentation.timed('fix_2_0.fix_schemalocation')
+def fix_schemalocation(tree):
+    """Makes sure that the schemaLocation is properly set
 
+    Returns the fixed tree, which is a new tree if the namespaces had to be fixed
+    """
     # fix the namespaces of the tree if necessary
     root_nsmap = tree.getroot().nsmap
     if root_nsmap.get('auc') is None or root_nsmap.get('xsi') is None:
@@ -171,86 +112,417 @@ def fix_schemalocation(file, directory):
     
     # make sure schemalocation is set
     root = tree.getroot()
-    root.set('{http://www.w3.org/2001/XMLSchema-instance}schemaLocation', 'http://buildingsync.net/schemas/bedes-auc/2019 https://raw.githubusercontent.com/BuildingSync/schema/v2.0/BuildingSync.xsd')
+    root.set(XSI_SCHEMA_LOCATION, SCHEMA_LOCATION)
 
-    # save the finished tree
-    filedata = etree.tostring(tree).decode()
+    return tree
 
-    # Write the file out again
-    with open(filepath, 'w') as f:
-        f.write(filedata)
 
-error_fixes_map = {
-    'starttimestamp': fix_timestamp,
-    'calculationmethod': fix_calculationmethod,
-    'subsections': fix_subsections,
-    'report': fix_report,
-    'primarylightingsystemtype': fix_primarylightingsystemtype,
-    'occupancyclassification': fix_occupancyclassification
-}
+def get_text_rewriter(rules):
+    """Returns a TextRewriter which applies the rules and fixes the schemaLocation, or
+    None if one of the rules needs a tree
 
-data_dir = os.sys.argv[1]
+    :param rules: list, Rules from error_fixes_map
+    """
+    renames = []
+    anchored_renames = []
+    text_replacements = {}
+    for rule in rules:
+        rewrite = TEXT_REWRITES.get(rule.name)
+        if rewrite is None:
+            return None
+        renames.extend(rewrite.get('renames', ()))
+        anchored_renames.extend(rewrite.get('anchored_renames', ()))
+        for tag, replacements in rewrite.get('text_replacements', {}).items():
+            text_replacements.setdefault(tag, []).extend(replacements)
+
+    # the same checks as fix_schemalocation, files whose namespaces have to be fixed need a tree
+    return TextRewriter(
+        renames,
+        text_replacements,
+        root_attributes={XSI_SCHEMA_LOCATION: SCHEMA_LOCATION},
+        root_prefixes=('auc', 'xsi'),
+        anchored_renames=anchored_renames
+    )
+
+
+def fix_file(file, directory, rules, stream=False, rewrite=True, data=None, writer=None, tree=None):
+    """Fixes the file in a single pass and writes it once
+
+    If the rules only rename elements or replace text, the file's markup is rewritten
+    without parsing it (see text_rewriter). Otherwise the file is parsed once, all
+    rules are applied in a single walk of the tree and the schemaLocation is fixed.
+
+    :param file: str, basename of the file to fix
+    :param directory: str, directory containing the file
+    :param rules: list, Rules to apply, see error_fixes_map
+    :param stream: bool, if True the bulky Scenario subtrees (TimeSeriesData and
+        ResourceUses) are streamed through to the output instead of being loaded into memory,
+        and files which are rewritten are read and written incrementally
+    :param rewrite: bool, if False the file is always fixed with a tree
+    :param data: bytes, content of the file if it was already read, e.g. by file_io.prefetch
+    :param writer: file_io.BackgroundWriter, if given the fixed file is written in the
+        background by it. Not used with stream
+    :param tree: ElementTree, the file already parsed (e.g. by detectors.detect), which
+        is fixed instead of parsing the file again. Not used with stream
+    :return: bool, False if the fixed file would be the same as the file, in which case
+        it isn't written. Streamed files are always written
+    """
+    filepath = os.path.join(directory, file)
+    with instrumentation.timed_file(filepath):
+        if stream:
+            text_rewriter = get_text_rewriter(rules) if rewrite else None
+            if text_rewriter is not None:
+                try:
+                    with instrumentation.step('rewrite'):
+                        _rewrite_file(filepath, text_rewriter)
+                    return True
+                except UnsupportedDocument:
+                    # fix it with a tree instead
+                    pass
+            _fix_file_streaming(filepath, rules)
+            return True
+
+        if data is None:
+            with instrumentation.step('read'), open(filepath, 'rb') as f:
+                data = f.read()
+        result = fix_data(data, rules, rewrite=rewrite, tree=tree)
+        if result == data:
+            return False
+        with instrumentation.step('write'):
+            _write(filepath, result, writer)
+        return True
+
+
+def fix_tree(tree, rules):
+    """Applies the rules to the tree in a single walk and fixes the schemaLocation
+
+    Returns the fixed tree, which is a new tree if the namespaces had to be fixed
+
+    :param tree: ElementTree
+    :param rules: list, Rules to apply, see error_fixes_map
+    """
+    with instrumentation.step('fix_2_0.rules'):
+        apply_rules(tree, rules)
+    return fix_schemalocation(tree)
+
+
+def apply_rules(tree, rules):
+    """Applies the rules to the tree in a single walk, or two if one of them is in
+    MOVING_RULES and other rules are applied too
+    """
+    moving_rules = [rule for rule in rules if rule.name in MOVING_RULES]
+    if not moving_rules or len(moving_rules) == len(rules):
+        RuleSet(rules).apply(tree)
+        return
+    RuleSet(moving_rules).apply(tree)
+    RuleSet([rule for rule in rules if rule.name not in MOVING_RULES]).apply(tree)
+
+
+def fix_data(data, rules, rewrite=True, tree=None):
+    """Fixes the content of a file in memory, see fix_file
+
+    :param data: bytes, content of the file
+    :param rules: list, Rules to apply, see error_fixes_map
+    :param rewrite: bool, if False the content is always fixed with a tree
+    :param tree: ElementTree, the content already parsed, which is fixed (in place)
+        instead of rewriting or parsing the content
+    :return: bytes, the fixed content
+    """
+    text_rewriter = get_text_rewriter(rules) if rewrite and tree is None else None
+    if text_rewriter is not None:
+        output = BytesIO()
+        try:
+            with instrumentation.step('rewrite'):
+                text_rewriter.rewrite(BytesIO(data), output)
+            return output.getvalue()
+        except UnsupportedDocument:
+            # fix it with a tree instead
+            pass
+
+    if tree is None:
+        with instrumentation.step('parse'):
+            tree = etree.parse(BytesIO(data))
+    tree = fix_tree(tree, rules)
+    with instrumentation.step('serialize'):
+        return etree.tostring(tree)
+
+
+def get_fixer_key(element_tag):
+    """Returns the key in error_fixes_map of the fix for schema validity errors of an
+    element, or None if the element is one of SKIPPED_ELEMENTS
+
+    :param element_tag: str, local name of the element the errors are for
+    """
+    fixer_key = element_tag.lower()
+    if fixer_key not in error_fixes_map:
+        if element_tag not in SKIPPED_ELEMENTS:
+            raise Exception(f'Failed to find fixer for {element_tag}, which is not supposed to be skipped')
+        return None
+    return fixer_key
+
+
+def get_rules(fixer_keys):
+    """Returns the Rules for fixer keys, in the order they are applied"""
+    return [rule for key, rule in error_fixes_map.items() if key in fixer_keys]
+
+
+def is_up_to_date(entry, rules):
+    """Returns True if fix_file wouldn't need to change a file
+
+    :param entry: dict, the file's entry in a classify manifest, or None
+    :param rules: list, Rules the file needs
+    """
+    return (
+        not rules and entry is not None and entry['bucket'] == '2.0'
+        and entry['schema_location'] == SCHEMA_LOCATION and entry['prefixes_declared']
+    )
 
-# copy over the source files
-fixed_data_dir = os.path.join(
-    os.path.dirname(data_dir),
-    os.path.basename(data_dir) + '_fixed')
-print(f'Copying source files into {fixed_data_dir}')
-if not os.path.isdir(fixed_data_dir):
-    shutil.copytree(data_dir, fixed_data_dir)
-else:
-    raise Exception(f'Remove the _fixed data directory before running this script to fix files: {fixed_data_dir}')
 
-# get the summary of validation errors
-validation_errors_dir = os.sys.argv[2]
-print(f'Summarizing validation errors from {validation_errors_dir}')
-parsed_errors = summarize_errors(validation_errors_dir)
+def _write(filepath, result, writer):
+    if writer is not None:
+        writer.write(filepath, result)
+    else:
+        write_atomic(filepath, result)
 
-# only care about the schema validity errors
-# we are just going to delete the file which has a parsing error
-element_errors = parsed_errors['Schemas validity error ']
+
+def _rewrite_file(filepath, text_rewriter):
+    # the output replaces the file, so it's written to a temporary file first
+    with open(filepath, 'rb') as source, open_atomic(filepath) as output:
+        text_rewriter.rewrite(source, output)
+
+
+def _fix_file_streaming(filepath, rules):
+    # the rules for every element also apply to the spooled subtrees, the others are
+    # for paths outside of them
+    subtree_rule_set = RuleSet([rule for rule in rules if rule.paths is None])
+
+    def fix_subtree(element):
+        subtree_rule_set.apply(element, check=False)
+
+    # the output replaces the file, so it's written to a temporary file first
+    with streaming.Spool(transform=fix_subtree) as spool:
+        with instrumentation.step('parse'):
+            tree = streaming.parse(filepath, spool)
+        with instrumentation.step('fix_2_0.rules'):
+            apply_rules(tree, rules)
+        tree = fix_schemalocation(tree)
+        with instrumentation.step('write'), open_atomic(filepath) as output:
+            streaming.write(tree, output, spool)
+
+
+# the fixes for each element with errors, the paths are those of the BRICR files
+error_fixes_map = {
+    'starttimestamp': Rule('starttimestamp', fix_timestamp),
+    'calculationmethod': Rule('calculationmethod', fix_calculationmethod, paths=[
+        ('Facilities', 'Facility', 'Reports', 'Report', 'Scenarios', 'Scenario', 'ScenarioType', 'PackageOfMeasures'),
+        ('Facilities', 'Facility', 'Reports', 'Report', 'Scenarios', 'Scenario'),
+    ]),
+    'subsections': Rule('subsections', fix_subsections),
+    'report': Rule('report', fix_report, paths=[('Facilities', 'Facility', 'Report')], min_matches=1, max_matches=1),
+    'primarylightingsystemtype': Rule('primarylightingsystemtype', fix_primarylightingsystemtype, paths=[
+        ('Facilities', 'Facility', 'Systems', 'LightingSystems', 'LightingSystem', 'PrimaryLightingSystemType'),
+    ], min_matches=1),
+    'occupancyclassification': Rule('occupancyclassification', fix_occupancyclassification),
+}
+
+# the fixes which move elements to where the paths of the other fixes expect them
+# (e.g. calculationmethod's paths are in Reports). They are applied in a walk of their
+# own before the others, see apply_rules
+MOVING_RULES = ('report',)
 
 # elements we won't try to fix (either fixed manually or deleted) - see README
-skipped_elements = [
+SKIPPED_ELEMENTS = [
     'Address',
     'Audits',
     'ResourceUses'  # handled by fixes to CalculationMethod (same files)
 ]
 
-# iterate through the errors and fix the files
-for element, specific_errors in element_errors.items():
-    print(f'\nFixing {element}')
-    # get the fixer function
-    element_tag = element.split(' ')[1]
-    fixer = error_fixes_map.get(element_tag.lower())
-    if not fixer:
-        if element_tag not in skipped_elements:
-            raise Exception(f'Failed to find fixer for {element_tag}, which is not supposed to be skipped')
-        # skipping this element
-        continue
-
-    # collect all files that had errors with this element (fixes are grouped by elements, not specific errors)
-    files_to_fix = []
-    for error_description, error_data in specific_errors.items():
-        # get _only_ the basename after removing the ':<linenumber>' part of the filename
-        files_to_fix += [os.path.basename(filename.split(':')[0]) for filename in error_data['files']]
+# the fixes which only rename elements or replace the text of specific elements, files
+# which only need these are rewritten without being parsed, see get_text_rewriter
+TEXT_REWRITES = {
+    'starttimestamp': {'renames': [('TimeStamp', 'Timestamp')]},
+    'subsections': {'anchored_renames': [('Subsection', 'Section')]},
+    'occupancyclassification': {'text_replacements': {OCCUPANCY_CLASSIFICATION: [('Hotel', 'Lodging')]}},
+}
 
-    # only grab unique files
-    files_to_fix = list(set(files_to_fix))
 
-    # fix to the file
-    for source_file in files_to_fix:
-        fixer(source_file, fixed_data_dir)
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Fix BRICR files to BuildingSync v2.0')
+    arg_parser.add_argument('data_dir', help='directory of files to fix')
+    arg_parser.add_argument(
+        'validation_errors_dir', nargs='?',
+        help='directory of validation errors for the files, or a compact summary of them (see error_summary.py). If '
+             'omitted, the fixes each file needs are detected by scanning it (see detectors.py), without validating '
+             'the files first'
+    )
+    arg_parser.add_argument(
+        '--stream', action='store_true',
+        help='stream TimeSeriesData and ResourceUses instead of loading them into memory (for very large files)'
+    )
+    arg_parser.add_argument(
+        '--no-rewrite', action='store_true',
+        help='parse every file, instead of rewriting the markup of files which only need elements renamed or text replaced'
+    )
+    arg_parser.add_argument(
+        '--io-threads', type=int, default=4,
+        help='number of threads reading files ahead and writing the fixed files in the background (0 to read and '
+             'write them in the main thread), not used with --stream'
+    )
+    arg_parser.add_argument(
+        '--manifest',
+        help='manifest written by classify.py, files it classifies as v0.3 or unparseable are skipped, as are '
+             'v2.0 files which need no fixes'
+    )
+    arg_parser.add_argument(
+        '--output-mode', choices=LINK_MODES, default='copy',
+        help='how the source files are put in the _fixed directory before fixing them: copied, hard linked (no '
+             'time or space is spent on the files which are not changed) or reflinked (copy-on-write clones, on '
+             'filesystems which support them)'
+    )
+    arg_parser.add_argument('--profile', help='record the time taken by each step and file, and write a report to this json file')
+    args = arg_parser.parse_args()
+    if args.profile:
+        recorder = instrumentation.enable()
+    init_worker()
+
+    data_dir = args.data_dir
+
+    # copy over the source files, or link them. The fixed files replace the links
+    fixed_data_dir = os.path.join(
+        os.path.dirname(data_dir),
+        os.path.basename(data_dir) + '_fixed')
+    print(f'Copying source files into {fixed_data_dir} ({args.output_mode})')
+    if not os.path.isdir(fixed_data_dir):
+        link_tree(data_dir, fixed_data_dir, mode=args.output_mode)
+    else:
+        raise Exception(f'Remove the _fixed data directory before running this script to fix files: {fixed_data_dir}')
+
+    # without validation errors, the fixes are detected when each file is read
+    validation_errors_dir = args.validation_errors_dir
+    detect_fixes = validation_errors_dir is None
+    fixer_keys_by_file = {}
+    if detect_fixes:
+        print('Detecting the fixes needed by each file')
+        element_tags = []
+    elif is_summary(validation_errors_dir):
+        # the summary has the same queries as the index, and only its header is read up front
+        print(f'Reading validation errors from the summary {validation_errors_dir}')
+        error_index = ErrorSummary(validation_errors_dir)
+        element_tags = error_index.element_tags(SCHEMA_VALIDITY_ERROR)
+    else:
+        # index the validation errors, only reading error files that changed since the last run
+        error_index_path = validation_errors_dir.rstrip('/') + '_index.sqlite'
+        print(f'Indexing validation errors from {validation_errors_dir} into {error_index_path}')
+        error_index = ErrorIndex(error_index_path)
+        error_index.update(validation_errors_dir)
+        element_tags = error_index.element_tags(SCHEMA_VALIDITY_ERROR)
+
+    # iterate through the errors and collect the fixers required by each file
+    # only care about the schema validity errors
+    # we are just going to delete the file which has a parsing error
+    for element in element_tags:
+        print(f'Found errors for {element}')
+        # get the fixer function
+        element_tag = element.split(' ')[1]
+        fixer_key = get_fixer_key(element_tag)
+        if fixer_key is None:
+            # skipping this element
+            continue
+
+        # collect all files that had errors with this element (fixes are grouped by elements, not specific errors)
+        for filename in error_index.files_with_element_errors(element, SCHEMA_VALIDITY_ERROR):
+            source_file = os.path.basename(filename)
+            fixer_keys_by_file.setdefault(source_file, set()).add(fixer_key)
+
+    manifest = classify.load_manifest(args.manifest) if args.manifest else {}
+
+    # fix each file in a single pass, applying all of its fixes in one walk of the tree.
+    # The namespaces and schemaLocation are fixed for ALL files, except those the manifest
+    # shows are already v2.0
+    print('\nFixing files, namespaces and schemalocation')
+    file_paths = []
+    rules_by_file = {}
+    unfixable = []
+    n_up_to_date = 0
+    for file_path in glob.glob(os.path.join(fixed_data_dir, '*.xml')):
+        source_file = os.path.basename(file_path)
+        # the rules of detected fixes are found once the file is read, see below
+        rules = None if detect_fixes else get_rules(fixer_keys_by_file.get(source_file, set()))
+        if classify.is_unfixable(manifest, source_file):
+            unfixable.append(source_file)
+        elif is_up_to_date(manifest.get(source_file), rules or []):
+            # when the fixes are detected, files which the manifest shows are already
+            # v2.0 are skipped without being read, since they have none of the BRICR defects
+            n_up_to_date += 1
+        else:
+            file_paths.append(file_path)
+            rules_by_file[file_path] = rules
+    if manifest:
+        print(f'Skipping {n_up_to_date} files which are already v2.0 and {len(unfixable)} files which can\'t be fixed')
+        for source_file in sorted(unfixable):
+            print(f'  {source_file} ({manifest[source_file]["bucket"]})')
+
+    # the next files are read while the current one is fixed, and the fixed files are
+    # written in the background. Streamed files are read and written incrementally instead
+    overlap_io = args.io_threads > 0 and not args.stream
+    files = prefetch(file_paths, threads=args.io_threads) if overlap_io else ((path, None) for path in file_paths)
+    writer = BackgroundWriter(threads=args.io_threads) if overlap_io else None
+    rewritten = set()
+    failed = set()
+    for file_path, content in files:
+        try:
+            data = content.result() if content is not None else None
+            rules = rules_by_file[file_path]
+            tree = None
+            if rules is None:
+                # streamed files aren't parsed to check the calculationmethod defect. The
+                # tree parsed to check the others is fixed rather than parsing the file again
+                with instrumentation.step('detect'):
+                    fixer_keys, tree = detectors.detect(
+                        data if data is not None else file_path, schema_2_0_index, check_tree=not args.stream,
+                        keep_tree=True
+                    )
+                fixer_keys_by_file[os.path.basename(file_path)] = fixer_keys
+                rules = get_rules(fixer_keys)
+            changed = fix_file(
+                os.path.basename(file_path), fixed_data_dir, rules,
+                stream=args.stream, rewrite=not args.no_rewrite, data=data, writer=writer, tree=tree
+            )
+            if changed:
+                rewritten.add(os.path.basename(file_path))
+        except Exception as e:
+            failed.add(os.path.basename(file_path))
+            print(f'\nSkipping file {file_path} due to exception: {str(e)}')
         print('.', end='', flush=True)
-
-# lastly fix the namespaces and schemaLocation for ALL files
-print('\nFixing namespaces and schemalocation')
-for file_path in glob.glob(os.path.join(fixed_data_dir, '*.xml')):
-    try:
-        fix_schemalocation(os.path.basename(file_path), fixed_data_dir)
-    except Exception as e:
-        print(f'\nSkipping file {file_path} due to exception: {str(e)}')
-    print('.', end='', flush=True)
-
-print('\n\n========  DONE  ========')
-print('Fixed files saved to ', fixed_data_dir)
+    if writer is not None:
+        writer.close()
+        for file_path, error in sorted(writer.errors.items()):
+            rewritten.discard(os.path.basename(file_path))
+            failed.add(os.path.basename(file_path))
+            print(f'\nFailed to write {file_path}:\n{error}')
+
+    # record which files were rewritten, the others are the same as the source files
+    output_manifest_path = fixed_data_dir + '_manifest.json'
+    output_manifest = {
+        'output_mode': args.output_mode,
+        'rewritten': sorted(rewritten),
+        'failed': sorted(failed),
+        'unchanged': sorted(
+            name for name in os.listdir(data_dir)
+            if name.endswith('.xml') and name not in rewritten and name not in failed
+        ),
+        # keys of the fixes applied to each file, from its validation errors or detected
+        'fixes': {
+            source_file: sorted(fixer_keys)
+            for source_file, fixer_keys in sorted(fixer_keys_by_file.items()) if fixer_keys
+        },
+    }
+    write_atomic(output_manifest_path, json.dumps(output_manifest, indent=2).encode())
+
+    print('\n\n========  DONE  ========')
+    print('Fixed files saved to ', fixed_data_dir)
+    print(f'{len(rewritten)} files rewritten, {len(output_manifest["unchanged"])} unchanged, see {output_manifest_path}')
+    if args.profile:
+        print(instrumentation.format_report(recorder))
+        instrumentation.write_report(recorder, args.profile)
+        print(f'Profile saved to {args.profile}')
@@ -1,26 +1,81 @@
 import os
-from io import StringIO
+import argparse
+import json
+from io import BytesIO, StringIO
 import glob
 import traceback
+from multiprocessing import Pool
 
 from lxml import etree
-from xmlschema import XMLSchema
 
+import classify
+import dedup
+import instrumentation
+import streaming
+import units
+import xpaths
+from file_io import BackgroundWriter, open_atomic, prefetch, write_atomic
+from schema_cache import load_schema
+from subtree_validation import ChangeTracker, SubtreeValidator
 from utils import (
     BUILDINGSYNC_URI,
-    NAMESPACES,
     add_child_to_element,
+    add_children_to_element,
     add_udfs
 )
 
-schema = XMLSchema('schema_2_0.xsd')
+SCHEMA_PATH = 'schema_2_0.xsd'
 
-parser = etree.XMLParser(remove_blank_text=True)
-etree.set_default_parser(parser)
+# built once per process by init_worker
+schema_index = None
+# built by init_worker if the fixed files are validated, see validate_tree
+validator = None
+# compiled by init_worker, parents whose duplicated children are removed, see dedup.py
+dedup_xpaths = []
 
+# 'subtrees' only validates the elements changed by fix_tree, 'full' the whole document
+VALIDATION_MODES = ('subtrees', 'full')
 
-def fix_file(source, save_dir):
-    tree = etree.parse(source)
+
+def _parser():
+    # blank text is removed so the output can be pretty printed. Parsers can't be shared
+    # by threads, and the default parser is per thread, so each parse gets its own
+    return etree.XMLParser(remove_blank_text=True)
+
+
+def init_worker(schema_path=SCHEMA_PATH, profile=False, validation=None, dedup_paths=()):
+    """Loads the schema for the current process
+
+    Used as the initializer for pool workers so the schema is only loaded once per worker
+
+    :param profile: bool, enable instrumentation in the worker
+    :param validation: str, one of VALIDATION_MODES to load the validator too
+    :param dedup_paths: iterable, XPaths of the parents whose duplicated children are
+        removed, e.g. dedup.DEFAULT_PARENT_PATHS, see dedup.py. Empty to keep the duplicates
+    """
+    global schema_index, validator, dedup_xpaths
+    if profile:
+        instrumentation.enable()
+    schema_index = load_schema(schema_path).index
+    dedup_xpaths = dedup.compile_parent_paths(dedup_paths)
+    if validation is not None:
+        validator = SubtreeValidator(schema_path)
+
+
+def fix_tree(tree, changes=None):
+    """Applies all of the Audit Template Tool fixes to the tree in place
+
+    :param changes: subtree_validation.ChangeTracker, if given the elements changed are
+        recorded in it, so that only they need to be validated
+    """
+    if changes is None:
+        changes = ChangeTracker()
+    anchors = xpaths.Anchors(tree)
+    lap = instrumentation.laps()
+
+    # remove duplicated Measures, ResourceUses, etc. first, if enabled, so the fixes skip them
+    dedup.deduplicate(tree, dedup_xpaths, changes)
+    lap('fix_ATT.dedup')
 
     # Add UDFs to end of report
     udfs_raw = [
@@ -38,39 +93,37 @@ def fix_file(source, save_dir):
         ["Required Audit Year Is Not Applicable", "false"]
     ]
 
-    report_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Reports/auc:Report'
-    report_element = tree.xpath(report_xpath, namespaces=NAMESPACES)[0]
-    add_udfs(report_element, udfs_raw)
+    changes.subtree_changed(add_udfs(anchors.report, udfs_raw))
+    changes.element_changed(anchors.report)
+    lap('fix_ATT.report_udfs')
 
     # add Liked premises or system if it doesn't exist
-    lps_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Reports/auc:Report/auc:LinkedPremisesOrSystem'
-    if not tree.xpath(lps_xpath, namespaces=NAMESPACES):
-        building_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Sites/auc:Site/auc:Buildings/auc:Building'
-        building_id = tree.xpath(building_xpath, namespaces=NAMESPACES)[0].get('ID')
+    if not xpaths.ALL_LINKED_PREMISES_OR_SYSTEMS(tree):
+        building_id = anchors.building.get('ID')
         lps_elem = etree.Element(f'{{{BUILDINGSYNC_URI}}}LinkedPremisesOrSystem')
         etree.SubElement(
             etree.SubElement(lps_elem, f'{{{BUILDINGSYNC_URI}}}Building'),
             f'{{{BUILDINGSYNC_URI}}}LinkedBuildingID',
             IDref=building_id
         )
-        report_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Reports/auc:Report'
-        report_element = tree.xpath(report_xpath, namespaces=NAMESPACES)[0]
-        add_child_to_element(report_element, lps_elem, tree, schema)
+        add_child_to_element(anchors.report, lps_elem, tree, schema_index)
+        changes.subtree_changed(lps_elem)
+    lap('fix_ATT.linked_premises')
+
+    # the new children of each Building are inserted together
+    building_children = {}
 
     # make sure address is in Buildings/Building
-    building_address_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Sites/auc:Site/auc:Buildings/auc:Building/auc:Address'
-    building_address_elem = tree.xpath(building_address_xpath, namespaces=NAMESPACES)
+    building_address_elem = xpaths.ALL_BUILDING_ADDRESSES(tree)
     if not building_address_elem:
-        site_address_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Sites/auc:Site/auc:Address'
-        site_address_elem = tree.xpath(site_address_xpath, namespaces=NAMESPACES)[0]
+        site_address_elem = xpaths.ALL_SITE_ADDRESSES(tree)[0]
+        changes.element_changed(site_address_elem.getparent())
         site_address_elem.getparent().remove(site_address_elem)
-        building_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Sites/auc:Site/auc:Buildings/auc:Building'
-        building_elem = tree.xpath(building_xpath, namespaces=NAMESPACES)[0]
-        add_child_to_element(building_elem, site_address_elem, tree, schema)
+        building_children.setdefault(anchors.building, []).append(site_address_elem)
+    lap('fix_ATT.building_address')
 
     # move FloorsAboveGrade and FloorsBelowGrade to ConditionedFloorsAboveGrade and ConditionedFloorsBelowGrade
-    above_grade_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Sites/auc:Site/auc:Buildings/auc:Building/auc:FloorsAboveGrade'
-    above_grade_elem = tree.xpath(above_grade_xpath, namespaces=NAMESPACES)
+    above_grade_elem = xpaths.ALL_FLOORS_ABOVE_GRADE(tree)
     if above_grade_elem:
         above_grade_elem = above_grade_elem[0]
         n_floors = above_grade_elem.text
@@ -78,10 +131,9 @@ def fix_file(source, save_dir):
         building_elem.remove(above_grade_elem)
         conditioned_above_grade_elem = etree.Element(f'{{{BUILDINGSYNC_URI}}}ConditionedFloorsAboveGrade')
         conditioned_above_grade_elem.text = n_floors
-        add_child_to_element(building_elem, conditioned_above_grade_elem, tree, schema)
+        building_children.setdefault(building_elem, []).append(conditioned_above_grade_elem)
 
-    below_grade_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Sites/auc:Site/auc:Buildings/auc:Building/auc:FloorsBelowGrade'
-    below_grade_elem = tree.xpath(below_grade_xpath, namespaces=NAMESPACES)
+    below_grade_elem = xpaths.ALL_FLOORS_BELOW_GRADE(tree)
     if below_grade_elem:
         below_grade_elem = below_grade_elem[0]
         n_floors = below_grade_elem.text
@@ -89,68 +141,68 @@ def fix_file(source, save_dir):
         building_elem.remove(below_grade_elem)
         conditioned_below_grade_elem = etree.Element(f'{{{BUILDINGSYNC_URI}}}ConditionedFloorsBelowGrade')
         conditioned_below_grade_elem.text = n_floors
-        add_child_to_element(building_elem, conditioned_below_grade_elem, tree, schema)
+        building_children.setdefault(building_elem, []).append(conditioned_below_grade_elem)
+    for building_elem, children in building_children.items():
+        add_children_to_element(building_elem, children, tree, schema_index)
+        for child in children:
+            changes.subtree_changed(child)
+        changes.element_changed(building_elem)
+    lap('fix_ATT.floors')
 
 
     # -- Edit Measures
     # add measuresavingsanalysis and some udfs
     measure_udf_raw = [["Rebate Available", "false"]]
-    measure_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Measures/auc:Measure'
-    measures = tree.xpath(measure_xpath, namespaces=NAMESPACES)
+    measures = xpaths.ALL_MEASURES(tree)
     for measure_element in measures:
         # add savings analysis
         msa_elem = etree.Element(f'{{{BUILDINGSYNC_URI}}}MeasureSavingsAnalysis')
         etree.SubElement(msa_elem, f'{{{BUILDINGSYNC_URI}}}FundingFromIncentives').text = '0'
-        add_child_to_element(measure_element, msa_elem, tree, schema)
+        add_child_to_element(measure_element, msa_elem, tree, schema_index)
 
         # add udfs
         add_udfs(measure_element, measure_udf_raw)
+        changes.subtree_changed(measure_element)
+    lap('fix_ATT.measures')
 
 
     # -- Edit Scenarios
     # check that ResourceUnits are in kBtu
-    resource_units_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Reports/auc:Report/auc:Scenarios/auc:Scenario/auc:ScenarioType/auc:PackageOfMeasures/auc:AnnualSavingsByFuels/auc:AnnualSavingsByFuel/auc:ResourceUnits'
-    resource_units_elems = tree.xpath(resource_units_xpath, namespaces=NAMESPACES)
+    resource_units_elems = xpaths.ALL_SAVINGS_UNITS(tree)
     for ru_elem in resource_units_elems:
         if ru_elem.text != 'kBtu':
             raise Exception(f'Expected all ResourceUses to be kBtu, but found one with "{ru_elem.text}"')
 
-    # change electricity units to kWh, gas to therms
-    electricity_savings_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Reports/auc:Report/auc:Scenarios/auc:Scenario/auc:ScenarioType/auc:PackageOfMeasures/auc:AnnualSavingsByFuels/auc:AnnualSavingsByFuel[auc:EnergyResource="Electricity"]/auc:ResourceUnits[text()="kBtu"]'
-    gas_savings_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Reports/auc:Report/auc:Scenarios/auc:Scenario/auc:ScenarioType/auc:PackageOfMeasures/auc:AnnualSavingsByFuels/auc:AnnualSavingsByFuel[auc:EnergyResource="Natural gas"]/auc:ResourceUnits[text()="kBtu"]'
-
-    for electricity_units in tree.xpath(electricity_savings_xpath, namespaces=NAMESPACES):
-        electricity_units.text = 'kWh'
-        electricity_value = electricity_units.getparent().xpath('auc:AnnualSavingsNativeUnits', namespaces=NAMESPACES)[0]
-        electricity_value.text = str(float(electricity_value.text) * 3.412)
-
-    for gas_units in tree.xpath(gas_savings_xpath, namespaces=NAMESPACES):
-        gas_units.text = 'therms'
-        gas_value = gas_units.getparent().xpath('auc:AnnualSavingsNativeUnits', namespaces=NAMESPACES)[0]
-        gas_value.text = str(float(gas_value.text) * 0.01)
+    # change electricity units to kWh, gas to therms, in the savings, resource uses and time series
+    units.convert_units(tree, changes)
+    lap('fix_ATT.units')
 
     # add temporal status, annual peak electricity reduction, and some udfs
-    scenario_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Reports/auc:Report/auc:Scenarios/auc:Scenario'
-    scenarios = tree.xpath(scenario_xpath, namespaces=NAMESPACES)
+    scenarios = xpaths.ALL_SCENARIOS(tree)
     for scenario_element in scenarios:
         ts_elem = etree.Element(f'{{{BUILDINGSYNC_URI}}}TemporalStatus')
         ts_elem.text = 'Current'
-        add_child_to_element(scenario_element, ts_elem, tree, schema)
+        add_child_to_element(scenario_element, ts_elem, tree, schema_index)
 
         aper_elem = etree.Element(f'{{{BUILDINGSYNC_URI}}}AnnualPeakElectricityReduction')
         aper_elem.text = '0'
-        pom_elem = scenario_element.xpath('auc:ScenarioType/auc:PackageOfMeasures', namespaces=NAMESPACES)[0]
-        add_child_to_element(pom_elem, aper_elem, tree, schema)
+        pom_elem = xpaths.PACKAGE_OF_MEASURES(scenario_element)[0]
+        add_child_to_element(pom_elem, aper_elem, tree, schema_index)
 
         udfs = [
             ["Application Scale", "Entire facility"],
             ["Recommended Resource Savings Category", "Potential Capital Recommendations"]
         ]
-        add_udfs(scenario_element, udfs)
+        # the Scenarios hold the bulky TimeSeriesData, so only the new children are validated
+        changes.subtree_changed(add_udfs(scenario_element, udfs))
+        changes.subtree_changed(ts_elem)
+        changes.subtree_changed(aper_elem)
+        changes.element_changed(scenario_element)
+        changes.element_changed(pom_elem)
+    lap('fix_ATT.scenarios')
 
     # add a special scenario so we don't loose all of our scenario information
-    building_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Sites/auc:Site/auc:Buildings/auc:Building'
-    building_id = tree.xpath(building_xpath, namespaces=NAMESPACES)[0].get('ID')
+    building_id = anchors.building.get('ID')
     new_scenario_text = """<auc:Scenario ID="ScenarioType-69870486597440" xmlns:auc="http://buildingsync.net/schemas/bedes-auc/2019">
   <auc:TemporalStatus>Current</auc:TemporalStatus>
   <auc:ScenarioType>
@@ -182,103 +234,299 @@ def fix_file(source, save_dir):
     </auc:UserDefinedField>
   </auc:UserDefinedFields>
 </auc:Scenario>""".format(building_id=building_id)
-    new_scenario_tree = etree.fromstring(new_scenario_text)
-    scenarios_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Reports/auc:Report/auc:Scenarios'
-    scenarios_elem = tree.xpath(scenarios_xpath, namespaces=NAMESPACES)[0]
-    add_child_to_element(scenarios_elem, new_scenario_tree, tree, schema)
+    new_scenario_tree = etree.fromstring(new_scenario_text, _parser())
+    add_child_to_element(anchors.scenarios, new_scenario_tree, tree, schema_index)
+    changes.subtree_changed(new_scenario_tree)
+    changes.element_changed(anchors.scenarios)
+    lap('fix_ATT.audit_template_scenario')
 
     # -- NY Use Case Changes
     # add ID to Facility and Site
-    facility_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility'
-    tree.xpath(facility_xpath, namespaces=NAMESPACES)[0].set('ID', 'FacilityID')
+    anchors.facility.set('ID', 'FacilityID')
+    changes.element_changed(anchors.facility)
 
-    site_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Sites/auc:Site'
-    tree.xpath(site_xpath, namespaces=NAMESPACES)[0].set('ID', 'SiteID')
+    anchors.site.set('ID', 'SiteID')
+    changes.element_changed(anchors.site)
 
     # IdentifierLabel for Assessor parcel number must be changed to City Custom Building ID
     # first remove any existing City Custom Building ID
-    existing_custom_id_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Sites/auc:Site/auc:Buildings/auc:Building/auc:PremisesIdentifiers/auc:PremisesIdentifier[auc:IdentifierCustomName="City Custom Building ID"]'
-    existing_custom_id_elem = tree.xpath(existing_custom_id_xpath, namespaces=NAMESPACES)
+    existing_custom_id_elem = xpaths.ALL_PREMISES_IDENTIFIERS_WITH_CUSTOM_NAME(tree, name='City Custom Building ID')
     if existing_custom_id_elem:
         existing_custom_id_elem = existing_custom_id_elem[0]
+        changes.element_changed(existing_custom_id_elem.getparent())
         existing_custom_id_elem.getparent().remove(existing_custom_id_elem)
     # Now change assessor parcel number to custom building id
-    premise_id_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Sites/auc:Site/auc:Buildings/auc:Building/auc:PremisesIdentifiers/auc:PremisesIdentifier[auc:IdentifierLabel="Assessor parcel number"]'
-    premise_id_elem = tree.xpath(premise_id_xpath, namespaces=NAMESPACES)
+    premise_id_elem = xpaths.ALL_PREMISES_IDENTIFIERS_WITH_LABEL(tree, label='Assessor parcel number')
     if premise_id_elem:
         premise_id_elem = premise_id_elem[0]
         id_name = etree.Element(f'{{{BUILDINGSYNC_URI}}}IdentifierCustomName')
         id_name.text = 'City Custom Building ID'
-        add_child_to_element(premise_id_elem, id_name, tree, schema)
+        add_child_to_element(premise_id_elem, id_name, tree, schema_index)
         # change IdentifierLabel to custom
-        id_label = premise_id_elem.xpath('auc:IdentifierLabel', namespaces=NAMESPACES)
+        id_label = xpaths.IDENTIFIER_LABEL(premise_id_elem)
         id_label[0].text = 'Custom'
         # strip the SF prefix
-        id_value = premise_id_elem.xpath('auc:IdentifierValue', namespaces=NAMESPACES)
+        id_value = xpaths.IDENTIFIER_VALUE(premise_id_elem)
         id_value[0].text = id_value[0].text.lstrip('SF')
+        changes.subtree_changed(premise_id_elem)
 
     # add ID to package of measures (required)
-    pom_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Reports/auc:Report/auc:Scenarios/auc:Scenario/auc:ScenarioType/auc:PackageOfMeasures'
     id_number = 0
-    for pom_elem in tree.xpath(pom_xpath, namespaces=NAMESPACES):
+    for pom_elem in xpaths.ALL_PACKAGES_OF_MEASURES(tree):
         pom_elem.set('ID', f'PackageOfMeasures_ID_{id_number}')
+        changes.element_changed(pom_elem)
         id_number += 1
 
     # add ID to scenario
-    scenario_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Reports/auc:Report/auc:Scenarios/auc:Scenario'
     id_number = 0
-    for scenario_elem in tree.xpath(scenario_xpath, namespaces=NAMESPACES):
+    for scenario_elem in xpaths.ALL_SCENARIOS(tree):
         if not scenario_elem.get('ID'):
             scenario_elem.set('ID', f'Scenario_ID_{id_number}')
+            changes.element_changed(scenario_elem)
             id_number += 1
 
     # make all AnnualSavingsCost >= 0
-    asc_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Reports/auc:Report/auc:Scenarios/auc:Scenario/auc:ScenarioType/auc:PackageOfMeasures/auc:AnnualSavingsCost'
-    for asc_elem in tree.xpath(asc_xpath, namespaces=NAMESPACES):
+    for asc_elem in xpaths.ALL_ANNUAL_SAVINGS_COSTS(tree):
         if int(asc_elem.text) < 0:
             asc_elem.text = '0'
+            changes.subtree_changed(asc_elem)
 
 
     # add id to Report
-    report_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Reports/auc:Report'
-    report_element = tree.xpath(report_xpath, namespaces=NAMESPACES)[0]
-    report_element.set('ID', 'Report_ID_0')
+    anchors.report.set('ID', 'Report_ID_0')
+    changes.element_changed(anchors.report)
 
     # add premises identifiers to auc:Site
-    site_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Sites/auc:Site'
-    site_elem = tree.xpath(site_xpath, namespaces=NAMESPACES)[0]
     pids_elem = etree.Element(f'{{{BUILDINGSYNC_URI}}}PremisesIdentifiers')
     pid_elem = etree.SubElement(pids_elem, f'{{{BUILDINGSYNC_URI}}}PremisesIdentifier')
     etree.SubElement(pid_elem, f'{{{BUILDINGSYNC_URI}}}IdentifierLabel').text = 'Custom'
     etree.SubElement(pid_elem, f'{{{BUILDINGSYNC_URI}}}IdentifierCustomName').text = 'Borough'
     etree.SubElement(pid_elem, f'{{{BUILDINGSYNC_URI}}}IdentifierValue').text = '18749'
-    add_child_to_element(site_elem, pids_elem, tree, schema)
+    add_child_to_element(anchors.site, pids_elem, tree, schema_index)
+    changes.subtree_changed(pids_elem)
+    changes.element_changed(anchors.site)
 
     # fix the Section type so the type is Space function
-    section_xpath = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Sites/auc:Site/auc:Buildings/auc:Building/auc:Sections/auc:Section'
-    section_elem = tree.xpath(section_xpath, namespaces=NAMESPACES)[0]
-    type_xpath = 'auc:SectionType'
-    type_elem = section_elem.xpath(type_xpath, namespaces=NAMESPACES)
+    section_elem = xpaths.ALL_SECTIONS(tree)[0]
+    type_elem = xpaths.SECTION_TYPE(section_elem)
     if type_elem:
         type_elem[0].text = 'Space function'
+        changes.subtree_changed(type_elem[0])
     else:
         type_elem = etree.Element(f'{{{BUILDINGSYNC_URI}}}SectionType')
         type_elem.text = 'Space function'
-        add_child_to_element(section_elem, type_elem, tree, schema)
+        add_child_to_element(section_elem, type_elem, tree, schema_index)
+        changes.subtree_changed(type_elem)
+        changes.element_changed(section_elem)
+    lap('fix_ATT.ny_use_case')
+
+
+def validate_tree(tree, changes, validation):
+    """Validates a tree fixed by fix_tree
+
+    :param changes: subtree_validation.ChangeTracker, the changes recorded by fix_tree
+    :param validation: str, one of VALIDATION_MODES, or None to not validate
+    :return: list, the errors (see subtree_validation), or None if not validated
+    """
+    if validation is None:
+        return None
+    if validator is None:
+        raise Exception('init_worker must be called with the validation mode to validate the fixed files')
+    if validation == 'full':
+        return validator.validate_document(tree)
+    return validator.validate_changes(tree, changes)
+
+
+def fix_file(source, save_dir, stream=False, data=None, writer=None, validation=None):
+    """Fixes a file and saves it into save_dir
+
+    The fixed file is written through a temporary file, so it only exists once it is complete
+
+    :param source: str, path to the file
+    :param save_dir: str, directory to save the fixed file to
+    :param stream: bool, if True the bulky Scenario subtrees (TimeSeriesData and
+        ResourceUses) are streamed from the source to the output instead of being
+        loaded into memory. The output isn't pretty printed in this mode
+    :param data: bytes, content of the file if it was already read, e.g. by file_io.prefetch
+    :param writer: file_io.BackgroundWriter, if given the fixed file is written in the
+        background by it. Not used with stream
+    :param validation: str, one of VALIDATION_MODES to validate the fixed tree before it
+        is written, see validate_tree. Only 'subtrees' can be used with stream, since the
+        streamed subtrees aren't in the tree
+    :return: list, the validation errors of the fixed file, or None if not validated
+    """
+    save_path = os.path.join(save_dir, os.path.basename(source))
+    with instrumentation.timed_file(source):
+        if stream:
+            if validation == 'full':
+                raise Exception('Streamed files can only be validated with the subtrees validation mode')
+            with streaming.Spool(transform=units.SpooledUnitConverter()) as spool:
+                with instrumentation.step('parse'):
+                    tree = streaming.parse(source, spool, remove_blank_text=True)
+                changes = ChangeTracker()
+                fix_tree(tree, changes)
+                errors = validate_tree(tree, changes, validation)
+                with instrumentation.step('write'), open_atomic(save_path) as output:
+                    streaming.write(tree, output, spool)
+            return errors
+
+        if data is None:
+            with instrumentation.step('read'), open(source, 'rb') as f:
+                data = f.read()
+        result, errors = _fix_data(data, validation)
+
+        # -- SAVE THE RESULT!
+        with instrumentation.step('write'):
+            if writer is not None:
+                writer.write(save_path, result)
+            else:
+                write_atomic(save_path, result)
+        return errors
+
+
+def fix_data(data):
+    """Fixes the content of a file in memory, returning the pretty printed result as bytes"""
+    return _fix_data(data, None)[0]
+
+
+def _fix_data(data, validation):
+    with instrumentation.step('parse'):
+        tree = etree.parse(BytesIO(data), _parser())
+    changes = ChangeTracker()
+    fix_tree(tree, changes)
+    errors = validate_tree(tree, changes, validation)
+    with instrumentation.step('serialize'):
+        return etree.tostring(tree, pretty_print=True), errors
+
+
+def process_file(bsync_file, save_dir, stream=False, content=None, writer=None, validation=None):
+    """Fixes a single file, returning the traceback as a string if it failed
+
+    :param content: Future, result of reading the file, from file_io.prefetch
+    :param writer: file_io.BackgroundWriter, see fix_file
+    :param validation: str, see fix_file
+    :return: tuple, (bsync_file, None, validation errors) on success or (bsync_file,
+        traceback, None) on failure. The validation errors are None if not validated
+    """
+    try:
+        data = content.result() if content is not None else None
+        errors = fix_file(bsync_file, save_dir, stream=stream, data=data, writer=writer, validation=validation)
+    except Exception:
+        return bsync_file, traceback.format_exc(), None
+    return bsync_file, None, errors
+
+
+def _process_file_args(args):
+    # the worker's instrumentation data is sent back with each result
+    return process_file(*args) + (instrumentation.collect(),)
+
+
+def process_files(
+    files, save_dir, jobs=1, stream=False, io_threads=4, validation=None, dedup_paths=()
+):
+    """Fixes files, distributing them across a pool of jobs processes if jobs > 1
+
+    Files are scheduled largest first so that big files don't end up as stragglers.
+    Without a pool, the next files are read while the current one is fixed and the
+    fixed files are written in the background by io_threads threads (unless streaming).
+
+    :param files: list, paths to the files to fix
+    :param save_dir: str, directory to save the fixed files to
+    :param jobs: int, number of worker processes
+    :param stream: bool, stream the bulky subtrees of the files, see fix_file
+    :param io_threads: int, number of reader and writer threads, 0 to read and write
+        in the main thread
+    :param validation: str, one of VALIDATION_MODES to validate the fixed files, see fix_file
+    :param dedup_paths: iterable, XPaths of the parents whose duplicated children are removed, see init_worker
+    :return: tuple, (failures, invalid) where failures is the traceback for each file that
+        failed and invalid the validation errors of each fixed file which has any, both
+        keyed by file path
+    """
+    files = sorted(files, key=os.path.getsize, reverse=True)
+    failures = {}
+    invalid = {}
+    if jobs > 1:
+        # workers are instrumented if this process is, and their data is merged into it
+        recorder = instrumentation.enable() if instrumentation.is_enabled() else None
+        with Pool(jobs, initializer=init_worker, initargs=(SCHEMA_PATH, recorder is not None, validation, dedup_paths)) as pool:
+            results = pool.imap_unordered(
+                _process_file_args, [(f, save_dir, stream, None, None, validation) for f in files]
+            )
+            for bsync_file, error, errors, profile in results:
+                if profile is not None:
+                    recorder.merge(profile)
+                if error is not None:
+                    failures[bsync_file] = error
+                if errors:
+                    invalid[bsync_file] = errors
+                print('.' if error is None else 'F', end='', flush=True)
+    else:
+        init_worker(validation=validation, dedup_paths=dedup_paths)
+        overlap_io = io_threads > 0 and not stream
+        contents = prefetch(files, threads=io_threads) if overlap_io else ((f, None) for f in files)
+        writer = BackgroundWriter(threads=io_threads) if overlap_io else None
+        for bsync_file, content in contents:
+            _, error, errors = process_file(
+                bsync_file, save_dir, stream=stream, content=content, writer=writer, validation=validation
+            )
+            if error is not None:
+                failures[bsync_file] = error
+            if errors:
+                invalid[bsync_file] = errors
+            print('.' if error is None else 'F', end='', flush=True)
+        if writer is not None:
+            writer.close()
+            sources = {os.path.join(save_dir, os.path.basename(f)): f for f in files}
+            for save_path, error in writer.errors.items():
+                failures[sources[save_path]] = error
+                invalid.pop(sources[save_path], None)
+                print('F', end='', flush=True)
+
+    return failures, invalid
 
-    # -- SAVE THE RESULT!
-    result = etree.tostring(tree, pretty_print=True).decode()
-    with open(os.path.join(save_dir, os.path.basename(source)), 'w') as f:
-        f.write(result)
 
 if __name__ == '__main__':
-    source_dir = os.sys.argv[1]
+    arg_parser = argparse.ArgumentParser(description='Fix BuildingSync v2.0 files for Audit Template Tool')
+    arg_parser.add_argument('source_dir', help='directory of BuildingSync v2.0 files')
+    arg_parser.add_argument('--reprocess', action='store_true', help='overwrite files that were already processed')
+    arg_parser.add_argument('--jobs', type=int, default=1, help='number of worker processes to use')
+    arg_parser.add_argument(
+        '--stream', action='store_true',
+        help='stream TimeSeriesData and ResourceUses instead of loading them into memory (for very large files)'
+    )
+    arg_parser.add_argument(
+        '--io-threads', type=int, default=4,
+        help='number of threads reading files ahead and writing the fixed files in the background (0 to read and '
+             'write them in the main thread), only used without --jobs and --stream'
+    )
+    arg_parser.add_argument(
+        '--manifest', help='manifest written by classify.py, files it classifies as v0.3 or unparseable are skipped'
+    )
+    arg_parser.add_argument(
+        '--validate', choices=VALIDATION_MODES,
+        help='validate each fixed file before writing it, either only the elements the fixes changed (subtrees, '
+             'see subtree_validation.py) or the whole document (full, not with --stream). The errors are written '
+             'to <output dir>_validation_errors.json'
+    )
+    arg_parser.add_argument(
+        '--dedup', action='store_true',
+        help='remove the duplicated children of Measures, ResourceUses and AnnualSavingsByFuels, see dedup.py'
+    )
+    arg_parser.add_argument(
+        '--dedup-path', action='append', dest='dedup_paths',
+        help='XPath of parents whose duplicated children are removed, instead of those of --dedup, can be repeated'
+    )
+    arg_parser.add_argument('--profile', help='record the time taken by each step and file, and write a report to this json file')
+    args = arg_parser.parse_args()
+    if args.stream and args.validate == 'full':
+        arg_parser.error('--validate full can\'t be used with --stream, use --validate subtrees')
+    dedup_paths = args.dedup_paths or (dedup.DEFAULT_PARENT_PATHS if args.dedup else ())
+    if args.profile:
+        recorder = instrumentation.enable()
+    source_dir = args.source_dir
 
     # determine if we should skip or reprocess files
-    reprocess = False
-    if len(os.sys.argv) == 3:
-        if os.sys.argv[2] == '--reprocess':
-            reprocess = True
+    reprocess = args.reprocess
     save_dir = source_dir.rstrip('/') + '_ATT'
     if os.path.exists(save_dir):
         if reprocess:
@@ -289,16 +537,48 @@ if __name__ == '__main__':
         print(f'Creating output directory {save_dir}')
         os.mkdir(save_dir)
     print('Fixing files for Audit Template Tool')
+    manifest = classify.load_manifest(args.manifest) if args.manifest else {}
+    files_to_process = []
+    n_skipped = 0
+    n_unfixable = 0
     for bsync_file in glob.glob(os.path.join(source_dir, '*.xml')):
         filename = os.path.basename(bsync_file)
 
         if not reprocess and os.path.exists(os.path.join(save_dir, filename)):
             # skip this file if we aren't reprocessing and it already exists
-            print('S', end='', flush=True)
+            n_skipped += 1
+            continue
+        if classify.is_unfixable(manifest, filename):
+            n_unfixable += 1
             continue
-        try:
-            fix_file(bsync_file, save_dir)
-        except Exception as e:
-            print(f'\nUnexpected error processing {bsync_file}: {str(e)}')
-            print(traceback.format_exc())
-        print('.', end='', flush=True)
+        files_to_process.append(bsync_file)
+
+    if manifest:
+        print(f'Skipped {n_unfixable} files the manifest classifies as v0.3 or unparseable')
+    print(f'Skipped {n_skipped} already processed files, processing {len(files_to_process)} files with {args.jobs} job(s)')
+    failures, invalid = process_files(
+        files_to_process, save_dir, jobs=args.jobs, stream=args.stream, io_threads=args.io_threads,
+        validation=args.validate, dedup_paths=dedup_paths
+    )
+
+    # report all failures at the end so they aren't interleaved with progress
+    for bsync_file, error in sorted(failures.items()):
+        print(f'\n\nUnexpected error processing {bsync_file}:')
+        print(error)
+    print('\n\n========  DONE  ========')
+    print(f'Processed {len(files_to_process) - len(failures)} files, {len(failures)} failed')
+    if failures:
+        print('Failed files:')
+        for bsync_file in sorted(failures):
+            print(f'  {bsync_file}')
+    if args.validate:
+        validation_errors_path = save_dir + '_validation_errors.json'
+        write_atomic(validation_errors_path, json.dumps(
+            {os.path.basename(bsync_file): errors for bsync_file, errors in sorted(invalid.items())}, indent=2
+        ).encode())
+        print(f'{len(invalid)} fixed files have validation errors ({args.validate}), see {validation_errors_path}')
+    if args.profile:
+        print()
+        print(instrumentation.format_report(recorder))
+        instrumentation.write_report(recorder, args.profile)
+        print(f'Profile saved to {args.profile}')
@@ -0,0 +1,240 @@
+"""Generates synthetic BRICR-style BuildingSync files for benchmarking
+
+The files have the structure of the BRICR files the transformations were written
+for, and the number of Measures, Scenarios, duplicated PackageOfMeasures children
+and TimeSeriesData readings can be scaled independently. Each of the BRICR defects
+fixed by fix_2_0.py can be switched on or off; the defects are named after the keys
+of fix_2_0.error_fixes_map:
+- starttimestamp: TimeSeries use StartTimeStamp instead of StartTimestamp
+- calculationmethod: PackageOfMeasures and Scenario children are out of order and
+  PackageOfMeasures has duplicated children
+- subsections: the Building has Subsections instead of Sections
+- report: Report isn't nested in Reports
+- primarylightingsystemtype: LightingSystems have a PrimaryLightingSystemType
+- occupancyclassification: OccupancyClassification is Hotel instead of Lodging
+
+Files are written incrementally, so generating files with millions of readings
+doesn't need much memory.
+"""
+import os
+import argparse
+import random
+
+from lxml import etree
+
+from utils import BUILDINGSYNC_URI
+
+DEFECTS = (
+    'starttimestamp',
+    'calculationmethod',
+    'subsections',
+    'report',
+    'primarylightingsystemtype',
+    'occupancyclassification',
+)
+
+# presets for the size of the corpus and of each file
+SCALES = {
+    'small': {'files': 20, 'measures': 5, 'scenarios': 3, 'duplicates': 1, 'readings': 24},
+    'medium': {'files': 50, 'measures': 50, 'scenarios': 10, 'duplicates': 2, 'readings': 720},
+    'large': {'files': 10, 'measures': 200, 'scenarios': 30, 'duplicates': 4, 'readings': 8760},
+}
+
+ENERGY_RESOURCES = ('Electricity', 'Natural gas')
+
+XSI_URI = 'http://www.w3.org/2001/XMLSchema-instance'
+BRICR_SCHEMA_LOCATION = 'http://buildingsync.net/schemas/bedes-auc/2019 https://raw.githubusercontent.com/BuildingSync/schema/v1.0.0/BuildingSync.xsd'
+
+
+def _tag(name):
+    return f'{{{BUILDINGSYNC_URI}}}{name}'
+
+
+def _leaf(xf, name, text, **attrib):
+    with xf.element(_tag(name), attrib):
+        if text is not None:
+            xf.write(text)
+
+
+def _write_site(xf, defects):
+    with xf.element(_tag('Sites')), xf.element(_tag('Site')):
+        with xf.element(_tag('Address')):
+            _leaf(xf, 'City', 'San Francisco')
+        with xf.element(_tag('Buildings')), xf.element(_tag('Building'), ID='Building-1'):
+            _leaf(xf, 'PremisesName', 'Synthetic building')
+            with xf.element(_tag('PremisesIdentifiers')), xf.element(_tag('PremisesIdentifier')):
+                _leaf(xf, 'IdentifierLabel', 'Assessor parcel number')
+                _leaf(xf, 'IdentifierValue', 'SF1234567')
+            occupancy = 'Hotel' if 'occupancyclassification' in defects else 'Lodging'
+            _leaf(xf, 'OccupancyClassification', occupancy)
+            _leaf(xf, 'FloorsAboveGrade', '3')
+            _leaf(xf, 'FloorsBelowGrade', '1')
+            section = 'Subsection' if 'subsections' in defects else 'Section'
+            with xf.element(_tag(f'{section}s')), xf.element(_tag(section), ID='Section-1'):
+                _leaf(xf, 'OccupancyClassification', occupancy)
+
+
+def _write_systems(xf, defects):
+    with xf.element(_tag('Systems')), xf.element(_tag('LightingSystems')):
+        with xf.element(_tag('LightingSystem'), ID='LightingSystem-1'):
+            if 'primarylightingsystemtype' in defects:
+                _leaf(xf, 'PrimaryLightingSystemType', 'T8')
+            _leaf(xf, 'LampType', 'Linear T8')
+
+
+def _write_measures(xf, n_measures):
+    with xf.element(_tag('Measures')):
+        for i in range(n_measures):
+            with xf.element(_tag('Measure'), ID=f'Measure-{i}'):
+                _leaf(xf, 'LongDescription', f'Measure {i}')
+
+
+def _write_package_of_measures(xf, rng, n_measures, n_duplicates, defects):
+    measure_ids = rng.sample(range(n_measures), min(n_measures, 3))
+
+    def write_measure_ids():
+        with xf.element(_tag('MeasureIDs')):
+            for i in measure_ids:
+                _leaf(xf, 'MeasureID', None, IDref=f'Measure-{i}')
+
+    def write_savings():
+        with xf.element(_tag('AnnualSavingsByFuels')):
+            for resource in ENERGY_RESOURCES:
+                with xf.element(_tag('AnnualSavingsByFuel')):
+                    _leaf(xf, 'EnergyResource', resource)
+                    _leaf(xf, 'ResourceUnits', 'kBtu')
+                    _leaf(xf, 'AnnualSavingsNativeUnits', str(rng.randint(1, 100000)))
+
+    source_energy = str(rng.randint(1, 1000))
+    cost = str(rng.randint(-500, 5000))
+    with xf.element(_tag('ScenarioType')), xf.element(_tag('PackageOfMeasures')):
+        if 'calculationmethod' in defects:
+            # out of order, with consecutive duplicates
+            _leaf(xf, 'AnnualSavingsCost', cost)
+            for _ in range(1 + n_duplicates):
+                _leaf(xf, 'CalculationMethod', 'Modeled')
+            write_measure_ids()
+            for _ in range(1 + n_duplicates):
+                _leaf(xf, 'AnnualSavingsSourceEnergy', source_energy)
+            write_savings()
+        else:
+            write_measure_ids()
+            _leaf(xf, 'CalculationMethod', 'Modeled')
+            _leaf(xf, 'AnnualSavingsSourceEnergy', source_energy)
+            _leaf(xf, 'AnnualSavingsCost', cost)
+            write_savings()
+
+
+def _write_resource_uses(xf, scenario_id):
+    with xf.element(_tag('ResourceUses')):
+        for i, resource in enumerate(ENERGY_RESOURCES):
+            with xf.element(_tag('ResourceUse'), ID=f'{scenario_id}-ResourceUse-{i}'):
+                _leaf(xf, 'EnergyResource', resource)
+                _leaf(xf, 'ResourceUnits', 'kBtu')
+                _leaf(xf, 'AnnualFuelUseNativeUnits', '1000')
+
+
+def _write_time_series_data(xf, rng, scenario_id, n_readings, defects):
+    start_tag = 'StartTimeStamp' if 'starttimestamp' in defects else 'StartTimestamp'
+    with xf.element(_tag('TimeSeriesData')):
+        for i in range(n_readings):
+            with xf.element(_tag('TimeSeries'), ID=f'{scenario_id}-TimeSeries-{i}'):
+                day, hour = divmod(i, 24)
+                _leaf(xf, start_tag, f'2019-{1 + day // 28 % 12:02}-{1 + day % 28:02}T{hour:02}:00:00')
+                _leaf(xf, 'IntervalReading', f'{rng.uniform(0, 100):.3f}')
+                _leaf(xf, 'ResourceUseID', None, IDref=f'{scenario_id}-ResourceUse-{i % len(ENERGY_RESOURCES)}')
+
+
+def _write_report(xf, rng, n_measures, n_scenarios, n_duplicates, n_readings, defects):
+    with xf.element(_tag('Scenarios')):
+        for i in range(n_scenarios):
+            scenario_id = f'Scenario-{i}'
+            with xf.element(_tag('Scenario'), ID=scenario_id):
+                _write_package_of_measures(xf, rng, n_measures, n_duplicates, defects)
+                if 'calculationmethod' in defects:
+                    # ResourceUses after TimeSeriesData, validation reports them as ResourceUses
+                    # errors like in the BRICR files, rather than as errors of another element
+                    _write_time_series_data(xf, rng, scenario_id, n_readings, defects)
+                    _write_resource_uses(xf, scenario_id)
+                else:
+                    _write_resource_uses(xf, scenario_id)
+                    _write_time_series_data(xf, rng, scenario_id, n_readings, defects)
+
+
+def write_file(output, measures=5, scenarios=3, duplicates=1, readings=24, defects=DEFECTS, seed=0):
+    """Writes a synthetic BRICR-style BuildingSync file
+
+    :param output: str or file, where to write the file
+    :param measures: int, number of Measures
+    :param scenarios: int, number of Scenarios, each with a PackageOfMeasures
+    :param duplicates: int, number of duplicates of the duplicated PackageOfMeasures children
+        (only used with the calculationmethod defect)
+    :param readings: int, number of TimeSeries in each Scenario's TimeSeriesData
+    :param defects: iterable, names of the BRICR defects to include, see DEFECTS
+    :param seed: int, seed for the generated values
+    """
+    unknown = set(defects) - set(DEFECTS)
+    if unknown:
+        raise Exception(f'Unknown defects: {sorted(unknown)}')
+    rng = random.Random(seed)
+    measures = max(measures, 1)
+
+    with etree.xmlfile(output, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element(
+            _tag('BuildingSync'),
+            {f'{{{XSI_URI}}}schemaLocation': BRICR_SCHEMA_LOCATION},
+            nsmap={'auc': BUILDINGSYNC_URI, 'xsi': XSI_URI}
+        ):
+            with xf.element(_tag('Facilities')), xf.element(_tag('Facility')):
+                _write_site(xf, defects)
+                _write_systems(xf, defects)
+                _write_measures(xf, measures)
+                if 'report' in defects:
+                    with xf.element(_tag('Report')):
+                        _write_report(xf, rng, measures, scenarios, duplicates, readings, defects)
+                else:
+                    with xf.element(_tag('Reports')), xf.element(_tag('Report')):
+                        _write_report(xf, rng, measures, scenarios, duplicates, readings, defects)
+
+
+def generate_corpus(directory, files=20, defects=DEFECTS, seed=0, **file_options):
+    """Writes a corpus of synthetic files into directory
+
+    :param directory: str, created if it doesn't exist
+    :param files: int, number of files
+    :param defects: iterable, names of the BRICR defects to include, see DEFECTS
+    :param seed: int, seed for the corpus, each file gets its own seed derived from it
+    :param file_options: passed to write_file (measures, scenarios, duplicates, readings)
+    :return: list, paths to the generated files
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(files):
+        path = os.path.join(directory, f'synthetic_{i:05}.xml')
+        write_file(path, defects=defects, seed=seed * 1000003 + i, **file_options)
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Generate synthetic BRICR-style BuildingSync files')
+    arg_parser.add_argument('directory', help='directory to write the files to')
+    arg_parser.add_argument('--scale', choices=sorted(SCALES), default='small', help='preset for the options below')
+    for option in ('files', 'measures', 'scenarios', 'duplicates', 'readings'):
+        arg_parser.add_argument(f'--{option}', type=int, help=f'number of {option}, overrides the scale preset')
+    arg_parser.add_argument(
+        '--defects', default=','.join(DEFECTS),
+        help=f'comma separated BRICR defects to include (default: all), any of {",".join(DEFECTS)}'
+    )
+    arg_parser.add_argument('--seed', type=int, default=0, help='seed for the generated values')
+    args = arg_parser.parse_args()
+
+    options = dict(SCALES[args.scale])
+    for option in options:
+        if getattr(args, option) is not None:
+            options[option] = getattr(args, option)
+    defects = [defect for defect in args.defects.split(',') if defect]
+
+    paths = generate_corpus(args.directory, defects=defects, seed=args.seed, **options)
+    print(f'Generated {len(paths)} files in {args.directory}')
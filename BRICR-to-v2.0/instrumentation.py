@@ -0,0 +1,201 @@
+"""Opt-in timing and call counts of the steps of the transformations
+
+Instrumentation is disabled unless enable() is called, in which case every timed
+step records its wall time and call count in the process' Recorder. Steps are
+named, e.g. 'parse', 'fix_2_0.rules' or 'utils.add_child_to_element', and
+nested steps are included in the time of the steps they run in. When disabled, a
+timed step costs a single check of a global.
+
+Pool workers call enable() in their initializer and send collect() back with each
+result so the parent can merge() them into its own Recorder, then write_report().
+"""
+import bisect
+import functools
+import json
+import time
+
+# upper bounds of the buckets of the per-step histograms, in seconds
+HISTOGRAM_BOUNDS = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1, 10)
+HISTOGRAM_LABELS = ('<10us', '<100us', '<1ms', '<10ms', '<100ms', '<1s', '<10s', '>=10s')
+
+# the Recorder of the current process, None when disabled
+_recorder = None
+
+
+class Recorder:
+    """Wall time, call counts and duration histograms of steps, and the time taken by each file"""
+    def __init__(self):
+        # step name -> [calls, seconds, histogram]
+        self.steps = {}
+        # file -> seconds
+        self.files = {}
+
+    def record(self, step, seconds):
+        stats = self.steps.get(step)
+        if stats is None:
+            stats = self.steps[step] = [0, 0.0, [0] * len(HISTOGRAM_LABELS)]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2][bisect.bisect_right(HISTOGRAM_BOUNDS, seconds)] += 1
+
+    def record_file(self, file, seconds):
+        self.files[file] = self.files.get(file, 0.0) + seconds
+
+    def merge(self, data):
+        """Adds the data of another Recorder, as returned by to_dict"""
+        for step, (calls, seconds, histogram) in data['steps'].items():
+            stats = self.steps.get(step)
+            if stats is None:
+                stats = self.steps[step] = [0, 0.0, [0] * len(HISTOGRAM_LABELS)]
+            stats[0] += calls
+            stats[1] += seconds
+            stats[2] = [a + b for a, b in zip(stats[2], histogram)]
+        for file, seconds in data['files'].items():
+            self.record_file(file, seconds)
+
+    def to_dict(self):
+        return {'steps': self.steps, 'files': self.files}
+
+
+class _Step:
+    __slots__ = ('recorder', 'name', 'start')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.record(self.name, time.perf_counter() - self.start)
+
+
+class _File(_Step):
+    __slots__ = ()
+
+    def __exit__(self, *exc_info):
+        self.recorder.record_file(self.name, time.perf_counter() - self.start)
+
+
+class _NullStep:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_STEP = _NullStep()
+
+
+def enable():
+    """Enables instrumentation in the current process, returning its Recorder"""
+    global _recorder
+    if _recorder is None:
+        _recorder = Recorder()
+    return _recorder
+
+
+def disable():
+    global _recorder
+    _recorder = None
+
+
+def is_enabled():
+    return _recorder is not None
+
+
+def step(name):
+    """Returns a context manager which records the time taken by its block as the step name"""
+    if _recorder is None:
+        return _NULL_STEP
+    return _Step(_recorder, name)
+
+
+def timed_file(name):
+    """Returns a context manager which records the time taken by its block for the file name"""
+    if _recorder is None:
+        return _NULL_STEP
+    return _File(_recorder, name)
+
+
+def timed(name):
+    """Decorator recording each call of a function as the step name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return func(*args, **kwargs)
+            with _Step(_recorder, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def laps():
+    """Returns a function which records the time since it was last called (or since laps
+    was called) as the step it is given, for timing consecutive sections of a function
+    """
+    recorder = _recorder
+    if recorder is None:
+        return _no_lap
+
+    last = [time.perf_counter()]
+
+    def lap(name):
+        now = time.perf_counter()
+        recorder.record(name, now - last[0])
+        last[0] = now
+
+    return lap
+
+
+def _no_lap(name):
+    pass
+
+
+def collect():
+    """Returns the data recorded since the last collect and resets it, or None if disabled
+
+    Used by pool workers to send their data with each result
+    """
+    global _recorder
+    if _recorder is None:
+        return None
+    data = _recorder.to_dict()
+    _recorder = Recorder()
+    return data
+
+
+def format_report(recorder, top_n=10):
+    """Formats the steps, sorted by their total time, and the top_n slowest files"""
+    lines = [f'{"step":<40}{"calls":>10}{"total s":>12}{"mean ms":>10}  histogram ({" ".join(HISTOGRAM_LABELS)})']
+    for name, (calls, seconds, histogram) in sorted(recorder.steps.items(), key=lambda item: -item[1][1]):
+        lines.append(
+            f'{name:<40}{calls:>10}{seconds:>12.3f}{seconds / calls * 1000:>10.3f}  {" ".join(map(str, histogram))}'
+        )
+
+    slowest = sorted(recorder.files.items(), key=lambda item: -item[1])[:top_n]
+    if slowest:
+        lines.append(f'\n{len(slowest)} slowest of {len(recorder.files)} files:')
+        lines.extend(f'{seconds:>10.3f}s  {file}' for file, seconds in slowest)
+    return '\n'.join(lines)
+
+
+def write_report(recorder, path, top_n=10):
+    """Writes the recorded data as json, with the steps and the top_n slowest files summarized"""
+    report = {
+        'histogram_labels': HISTOGRAM_LABELS,
+        'steps': {
+            name: {'calls': calls, 'seconds': seconds, 'histogram': histogram}
+            for name, (calls, seconds, histogram) in recorder.steps.items()
+        },
+        'slowest_files': sorted(recorder.files.items(), key=lambda item: -item[1])[:top_n],
+        'files': recorder.files,
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
@@ -1,25 +1,27 @@
+import argparse
 import glob
 import os
 import json
 
-def get_errors(file):
+def iter_errors(file):
+    """yields the split lines of an error file which describe an error"""
     with open(file, 'r') as f:
-        lines = f.readlines()
-        # don't look at last line, it's just 
-        processed_lines = []
-        for line in lines:
+        for line in f:
             split_line = line.split(': ')
-            
+
             # skip lines that aren't describing an error
             if len(split_line) <= 1:
                 continue
-            
-            processed_lines.append(split_line)
-        return processed_lines
+
+            yield split_line
+
+
+def get_errors(file):
+    return list(iter_errors(file))
 
 NOT_ELEMENT = 'NOT_ELEMENT'
-def update_errors(errors, error):
-    """adds an error to the errors dict"""
+def split_error(error):
+    """returns (filename, short_error, element_tag, error_details) for a split error line"""
     if len(error) == 4:
         filename, short_error, error_details, _ = error
         element_tag = NOT_ELEMENT
@@ -29,7 +31,23 @@ def update_errors(errors, error):
         print(error)
         raise Exception('Had lines ' + str(len(error)))
 
-    error_details = error_details.strip()
+    return filename, short_error, element_tag, error_details.strip()
+
+
+def split_filename(filename):
+    """returns (name, line) for the filename of an error, which looks like <path>:<linenumber>
+
+    line is None if the filename has no line number
+    """
+    name, _, line = filename.rpartition(':')
+    if line.isdigit():
+        return name, int(line)
+    return filename, None
+
+
+def update_errors(errors, error):
+    """adds an error to the errors dict"""
+    filename, short_error, element_tag, error_details = split_error(error)
     if short_error not in errors:
         # build the error description
         errors[short_error] = {}
@@ -84,9 +102,22 @@ def summarize_errors(directory, filesubset=None, errors=None):
     return errors
 
 if __name__ == '__main__':
-    # parse the errors and save as json
-    # usage: parse_errors.py <errors_dir> <json_filename>
-    errors = summarize_errors(os.sys.argv[1])
-    errors_json = json.dumps(errors, indent=2)
-    with open(os.sys.argv[2], 'w') as f:
-        f.write(errors_json)
+    # parse the errors and save as json, or as a compact summary (see error_summary.py)
+    # usage: parse_errors.py <errors_dir> <json_filename> [--compact]
+    arg_parser = argparse.ArgumentParser(description='Summarize a directory of validation errors')
+    arg_parser.add_argument('errors_dir', help='directory of validation errors')
+    arg_parser.add_argument('output', help='file to write the summary to')
+    arg_parser.add_argument(
+        '--compact', action='store_true',
+        help='write a compact summary which can be queried without loading it, see error_summary.py'
+    )
+    args = arg_parser.parse_args()
+    if args.compact:
+        from error_summary import iter_error_rows, write_summary
+
+        write_summary(args.output, iter_error_rows(args.errors_dir))
+    else:
+        errors = summarize_errors(args.errors_dir)
+        errors_json = json.dumps(errors, indent=2)
+        with open(args.output, 'w') as f:
+            f.write(errors_json)
@@ -0,0 +1,97 @@
+"""IDs of the elements which require one, as added by add-required-ids
+
+An element requires an ID if its path in the schema is that of an element with an ID
+attribute. The paths are found from the XSD with xmlschema, which is slow, so they are
+cached on disk like the schema_cache structures. add-required-ids/main.py and
+transform.add_ids both add the IDs with add_missing_ids.
+"""
+import os
+import pickle
+from uuid import uuid4
+
+from lxml import etree
+
+from file_io import write_atomic
+from schema_cache import CACHE_VERSION, file_digest, get_cache_dir
+from utils import BUILDINGSYNC_URI
+
+
+def load_elements_requiring_ids(schema_file):
+    """
+    Get the XPaths of the schema elements that have ID attributes. Loading the schema
+    is slow, so the result is cached on disk, keyed by the sha256 of the schema file
+
+    :param schema_file: Path to BuildingSync.xsd
+    :return: [(str, str)] XPath and local name of each schema element that has an ID attribute
+    """
+    cache_path = os.path.join(get_cache_dir(), f'ids-{file_digest(schema_file)}-v{CACHE_VERSION}.pickle')
+    try:
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    # only import xmlschema when the cache misses since importing it is slow
+    from xmlschema import XMLSchema
+    schema = XMLSchema(schema_file)
+
+    # very nice function - XPath in Schema file
+    elements_requiring_ids = [
+        # A nice method to return the full path to an element, so as to avoid
+        # finding elements such as auc:LinkedPremises/auc:Building
+        ("//" + el.get_path().replace(f"{{{BUILDINGSYNC_URI}}}", 'auc:'), el.local_name)
+        for el in schema.findall("//*[@ID]")
+    ]
+
+    # write through a temporary file so concurrent runs never read a partial cache
+    write_atomic(cache_path, pickle.dumps(elements_requiring_ids))
+
+    return elements_requiring_ids
+
+
+def index_elements_requiring_ids(elements_requiring_ids):
+    """
+    Turn the XPaths of the elements requiring IDs into lists of tags, grouped by the
+    tag of the element, so add_ids can match elements while walking the tree
+
+    :param elements_requiring_ids: [(str, str)] from load_elements_requiring_ids
+    :return: {str: [([str], str)]} tags of the path and local name of the schema element, by element tag
+    """
+    index = {}
+    for xp, local_name in elements_requiring_ids:
+        # the XPaths look like //auc:Foo/auc:Bar
+        path_tags = [
+            f"{{{BUILDINGSYNC_URI}}}{step.replace('auc:', '', 1)}"
+            for step in xp.lstrip('/').split('/')
+        ]
+        index.setdefault(path_tags[-1], []).append((path_tags, local_name))
+    return index
+
+
+def add_missing_ids(tree, ids_index):
+    """
+    Add unique ID attributes to all elements requiring one which don't have one
+
+    The tree is walked once; an element requires an ID if the tags of its ancestors
+    end with the path of one of the schema elements that have ID attributes
+
+    :param tree: ElementTree
+    :param ids_index: {str: [([str], str)]} from index_elements_requiring_ids
+    :return: int, number of IDs added
+    """
+    n_added = 0
+    tag_stack = []
+    for event, el in etree.iterwalk(tree, events=('start', 'end')):
+        if event == 'end':
+            tag_stack.pop()
+            continue
+
+        tag_stack.append(el.tag)
+        if 'ID' in el.attrib or el.tag not in ids_index:
+            continue
+        for path_tags, local_name in ids_index[el.tag]:
+            if tag_stack[-len(path_tags):] == path_tags:
+                el.set('ID', f"{local_name}-{uuid4()}")
+                n_added += 1
+                break
+    return n_added
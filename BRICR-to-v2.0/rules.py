@@ -0,0 +1,95 @@
+"""Fixes registered against element tags, applied in a single walk of the tree
+
+A Rule is a function of a single element, registered either for elements at given
+paths or for every element. A RuleSet walks the tree once and calls each element's
+rules, so applying many rules costs one traversal instead of one per rule.
+
+The walk visits elements in reverse document order, so each element is visited after
+all of its descendants and all of its following siblings. Rules can therefore remove
+or move the element they are called with, or add children to its parent, without
+affecting which elements are visited. Elements added by a rule aren't visited, and
+when an element's rules run its ancestors haven't been changed yet.
+"""
+from lxml import etree
+
+from utils import BUILDINGSYNC_URI
+
+
+class Rule:
+    """A fix applied to single elements
+
+    :param name: str, name used in error messages
+    :param apply: function, called with each matching element, modifies it in place
+    :param paths: list, paths of the elements to apply the rule to, each as a tuple
+        of local names of the BuildingSync elements from the root's child down to the
+        element, e.g. ('Facilities', 'Facility', 'Report'). If None the rule is
+        applied to every element
+    :param min_matches: int, the number of elements matching paths must be at least this
+    :param max_matches: int, the number of elements matching paths must be at most this
+    """
+    def __init__(self, name, apply, paths=None, min_matches=0, max_matches=None):
+        self.name = name
+        self.apply = apply
+        self.paths = None
+        if paths is not None:
+            self.paths = [tuple(f'{{{BUILDINGSYNC_URI}}}{step}' for step in path) for path in paths]
+        self.min_matches = min_matches
+        self.max_matches = max_matches
+
+
+def _matches_path(element, path):
+    """Returns True if the tags of the element's ancestors below the root are path[:-1]"""
+    for tag in reversed(path[:-1]):
+        element = element.getparent()
+        if element is None or element.tag != tag:
+            return False
+    parent = element.getparent()
+    return parent is not None and parent.getparent() is None
+
+
+class RuleSet:
+    """Rules dispatched during a single walk of a tree
+
+    Rules for every element run before rules for paths, in the order they were given.
+
+    :param rules: list, Rules
+    """
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.element_rules = [rule for rule in self.rules if rule.paths is None]
+        # tag -> [(rule, path)]
+        self.path_rules = {}
+        for rule in self.rules:
+            for path in rule.paths or ():
+                self.path_rules.setdefault(path[-1], []).append((rule, path))
+
+    def apply(self, tree, check=True):
+        """Applies the rules to a tree or to the subtree of an element
+
+        :param tree: ElementTree or Element
+        :param check: bool, raise an Exception if a rule matched too few or too many elements
+        :return: dict, number of elements each path rule was applied to, by rule name
+        """
+        element_rules = self.element_rules
+        path_rules = self.path_rules
+        matches = {rule.name: 0 for rule in self.rules if rule.paths is not None}
+        for element in reversed(list(tree.iter(etree.Element))):
+            for rule in element_rules:
+                rule.apply(element)
+            for rule, path in path_rules.get(element.tag, ()):
+                if _matches_path(element, path):
+                    matches[rule.name] += 1
+                    rule.apply(element)
+
+        if check:
+            for rule in self.rules:
+                if rule.paths is None:
+                    continue
+                n_matches = matches[rule.name]
+                if n_matches < rule.min_matches or (rule.max_matches is not None and n_matches > rule.max_matches):
+                    raise Exception(
+                        f'Expected {rule.name} to apply to between {rule.min_matches} and '
+                        f'{rule.max_matches if rule.max_matches is not None else "any number of"} elements, '
+                        f'but it applied to {n_matches}'
+                    )
+        return matches
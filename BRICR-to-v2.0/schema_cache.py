@@ -0,0 +1,82 @@
+"""Persistent on-disk cache of the structures derived from the BuildingSync schema
+
+Building an xmlschema.XMLSchema from the XSD takes seconds, so the SchemaIndex
+built from it is pickled into a cache directory, keyed by the sha256 of the XSD's
+content. Changing the XSD changes the key, so stale entries are never used.
+"""
+import hashlib
+import os
+import pickle
+
+from lxml import etree
+
+from file_io import write_atomic
+from utils import SchemaIndex
+
+# bump this when the layout of the cached structures changes
+CACHE_VERSION = 2
+
+
+def get_cache_dir():
+    """Returns the directory used for caching, creating it if necessary"""
+    cache_dir = os.environ.get(
+        'BSYNC_CACHE_DIR',
+        os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'bsync-transformations')
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def file_digest(path):
+    """Returns the sha256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SchemaData:
+    """The structures derived from a schema file
+
+    :param xsd_path: str, path to the XSD
+    :param digest: str, sha256 of the XSD's content
+    :param index: SchemaIndex, child order of the schema
+    """
+    def __init__(self, xsd_path, digest, index):
+        self.xsd_path = xsd_path
+        self.digest = digest
+        self.index = index
+        self._validator = None
+
+    @property
+    def validator(self):
+        """lxml.etree.XMLSchema for the XSD, compiled on first use
+
+        lxml's compiled schemas can't be serialized, but libxml2 compiles the XSD
+        quickly so it isn't worth caching
+        """
+        if self._validator is None:
+            self._validator = etree.XMLSchema(etree.parse(self.xsd_path))
+        return self._validator
+
+
+def load_schema(xsd_path):
+    """Returns the SchemaData for the XSD, from the cache if possible
+
+    :param xsd_path: str, path to the XSD
+    :return: SchemaData
+    """
+    digest = file_digest(xsd_path)
+    cache_path = os.path.join(get_cache_dir(), f'schema-{digest}-v{CACHE_VERSION}.pickle')
+    try:
+        with open(cache_path, 'rb') as f:
+            index = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        # only import xmlschema when the cache misses since importing it is slow
+        from xmlschema import XMLSchema
+
+        index = SchemaIndex(XMLSchema(xsd_path))
+        write_atomic(cache_path, pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL))
+
+    return SchemaData(xsd_path, digest, index)
@@ -0,0 +1,302 @@
+"""A long running HTTP service which transforms single documents, e.g. for each upload
+
+Running the scripts on a single file pays for importing lxml and xmlschema, loading
+the schema and compiling the validator and XPaths every time. The service does this
+once in each of its worker processes, and keeps them warm between requests.
+
+Each endpoint takes the document as the body of a POST request:
+- /validate: validates the document, responds with json {"valid": bool, "errors": [...]}
+- /fix-2.0: validates the document and applies the fixes for its errors (see
+  transform.fix_validation_errors), responds with the fixed document. The names of the fixes applied
+  are in the X-Fixes-Applied header, and X-Valid is false if errors without a fix
+  remain (see /validate)
+- /att: applies the Audit Template Tool fixes (see fix_ATT.py), responds with the
+  fixed document
+- /add-ids: adds an ID to the elements which require one, responds with the document.
+  The number of IDs added is in the X-IDs-Added header
+
+Documents which can't be transformed (malformed XML, or a document the transformations
+don't support) get a 422 response with json {"error": message}, other errors a 500.
+At most --max-pending requests are queued for the --jobs worker processes, others get
+a 503 response straight away. GET /metrics responds with the number of requests,
+latency histogram (see instrumentation) and latency percentiles of each endpoint.
+
+ServiceClient drives a running service, and the client command of this script sends a
+file to it, e.g.
+    python3 service.py serve schema_2_0.xsd --port 8080 --jobs 4
+    python3 service.py client http://localhost:8080 fix-2.0 file.xml --output fixed.xml
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from multiprocessing import Pool
+from socketserver import ThreadingMixIn
+
+from lxml import etree
+
+import instrumentation
+import transform
+
+ENDPOINTS = ('validate', 'fix-2.0', 'att', 'add-ids')
+
+# number of the most recent latencies of each endpoint the percentiles are computed from
+LATENCY_WINDOW = 1000
+PERCENTILES = (50, 90, 99)
+
+
+def handle(endpoint, data):
+    """Transforms a document, called in the worker processes
+
+    :param endpoint: str, one of ENDPOINTS
+    :param data: bytes, the document
+    :return: tuple, (status, content type, body, headers)
+    """
+    try:
+        if endpoint == 'validate':
+            errors = transform.validate(data)
+            body = json.dumps({'valid': not errors, 'errors': errors}).encode()
+            return 200, 'application/json', body, {}
+
+        if endpoint == 'fix-2.0':
+            result, rules, errors = transform.fix_validation_errors(data)
+            headers = {'X-Fixes-Applied': ','.join(rule.name for rule in rules), 'X-Valid': str(not errors).lower()}
+            return 200, 'application/xml', result, headers
+
+        if endpoint == 'att':
+            return 200, 'application/xml', transform.fix_att(data), {}
+
+        if endpoint == 'add-ids':
+            result, n_added = transform.add_ids(data)
+            return 200, 'application/xml', result, {'X-IDs-Added': str(n_added)}
+    except etree.XMLSyntaxError as e:
+        return 422, 'application/json', json.dumps({'error': str(e)}).encode(), {}
+    except Exception as e:
+        # the transformations raise plain Exceptions for documents they don't support, other
+        # exceptions are bugs, which get a 500 response
+        if type(e) is not Exception:
+            raise
+        return 422, 'application/json', json.dumps({'error': str(e)}).encode(), {}
+
+    raise ValueError(f'Unknown endpoint {endpoint}')
+
+
+class Metrics:
+    """Request counts, latency histograms and recent latencies of each endpoint, shared by
+    the request threads
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recorder = instrumentation.Recorder()
+        # endpoint -> {status: count}
+        self._statuses = {}
+        # endpoint -> the LATENCY_WINDOW most recent latencies
+        self._latencies = {}
+
+    def record(self, endpoint, status, seconds):
+        with self._lock:
+            self._recorder.record(endpoint, seconds)
+            statuses = self._statuses.setdefault(endpoint, {})
+            statuses[status] = statuses.get(status, 0) + 1
+            self._latencies.setdefault(endpoint, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def to_dict(self):
+        with self._lock:
+            endpoints = {}
+            for endpoint, (calls, seconds, histogram) in self._recorder.steps.items():
+                latencies = sorted(self._latencies[endpoint])
+                endpoints[endpoint] = {
+                    'requests': calls,
+                    'statuses': {str(status): count for status, count in sorted(self._statuses[endpoint].items())},
+                    'mean_ms': seconds / calls * 1000,
+                    'percentiles_ms': {
+                        f'p{p}': latencies[min(len(latencies) - 1, len(latencies) * p // 100)] * 1000
+                        for p in PERCENTILES
+                    },
+                    'histogram': histogram,
+                }
+            return {'histogram_labels': instrumentation.HISTOGRAM_LABELS, 'endpoints': endpoints}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self._respond(404, 'application/json', json.dumps({'error': 'Not found'}).encode())
+            return
+        self._respond(200, 'application/json', json.dumps(self.server.metrics.to_dict(), indent=2).encode())
+
+    def do_POST(self):
+        start = time.perf_counter()
+        endpoint = self.path.strip('/')
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if endpoint not in ENDPOINTS:
+            self._respond(404, 'application/json', json.dumps({'error': 'Not found'}).encode())
+            return
+
+        if not self.server.slots.acquire(blocking=False):
+            status = 503
+            self._respond(status, 'application/json', json.dumps({'error': 'Too many pending requests'}).encode())
+        else:
+            try:
+                status, content_type, body, headers = self.server.pool.apply(handle, (endpoint, data))
+            except Exception:
+                status, content_type, headers = 500, 'application/json', {}
+                body = json.dumps({'error': traceback.format_exc()}).encode()
+            finally:
+                self.server.slots.release()
+            self._respond(status, content_type, body, headers)
+        self.server.metrics.record(endpoint, status, time.perf_counter() - start)
+
+    def _respond(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class TransformationServer(ThreadingMixIn, HTTPServer):
+    """HTTP server handing the documents to a pool of warm worker processes
+
+    :param address: tuple, (host, port) to listen on, port 0 picks a free port
+    :param schema_path: str, path to the v2.0 XSD
+    :param jobs: int, number of worker processes
+    :param max_pending: int, number of requests which can be queued or running at once
+    :param quiet: bool, don't log each request
+    """
+    daemon_threads = True
+    # requests beyond max_pending are rejected rather than left waiting for a connection
+    request_queue_size = 128
+
+    def __init__(self, address, schema_path, jobs=1, max_pending=16, quiet=False):
+        super().__init__(address, ServiceHandler)
+        # the workers load the schema as soon as they start, before the first request
+        self.pool = Pool(jobs, initializer=transform.init, initargs=(schema_path,))
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.metrics = Metrics()
+        self.quiet = quiet
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close()
+        self.pool.join()
+
+
+class ServiceError(Exception):
+    """Error response from the service
+
+    :param status: int, HTTP status
+    :param message: str, body of the response
+    """
+    def __init__(self, status, message):
+        super().__init__(f'{status}: {message}')
+        self.status = status
+
+
+class ServiceClient:
+    """Sends documents to a running service
+
+    The transformations return (body, headers), and raise a ServiceError for error responses
+
+    :param url: str, e.g. http://localhost:8080
+    :param timeout: float, seconds to wait for each response
+    """
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, endpoint, data=None):
+        request = urllib.request.Request(
+            f'{self.url}/{endpoint}', data=data, headers={'Content-Type': 'application/xml'} if data else {}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read(), dict(response.headers)
+        except urllib.error.HTTPError as e:
+            raise ServiceError(e.code, e.read().decode()) from None
+
+    def validate(self, data):
+        """Returns the validation result of a document, see the module docstring"""
+        return json.loads(self.request('validate', data)[0])
+
+    def fix_2_0(self, data):
+        return self.request('fix-2.0', data)
+
+    def att(self, data):
+        return self.request('att', data)
+
+    def add_ids(self, data):
+        return self.request('add-ids', data)
+
+    def metrics(self):
+        return json.loads(self.request('metrics')[0])
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Transform single BuildingSync documents over HTTP')
+    subparsers = arg_parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    serve_parser = subparsers.add_parser('serve', help='run the service')
+    serve_parser.add_argument('schema', help='path to the local v2.0 xsd')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    serve_parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    serve_parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    serve_parser.add_argument(
+        '--max-pending', type=int, default=None,
+        help='number of requests which can be queued or running at once, others are rejected (default: 4 per job)'
+    )
+    serve_parser.add_argument('--quiet', action='store_true', help="don't log each request")
+
+    client_parser = subparsers.add_parser('client', help='send a file to a running service')
+    client_parser.add_argument('url', help='url of the service, e.g. http://localhost:8080')
+    client_parser.add_argument('endpoint', choices=ENDPOINTS + ('metrics',))
+    client_parser.add_argument('file', nargs='?', help='file to send, not used for metrics')
+    client_parser.add_argument('--output', help='file to write the transformed document to (default: stdout)')
+    args = arg_parser.parse_args()
+
+    if args.command == 'serve':
+        max_pending = args.max_pending if args.max_pending is not None else 4 * args.jobs
+        server = TransformationServer(
+            (args.host, args.port), args.schema, jobs=args.jobs, max_pending=max_pending, quiet=args.quiet
+        )
+        print(f'Serving on http://{server.server_address[0]}:{server.server_address[1]} with {args.jobs} workers')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    else:
+        client = ServiceClient(args.url)
+        if args.endpoint == 'metrics':
+            print(json.dumps(client.metrics(), indent=2))
+        else:
+            with open(args.file, 'rb') as f:
+                data = f.read()
+            try:
+                body, headers = client.request(args.endpoint, data)
+            except ServiceError as e:
+                raise SystemExit(str(e))
+            if args.endpoint == 'validate':
+                print(body.decode())
+            elif args.output:
+                with open(args.output, 'wb') as f:
+                    f.write(body)
+            else:
+                sys.stdout.buffer.write(body)
@@ -0,0 +1,191 @@
+"""Bounded memory reading and writing of files with large bulky subtrees
+
+parse() reads a file with iterparse. The children of bulky containers (e.g.
+Scenario/TimeSeriesData) are serialized to a temporary spool file as soon as
+they are parsed and are removed from the tree, so the tree only holds the
+skeleton of the document: the small elements the transformations work on, plus
+the empty bulky containers in their original positions. write() serializes the
+skeleton with an incremental writer (etree.xmlfile), copying the spooled bytes
+straight into the output in place of each bulky container's children.
+
+Peak memory is therefore bounded by the size of the skeleton plus the largest
+single child of a bulky container, regardless of the size of the file.
+"""
+import re
+import tempfile
+
+from lxml import etree
+
+from utils import BUILDINGSYNC_URI
+
+# marks bulky containers in the skeleton, the value is the container's index in the spool.
+# It isn't namespaced so that it doesn't add a namespace declaration to the container's scope
+SPOOL_REF_ATTRIBUTE = 'bsync-transformations-spool-ref'
+
+DEFAULT_BULKY_TAGS = frozenset([
+    f'{{{BUILDINGSYNC_URI}}}TimeSeriesData',
+    f'{{{BUILDINGSYNC_URI}}}ResourceUses',
+])
+
+# namespace declarations in the start tag of a serialized element
+XMLNS_DECLARATION_RE = re.compile(rb'\s+xmlns(?::[\w.-]+)?="[^"]*"')
+
+
+class Spool:
+    """Temporary file holding the serialized children of bulky containers
+
+    Each container's children are written consecutively, so a container is stored as
+    a single (start, end) byte range. Children whose namespaces are all declared on
+    the source's root element are stored without their namespace declarations so
+    they can be copied into the output as-is.
+
+    :param transform: function, optional, called with each child before it is spooled
+    """
+    def __init__(self, transform=None):
+        self.file = tempfile.TemporaryFile()
+        self.transform = transform
+        self.ranges = []
+        self.source_nsmap = {}
+
+    def new_container(self):
+        """Starts a new container, returning its ref"""
+        offset = self.file.tell()
+        self.ranges.append((offset, offset))
+        return len(self.ranges) - 1
+
+    def add(self, ref, child):
+        """Serializes a child of the container ref to the end of the spool"""
+        if self.transform is not None:
+            self.transform(child)
+        data = etree.tostring(child, with_tail=False)
+        if child.nsmap.items() <= self.source_nsmap.items():
+            # the declarations are all in the first start tag
+            head_end = data.index(b'>')
+            data = XMLNS_DECLARATION_RE.sub(b'', data[:head_end]) + data[head_end:]
+        self.file.write(data)
+        start, _ = self.ranges[ref]
+        self.ranges[ref] = (start, self.file.tell())
+
+    def iter_chunks(self, ref, chunk_size=1 << 20):
+        """Yields the bytes of the container's children in chunks"""
+        start, end = self.ranges[ref]
+        self.file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = self.file.read(min(chunk_size, remaining))
+            remaining -= len(chunk)
+            yield chunk
+        self.file.seek(0, 2)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parse(source, spool, bulky_tags=DEFAULT_BULKY_TAGS, remove_blank_text=False):
+    """Parses a file, spooling the children of bulky containers
+
+    :param source: str or file, the file to parse
+    :param spool: Spool, where the children of the bulky containers are put
+    :param bulky_tags: set, qualified tags of the bulky containers
+    :param remove_blank_text: bool, same as for etree.XMLParser
+    :return: ElementTree, the skeleton of the document
+    """
+    context = etree.iterparse(source, events=('start', 'end'), remove_blank_text=remove_blank_text)
+    container = None
+    for event, element in context:
+        if event == 'start':
+            if element.getparent() is None:
+                spool.source_nsmap = dict(element.nsmap)
+            elif container is None and element.tag in bulky_tags:
+                container = element
+                container.set(SPOOL_REF_ATTRIBUTE, str(spool.new_container()))
+            continue
+
+        if container is None:
+            continue
+        if element is container:
+            container = None
+        elif element.getparent() is container:
+            spool.add(int(container.get(SPOOL_REF_ATTRIBUTE)), element)
+            container.remove(element)
+
+    return etree.ElementTree(context.root)
+
+
+def _write_element(xf, element, spool, raw_output, nsmap=None):
+    if not isinstance(element.tag, str):
+        # comments and processing instructions
+        xf.write(element)
+        return
+
+    attrib = {key: value for key, value in element.attrib.items() if key != SPOOL_REF_ATTRIBUTE}
+    with xf.element(element.tag, attrib, nsmap=nsmap):
+        if element.text:
+            xf.write(element.text)
+        ref = element.get(SPOOL_REF_ATTRIBUTE)
+        if ref is not None:
+            _write_spooled(xf, spool, int(ref), raw_output)
+        for child in element:
+            _write_element(xf, child, spool, raw_output)
+            if child.tail:
+                xf.write(child.tail)
+
+
+def _write_spooled(xf, spool, ref, raw_output):
+    if raw_output is not None:
+        xf.flush()
+        for chunk in spool.iter_chunks(ref):
+            raw_output.write(chunk)
+        return
+
+    # the namespaces of the output root differ from the source, so the children are parsed
+    # again with the source's declarations and written with the output's prefixes, like
+    # the skeleton. They are parsed incrementally and each is written as soon as it is
+    # complete, so only one child is in memory at a time
+    declarations = ''.join(
+        f' xmlns:{prefix}="{uri}"' if prefix else f' xmlns="{uri}"'
+        for prefix, uri in spool.source_nsmap.items()
+    ).encode()
+    parser = etree.XMLPullParser(events=('end',))
+    parser.feed(b'<spooled' + declarations + b'>')
+    for chunk in spool.iter_chunks(ref):
+        parser.feed(chunk)
+        _write_parsed_children(xf, parser)
+    parser.feed(b'</spooled>')
+    _write_parsed_children(xf, parser)
+    parser.close()
+
+
+def _write_parsed_children(xf, parser):
+    for _, element in parser.read_events():
+        parent = element.getparent()
+        # only the children of the wrapper, which is the root
+        if parent is not None and parent.getparent() is None:
+            _write_element(xf, element, None, None)
+            parent.remove(element)
+
+
+def write(tree, output, spool):
+    """Writes the skeleton and the spooled children of its bulky containers
+
+    :param tree: ElementTree, from parse
+    :param output: str or file, where to write the document
+    :param spool: Spool, the spool used when parsing the tree
+    """
+    if isinstance(output, str):
+        with open(output, 'wb') as f:
+            write(tree, f, spool)
+        return
+
+    root = tree.getroot()
+    # the spooled bytes can be copied as-is if the output root declares the same namespaces
+    raw_output = output if spool.source_nsmap.items() <= root.nsmap.items() else None
+    with etree.xmlfile(output, encoding='utf-8') as xf:
+        xf.write_declaration()
+        _write_element(xf, root, spool, raw_output, nsmap=root.nsmap)
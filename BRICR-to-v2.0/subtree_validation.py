@@ -0,0 +1,179 @@
+"""Validation of only the parts of a document that a transformation changed
+
+Validating a whole document after fix_ATT has added a few elements takes time
+proportional to the size of the document, most of which (e.g. the TimeSeriesData of
+the Scenarios) the transformation never touched. A ChangeTracker records the elements
+a transformation changes, and SubtreeValidator validates only those against their
+declarations in the schema:
+- subtrees which were added, or whose content changed, are validated with all of
+  their descendants
+- elements whose attributes or children changed (e.g. a Scenario which got a new
+  child) are validated shallowly: their attributes and the sequence of their
+  children's tags, without validating the content of the children again
+
+Errors are dicts with the XPath of the element they are about, e.g.
+/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Reports/auc:Report/auc:Scenarios/auc:Scenario[2],
+its line in the source (None for new elements), local name and the message.
+
+Constraints spanning the document (unique IDs, IDREFs pointing to existing IDs)
+aren't checked for subtrees. SubtreeValidator.validate_document validates the whole
+document with libxml2, like validate.py, for when they need to be.
+"""
+from lxml import etree
+
+import instrumentation
+from validate import get_element_name
+
+
+class ChangeTracker:
+    """The elements of a tree changed by a transformation
+
+    Elements are recorded in the order they are changed, each once. Elements which
+    are removed from the tree afterwards are ignored when validating.
+    """
+    def __init__(self):
+        # dicts are used as ordered sets
+        self.subtrees = {}
+        self.elements = {}
+
+    def subtree_changed(self, element):
+        """Records that the element was added, or that its text or descendants changed"""
+        self.subtrees[element] = None
+
+    def element_changed(self, element):
+        """Records that the element's attributes or children changed, but not the content
+        of the children
+        """
+        self.elements[element] = None
+
+
+def _shallow_copy(element):
+    """Returns a copy of the element with empty copies of its children, and a dict mapping
+    the copies to the original elements
+
+    xmlschema looks through the whole of the element it is given for namespace
+    declarations, even if it only validates the top of it, so shallow validation is done
+    on a copy
+    """
+    copy = etree.Element(element.tag, attrib=dict(element.attrib), nsmap=element.nsmap)
+    copy.text = element.text
+    originals = {copy: element}
+    for child in element.iterchildren(etree.Element):
+        originals[etree.SubElement(copy, child.tag, attrib=dict(child.attrib))] = child
+    return copy, originals
+
+
+def _error(tree, element, message):
+    return {
+        'path': tree.getpath(element),
+        'line': element.sourceline,
+        'element': etree.QName(element).localname,
+        'message': message,
+    }
+
+
+class SubtreeValidator:
+    """Validates the changes recorded by a ChangeTracker, or whole documents
+
+    :param xsd_path: str, path to the v2.0 XSD
+    """
+    def __init__(self, xsd_path):
+        # only import xmlschema when validating subtrees since importing it is slow
+        from xmlschema import XMLSchema
+
+        self.xsd_path = xsd_path
+        self.schema = XMLSchema(xsd_path)
+        self._document_schema = None
+        # qualified tag -> declaration of the global elements
+        self._root_declarations = {
+            xsd_element.name: xsd_element for xsd_element in self.schema.elements.values()
+        }
+        # declaration -> {child tag: declaration of the child}
+        self._child_declarations = {}
+
+    def get_declaration(self, element):
+        """Returns the xmlschema declaration of an element, from the tags of the element and
+        its ancestors, or None if the path isn't in the schema
+
+        :param element: Element
+        """
+        tags = [ancestor.tag for ancestor in element.iterancestors()][::-1] + [element.tag]
+        declaration = self._root_declarations.get(tags[0])
+        for tag in tags[1:]:
+            if declaration is None:
+                break
+            children = self._child_declarations.get(declaration)
+            if children is None:
+                children = {}
+                for xsd_child in declaration.iterchildren():
+                    # skip wildcards, and keep the first declaration if a tag is repeated
+                    if xsd_child.name is not None and xsd_child.name not in children:
+                        children[xsd_child.name] = xsd_child
+                self._child_declarations[declaration] = children
+            declaration = children.get(tag)
+        return declaration
+
+    @instrumentation.timed('validate.subtrees')
+    def validate_changes(self, tree, changes):
+        """Validates the elements changed in the tree
+
+        :param tree: ElementTree
+        :param changes: ChangeTracker, the changes made to the tree
+        :return: list, a dict for each error, see the module docstring. Empty if the
+            changed elements are valid
+        """
+        root = tree.getroot()
+        subtrees = set()
+        to_validate = []
+        for element, max_depth in (
+            [(element, None) for element in changes.subtrees] + [(element, 1) for element in changes.elements]
+        ):
+            ancestors = list(element.iterancestors())
+            if (ancestors[-1] if ancestors else element) is not root:
+                # removed from the tree
+                continue
+            if element in subtrees or any(ancestor in subtrees for ancestor in ancestors):
+                # validated with one of its ancestors (or already validated)
+                continue
+            if max_depth is None:
+                subtrees.add(element)
+            to_validate.append((element, max_depth))
+
+        errors = []
+        for element, max_depth in to_validate:
+            # skip the subtrees contained in subtrees recorded after them
+            if max_depth is None and any(ancestor in subtrees for ancestor in element.iterancestors()):
+                continue
+            declaration = self.get_declaration(element)
+            if declaration is None:
+                errors.append(_error(tree, element, 'This element is not expected at this path by the schema.'))
+                continue
+            if max_depth is None:
+                source, originals = element, None
+            else:
+                source, originals = _shallow_copy(element)
+            for error in declaration.iter_errors(source, max_depth=max_depth):
+                error_element = error.elem if error.elem is not None else source
+                if getattr(error, 'invalid_tag', None) is not None:
+                    # unexpected children are reported on the child, like validate.py does
+                    error_element = error.elem[error.index]
+                if originals is not None:
+                    error_element = originals[error_element]
+                errors.append(_error(tree, error_element, error.reason or error.message))
+        return errors
+
+    @instrumentation.timed('validate.document')
+    def validate_document(self, tree):
+        """Validates the whole tree with libxml2
+
+        :param tree: ElementTree
+        :return: list, a dict for each error, see the module docstring
+        """
+        if self._document_schema is None:
+            self._document_schema = etree.XMLSchema(etree.parse(self.xsd_path))
+        if self._document_schema.validate(tree):
+            return []
+        return [
+            {'path': error.path, 'line': error.line, 'element': get_element_name(error), 'message': error.message}
+            for error in self._document_schema.error_log
+        ]
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# the scripts are modules at the top of BRICR-to-v2.0
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# downloaded as in the README's Setup
+SCHEMA_PATH = os.path.join(ROOT, 'schema_2_0.xsd')
+
+
+@pytest.fixture(scope='session')
+def schema_path(tmp_path_factory):
+    """Path to the v2.0 XSD, the tests using it are skipped if it wasn't downloaded"""
+    if not os.path.exists(SCHEMA_PATH):
+        pytest.skip('the v2.0 schema is not downloaded to schema_2_0.xsd')
+    # don't cache the schema index in the user's cache
+    os.environ['BSYNC_CACHE_DIR'] = str(tmp_path_factory.mktemp('cache'))
+    return SCHEMA_PATH
@@ -0,0 +1,57 @@
+from lxml import etree
+
+import dedup
+from utils import NAMESPACES
+
+MEASURES = '/auc:BuildingSync/auc:Facilities/auc:Facility/auc:Measures'
+
+DOCUMENT = b'''<auc:BuildingSync xmlns:auc="http://buildingsync.net/schemas/bedes-auc/2019">
+  <auc:Facilities><auc:Facility>
+    <auc:Measures>
+      <auc:Measure ID="Measure-1"><auc:LongDescription>LED</auc:LongDescription></auc:Measure>
+      <auc:Measure ID="Measure-2"><auc:LongDescription>Boiler</auc:LongDescription></auc:Measure>
+      <auc:Measure ID="Measure-3"><auc:LongDescription>LED</auc:LongDescription></auc:Measure>
+    </auc:Measures>
+    <auc:MeasureIDs>
+      <auc:MeasureID IDref="Measure-1"/>
+      <auc:MeasureID IDref="Measure-2"/>
+      <auc:MeasureID IDref="Measure-3"/>
+    </auc:MeasureIDs>
+    <auc:MeasureIDs>
+      <auc:MeasureID IDref="Measure-3"/>
+    </auc:MeasureIDs>
+  </auc:Facility></auc:Facilities>
+</auc:BuildingSync>'''
+
+
+def _idrefs(tree):
+    return [
+        [measure_id.get('IDref') for measure_id in measure_ids]
+        for measure_ids in tree.iterfind('.//auc:MeasureIDs', namespaces=NAMESPACES)
+    ]
+
+
+def test_deduplicate_repoints_idrefs():
+    tree = etree.ElementTree(etree.fromstring(DOCUMENT))
+    assert dedup.deduplicate(tree, dedup.compile_parent_paths([MEASURES])) == 1
+    measures = tree.findall('.//auc:Measure', namespaces=NAMESPACES)
+    assert [measure.get('ID') for measure in measures] == ['Measure-1', 'Measure-2']
+    # the repeated MeasureID is removed, the one on its own is repointed
+    assert _idrefs(tree) == [['Measure-1', 'Measure-2'], ['Measure-1']]
+
+
+def test_deduplicate_with_reused_ids():
+    # invalid, Measure-1 is the ID of both a kept and a removed element
+    tree = etree.ElementTree(etree.fromstring(b'''<auc:BuildingSync xmlns:auc="http://buildingsync.net/schemas/bedes-auc/2019">
+  <auc:Facilities><auc:Facility>
+    <auc:Measures>
+      <auc:Measure ID="Measure-1"><auc:LongDescription>LED</auc:LongDescription></auc:Measure>
+      <auc:Measure ID="Measure-2"><auc:LongDescription>Boiler</auc:LongDescription></auc:Measure>
+      <auc:Measure ID="Measure-2"><auc:LongDescription>LED</auc:LongDescription></auc:Measure>
+      <auc:Measure ID="Measure-1"><auc:LongDescription>Boiler</auc:LongDescription></auc:Measure>
+    </auc:Measures>
+    <auc:MeasureIDs><auc:MeasureID IDref="Measure-1"/><auc:MeasureID IDref="Measure-2"/></auc:MeasureIDs>
+  </auc:Facility></auc:Facilities>
+</auc:BuildingSync>'''))
+    assert dedup.deduplicate(tree, dedup.compile_parent_paths([MEASURES])) == 2
+    assert len(tree.findall('.//auc:Measure', namespaces=NAMESPACES)) == 2
@@ -0,0 +1,69 @@
+import pytest
+
+import detectors
+import fix_2_0
+from schema_cache import load_schema
+
+
+def _document(facility):
+    return f'''<auc:BuildingSync xmlns:auc="http://buildingsync.net/schemas/bedes-auc/2019">
+  <auc:Facilities><auc:Facility>{facility}</auc:Facility></auc:Facilities>
+</auc:BuildingSync>'''.encode()
+
+
+SYSTEMS = '''<auc:Systems><auc:LightingSystems><auc:LightingSystem ID="LightingSystem-1">
+  <auc:PrimaryLightingSystemType>LED</auc:PrimaryLightingSystemType>
+</auc:LightingSystem></auc:LightingSystems></auc:Systems>'''
+
+# files without the defects, which match the patterns of their fixes
+WITHOUT_DEFECTS = {
+    'report in a comment': _document('<!-- <auc:Report ID="Report-1"/> -->'),
+    'primary lighting system type in a comment': _document(
+        '<!-- <auc:PrimaryLightingSystemType>LED</auc:PrimaryLightingSystemType> -->'
+    ),
+}
+
+# a Scenario with a child which isn't in the schema, but whose children are in order
+UNKNOWN_SCENARIO_CHILD = _document(
+    '<auc:Reports><auc:Report ID="Report-1"><auc:Scenarios><auc:Scenario ID="Scenario-1">'
+    '<auc:Unknown/></auc:Scenario></auc:Scenarios></auc:Report></auc:Reports>'
+)
+
+WITH_DEFECTS = {
+    'report': _document('<auc:Report ID="Report-1"/>'),
+    'primarylightingsystemtype': _document(SYSTEMS),
+}
+
+
+@pytest.fixture(scope='module')
+def schema_index(schema_path):
+    return load_schema(schema_path).index
+
+
+@pytest.mark.parametrize('check_tree', [True, False])
+@pytest.mark.parametrize('name', sorted(WITHOUT_DEFECTS))
+def test_no_fixes_without_defects(schema_index, name, check_tree):
+    assert detectors.detect(WITHOUT_DEFECTS[name], schema_index, check_tree=check_tree) == set()
+
+
+def test_unknown_child_does_not_need_calculationmethod(schema_index):
+    # without checking the tree, files with Scenarios are assumed to need the fix
+    assert detectors.detect(UNKNOWN_SCENARIO_CHILD, schema_index) == set()
+
+
+@pytest.mark.parametrize('check_tree', [True, False])
+@pytest.mark.parametrize('fixer_key', sorted(WITH_DEFECTS))
+def test_fixes_with_defects(schema_index, fixer_key, check_tree, tmp_path):
+    source = tmp_path / 'source.xml'
+    source.write_bytes(WITH_DEFECTS[fixer_key])
+    assert detectors.detect(str(source), schema_index, check_tree=check_tree) == {fixer_key}
+
+
+def test_detected_tree_is_fixed(schema_index):
+    data = WITH_DEFECTS['report']
+    fixer_keys, tree = detectors.detect(data, schema_index, keep_tree=True)
+    assert fixer_keys == {'report'} and tree is not None
+    # the same tree is given back when a tree is checked
+    assert detectors.detect(tree, schema_index, keep_tree=True) == ({'report'}, tree)
+    rules = fix_2_0.get_rules(fixer_keys)
+    assert fix_2_0.fix_data(data, rules, tree=tree) == fix_2_0.fix_data(data, rules)
@@ -0,0 +1,43 @@
+from io import BytesIO
+
+import pytest
+from lxml import etree
+
+import fix_ATT
+import generate_corpus
+from utils import NAMESPACES
+
+
+@pytest.fixture(scope='module')
+def init(schema_path):
+    fix_ATT.init_worker(schema_path)
+
+
+def _element(xml):
+    return etree.fromstring(f'<root xmlns:auc="{NAMESPACES["auc"]}">{xml}</root>')[0]
+
+
+def test_multiple_sites_and_buildings(init):
+    output = BytesIO()
+    generate_corpus.write_file(output, defects=())
+    tree = etree.parse(BytesIO(output.getvalue()), etree.XMLParser(remove_blank_text=True))
+    sites = tree.find('.//auc:Sites', NAMESPACES)
+    # a Site without Buildings before the Site of the Buildings, whose first Building
+    # doesn't have the floors
+    sites.insert(0, _element('<auc:Site ID="Site-0"/>'))
+    buildings = tree.find('.//auc:Buildings', NAMESPACES)
+    buildings.insert(0, _element('<auc:Building ID="Building-0"><auc:PremisesName>Other</auc:PremisesName></auc:Building>'))
+
+    fix_ATT.fix_tree(tree)
+
+    building_0, building_1 = tree.findall('.//auc:Buildings/auc:Building', NAMESPACES)
+    assert building_0.find('auc:Address', NAMESPACES) is not None
+    assert building_0.find('auc:ConditionedFloorsAboveGrade', NAMESPACES) is None
+    assert building_1.find('auc:ConditionedFloorsAboveGrade', NAMESPACES).text == '3'
+    assert building_1.find('auc:ConditionedFloorsBelowGrade', NAMESPACES).text == '1'
+    assert tree.find('.//auc:FloorsAboveGrade', NAMESPACES) is None
+    assert tree.find('.//auc:FloorsBelowGrade', NAMESPACES) is None
+    linked_building = tree.find('.//auc:LinkedPremisesOrSystem/auc:Building/auc:LinkedBuildingID', NAMESPACES)
+    assert linked_building.get('IDref') == 'Building-0'
+    identifier = building_1.find('auc:PremisesIdentifiers/auc:PremisesIdentifier', NAMESPACES)
+    assert identifier.find('auc:IdentifierCustomName', NAMESPACES).text == 'City Custom Building ID'
@@ -0,0 +1,33 @@
+from lxml import etree
+
+import transform
+from utils import NAMESPACES
+
+DOCUMENT = b'''<auc:BuildingSync xmlns:auc="http://buildingsync.net/schemas/bedes-auc/2019">
+  <auc:Facilities>
+    <auc:Facility ID="Facility-1">
+      <auc:Sites>
+        <auc:Site>
+          <auc:Buildings>
+            <auc:Building ID="Building-1"/>
+          </auc:Buildings>
+        </auc:Site>
+      </auc:Sites>
+      <auc:Measures>
+        <auc:Measure/>
+      </auc:Measures>
+    </auc:Facility>
+  </auc:Facilities>
+</auc:BuildingSync>'''
+
+
+def test_add_ids(schema_path):
+    transform.init(schema_path)
+    document, n_added = transform.add_ids(DOCUMENT)
+    assert n_added == 2
+    tree = etree.fromstring(document)
+    assert tree.find('.//auc:Site', NAMESPACES).get('ID').startswith('Site-')
+    assert tree.find('.//auc:Measure', NAMESPACES).get('ID').startswith('Measure-')
+    # existing IDs are kept
+    assert tree.find('.//auc:Building', NAMESPACES).get('ID') == 'Building-1'
+    assert transform.add_ids(etree.ElementTree(tree))[1] == 0
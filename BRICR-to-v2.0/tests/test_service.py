@@ -0,0 +1,114 @@
+import threading
+from io import BytesIO
+
+import pytest
+
+import generate_corpus
+import transform
+from service import ServiceClient, ServiceError, TransformationServer
+
+MAX_PENDING = 2
+
+
+def _document(defects=generate_corpus.DEFECTS):
+    output = BytesIO()
+    generate_corpus.write_file(output, defects=defects)
+    return output.getvalue()
+
+
+def _start_server(schema_path):
+    server = TransformationServer(('127.0.0.1', 0), schema_path, jobs=1, max_pending=MAX_PENDING, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, thread
+
+
+def _stop_server(server, thread):
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.fixture
+def server(schema_path):
+    server, thread = _start_server(schema_path)
+    yield server
+    _stop_server(server, thread)
+
+
+@pytest.fixture
+def client(server):
+    return ServiceClient(f'http://127.0.0.1:{server.server_address[1]}', timeout=30)
+
+
+def test_endpoints(client):
+    result = client.validate(_document())
+    assert not result['valid'] and result['errors']
+
+    fixed, headers = client.fix_2_0(_document())
+    assert headers['Content-Type'] == 'application/xml'
+    assert set(headers['X-Fixes-Applied'].split(',')) >= {'report', 'calculationmethod', 'subsections'}
+    assert headers['X-Valid'] == 'true'
+    assert client.validate(fixed) == {'valid': True, 'errors': []}
+
+    converted, headers = client.att(fixed)
+    assert headers['Content-Type'] == 'application/xml'
+    assert b'ConditionedFloorsAboveGrade' in converted
+
+    with_ids, headers = client.add_ids(converted.replace(b' ID="Measure-0"', b''))
+    assert headers['X-IDs-Added'] == '1'
+    assert client.add_ids(with_ids)[1]['X-IDs-Added'] == '0'
+
+
+def test_malformed_document(client):
+    # the parse errors are validation errors
+    assert not client.validate(b'<auc:BuildingSync')['valid']
+    for transformation in (client.fix_2_0, client.att, client.add_ids):
+        with pytest.raises(ServiceError) as error:
+            transformation(b'<auc:BuildingSync')
+        assert error.value.status == 422
+
+
+def _fail(document):
+    return {}['missing']
+
+
+def test_programming_error(schema_path, monkeypatch):
+    # the worker processes are forked with the failing fix_att
+    monkeypatch.setattr(transform, 'fix_att', _fail)
+    server, thread = _start_server(schema_path)
+    try:
+        client = ServiceClient(f'http://127.0.0.1:{server.server_address[1]}', timeout=30)
+        with pytest.raises(ServiceError) as error:
+            client.att(_document(defects=()))
+        assert error.value.status == 500
+        assert 'KeyError' in str(error.value)
+    finally:
+        _stop_server(server, thread)
+
+
+def test_too_many_pending_requests(server, client):
+    for _ in range(MAX_PENDING):
+        server.slots.acquire()
+    try:
+        with pytest.raises(ServiceError) as error:
+            client.validate(_document())
+        assert error.value.status == 503
+    finally:
+        for _ in range(MAX_PENDING):
+            server.slots.release()
+    assert client.validate(_document(defects=()))['valid']
+
+
+def test_metrics(client):
+    client.validate(_document())
+    client.validate(_document())
+    with pytest.raises(ServiceError):
+        client.fix_2_0(b'not xml')
+
+    endpoints = client.metrics()['endpoints']
+    assert endpoints['validate']['requests'] == 2
+    assert endpoints['validate']['statuses'] == {'200': 2}
+    assert endpoints['fix-2.0']['statuses'] == {'422': 1}
+    assert set(endpoints['validate']['percentiles_ms']) == {'p50', 'p90', 'p99'}
+    assert 'att' not in endpoints
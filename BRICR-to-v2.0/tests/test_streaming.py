@@ -0,0 +1,44 @@
+from lxml import etree
+
+import streaming
+from utils import fix_namespaces
+
+# the BuildingSync namespace has a prefix other than auc, so fix_namespaces changes the
+# root's namespaces and the spooled children have to be parsed again when written
+DOCUMENT = b'''<b:BuildingSync xmlns:b="http://buildingsync.net/schemas/bedes-auc/2019">
+  <b:Facilities><b:Facility><b:Reports><b:Report><b:Scenarios><b:Scenario>
+    <b:ResourceUses>
+      <b:ResourceUse ID="ResourceUse-1"><b:EnergyResource>Electricity</b:EnergyResource></b:ResourceUse>
+      <b:ResourceUse ID="ResourceUse-2"><b:EnergyResource>Natural gas</b:EnergyResource></b:ResourceUse>
+    </b:ResourceUses>
+    <b:TimeSeriesData>
+      <b:TimeSeries ID="TimeSeries-1"><b:IntervalReading>1.5</b:IntervalReading></b:TimeSeries>
+      <b:TimeSeries ID="TimeSeries-2"><b:IntervalReading>2.5</b:IntervalReading></b:TimeSeries>
+    </b:TimeSeriesData>
+  </b:Scenario></b:Scenarios></b:Report></b:Reports></b:Facility></b:Facilities>
+</b:BuildingSync>
+'''
+
+
+def _canonical(data):
+    parser = etree.XMLParser(remove_blank_text=True)
+    return etree.tostring(etree.fromstring(data, parser), method='c14n')
+
+
+def test_write_restores_namespaces_in_chunks(tmp_path, monkeypatch):
+    # feed the spooled children to the parser a few bytes at a time
+    iter_chunks = streaming.Spool.iter_chunks
+    monkeypatch.setattr(streaming.Spool, 'iter_chunks', lambda self, ref: iter_chunks(self, ref, chunk_size=7))
+
+    source = tmp_path / 'source.xml'
+    source.write_bytes(DOCUMENT)
+    output = tmp_path / 'output.xml'
+    with streaming.Spool() as spool:
+        tree = fix_namespaces(streaming.parse(str(source), spool, remove_blank_text=True))
+        assert tree.getroot().nsmap != spool.source_nsmap
+        streaming.write(tree, str(output), spool)
+
+    written = output.read_bytes()
+    assert b'<auc:ResourceUse ID="ResourceUse-1">' in written
+    expected = fix_namespaces(etree.ElementTree(etree.fromstring(DOCUMENT)))
+    assert _canonical(written) == _canonical(etree.tostring(expected))
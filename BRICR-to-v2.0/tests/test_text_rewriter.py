@@ -0,0 +1,71 @@
+import itertools
+from io import BytesIO
+
+import pytest
+from lxml import etree
+
+import fix_2_0
+import generate_corpus
+
+REWRITTEN_DEFECTS = sorted(fix_2_0.TEXT_REWRITES)
+
+DOCUMENT = b'''<?xml version="1.0" encoding="UTF-8"?>
+<!-- <auc:Subsections> in a comment -->
+<auc:BuildingSync xmlns:auc="http://buildingsync.net/schemas/bedes-auc/2019"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="old">
+  <auc:Facilities>
+    <auc:Facility>
+      <auc:Sites><auc:Site><auc:Buildings><auc:Building ID="Building-1">
+        <auc:PremisesName><![CDATA[<auc:Subsection> & StartTimeStamp]]></auc:PremisesName>
+        <auc:OccupancyClassification>Hotel</auc:OccupancyClassification>
+        <auc:Subsections>
+          <!-- Subsection <auc:Subsection attr="x"> -->
+          <auc:Subsection ID="Subsection-1" note="a>b Subsection"/>
+          <auc:Subsection ID='Subsection-2' note='auc:Subsection>'><auc:OtherSubsection/></auc:Subsection>
+        </auc:Subsections>
+      </auc:Building></auc:Buildings></auc:Site></auc:Sites>
+      <auc:TimeSeriesData><auc:TimeSeries>
+        <auc:StartTimeStamp>2019-01-01T00:00:00</auc:StartTimeStamp>
+      </auc:TimeSeries></auc:TimeSeriesData>
+    </auc:Facility>
+  </auc:Facilities>
+</auc:BuildingSync>
+'''
+
+
+def _canonical(data):
+    return etree.tostring(etree.parse(BytesIO(data)), method='c14n')
+
+
+def _rewrite(data, rules, chunk_size):
+    output = BytesIO()
+    fix_2_0.get_text_rewriter(rules).rewrite(BytesIO(data), output, chunk_size=chunk_size)
+    return output.getvalue()
+
+
+def _fix_with_tree(data, rules):
+    return fix_2_0.fix_data(data, rules, rewrite=False)
+
+
+@pytest.mark.parametrize('n_defects', range(1, len(REWRITTEN_DEFECTS) + 1))
+def test_rewriter_matches_tree_on_corpus(tmp_path, n_defects):
+    for defects in itertools.combinations(REWRITTEN_DEFECTS, n_defects):
+        rules = fix_2_0.get_rules(defects)
+        paths = generate_corpus.generate_corpus(str(tmp_path / '_'.join(defects)), files=3, defects=defects)
+        for path in paths:
+            with open(path, 'rb') as f:
+                data = f.read()
+            expected = _canonical(_fix_with_tree(data, rules))
+            assert _canonical(_rewrite(data, rules, 1 << 20)) == expected
+            assert _canonical(_rewrite(data, rules, 64)) == expected
+
+
+@pytest.mark.parametrize('chunk_size', [1 << 20, 16, 7])
+def test_rewriter_matches_tree_with_cdata_comments_and_attributes(chunk_size):
+    rules = fix_2_0.get_rules(REWRITTEN_DEFECTS)
+    rewritten = _rewrite(DOCUMENT, rules, chunk_size)
+    assert _canonical(rewritten) == _canonical(_fix_with_tree(DOCUMENT, rules))
+    # only the whole local names starting with Subsection are renamed
+    assert b'<auc:Sections>' in rewritten and b'<auc:OtherSubsection/>' in rewritten
+    assert b'<!-- Subsection <auc:Subsection attr="x"> -->' in rewritten
+    assert b'note="a>b Subsection"' in rewritten
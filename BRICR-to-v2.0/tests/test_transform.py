@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+from io import BytesIO
+
+import pytest
+
+import generate_corpus
+import transform
+from conftest import ROOT
+
+# the scripts detect Hotel in OccupancyClassification, while convert only replaces it if
+# the schema's enumeration doesn't allow it
+DETECTED_DEFECTS = tuple(defect for defect in generate_corpus.DEFECTS if defect != 'occupancyclassification')
+
+
+@pytest.fixture(scope='module')
+def init(schema_path):
+    transform.init(schema_path)
+
+
+def _document(defects):
+    output = BytesIO()
+    generate_corpus.write_file(output, defects=defects)
+    return output.getvalue()
+
+
+def _run_scripts(data_dir):
+    # the scripts find schema_2_0.xsd in the working directory
+    for script, directory in (('fix_2_0.py', data_dir), ('fix_ATT.py', f'{data_dir}_fixed')):
+        subprocess.run(
+            [sys.executable, os.path.join(ROOT, script), directory],
+            cwd=ROOT, check=True, stdout=subprocess.DEVNULL
+        )
+    return f'{data_dir}_fixed_ATT'
+
+
+@pytest.mark.parametrize('defects', [DETECTED_DEFECTS, ('report',), ()], ids=['all', 'report', 'none'])
+def test_convert_matches_scripts(init, tmp_path, defects):
+    data = _document(defects)
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    (data_dir / 'building.xml').write_bytes(data)
+
+    att_dir = _run_scripts(str(data_dir))
+
+    with open(os.path.join(att_dir, 'building.xml'), 'rb') as f:
+        assert transform.convert(data) == f.read()
+
+
+def test_fix_validation_errors_reaches_fixed_point(init):
+    # the errors below the unnested Report are only reported once it is in Reports
+    data = _document(('report', 'calculationmethod'))
+    assert {error['element'] for error in transform.validate(data)} == {'Report'}
+
+    fixed, applied, errors = transform.fix_validation_errors(data)
+
+    assert [rule.name for rule in applied] == ['report', 'calculationmethod']
+    assert errors == []
+    assert transform.validate(fixed) == []
+    # the fixed document needs no more fixes
+    assert transform.fix_validation_errors(fixed)[1] == []
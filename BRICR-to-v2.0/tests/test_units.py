@@ -0,0 +1,120 @@
+import pytest
+from lxml import etree
+
+import streaming
+import units
+from utils import NAMESPACES
+
+DOCUMENT = b'''<auc:BuildingSync xmlns:auc="http://buildingsync.net/schemas/bedes-auc/2019">
+  <auc:Facilities><auc:Facility><auc:Reports><auc:Report><auc:Scenarios>
+    <auc:Scenario>
+      <auc:ScenarioType><auc:PackageOfMeasures><auc:AnnualSavingsByFuels>
+        <auc:AnnualSavingsByFuel>
+          <auc:EnergyResource>Electricity</auc:EnergyResource>
+          <auc:ResourceUnits>kBtu</auc:ResourceUnits>
+          <auc:AnnualSavingsNativeUnits>3412</auc:AnnualSavingsNativeUnits>
+        </auc:AnnualSavingsByFuel>
+        <auc:AnnualSavingsByFuel>
+          <auc:EnergyResource>Natural gas</auc:EnergyResource>
+          <auc:ResourceUnits>kBtu</auc:ResourceUnits>
+          <auc:AnnualSavingsNativeUnits>500</auc:AnnualSavingsNativeUnits>
+        </auc:AnnualSavingsByFuel>
+      </auc:AnnualSavingsByFuels></auc:PackageOfMeasures></auc:ScenarioType>
+      <auc:ResourceUses>
+        <auc:ResourceUse ID="Electricity">
+          <auc:EnergyResource>Electricity</auc:EnergyResource>
+          <auc:ResourceUnits>kBtu</auc:ResourceUnits>
+          <auc:AnnualFuelUseNativeUnits>34.12</auc:AnnualFuelUseNativeUnits>
+        </auc:ResourceUse>
+        <auc:ResourceUse ID="Gas">
+          <auc:EnergyResource>Natural gas</auc:EnergyResource>
+          <auc:ResourceUnits>kBtu</auc:ResourceUnits>
+          <auc:AnnualFuelUseNativeUnits>1000</auc:AnnualFuelUseNativeUnits>
+        </auc:ResourceUse>
+        <auc:ResourceUse ID="Water">
+          <auc:EnergyResource>Water</auc:EnergyResource>
+          <auc:ResourceUnits>kBtu</auc:ResourceUnits>
+          <auc:AnnualFuelUseNativeUnits>7</auc:AnnualFuelUseNativeUnits>
+        </auc:ResourceUse>
+      </auc:ResourceUses>
+      <auc:TimeSeriesData>
+        <auc:TimeSeries>
+          <auc:IntervalReading>6.824</auc:IntervalReading>
+          <auc:ResourceUseID IDref="Electricity"/>
+        </auc:TimeSeries>
+        <auc:TimeSeries>
+          <auc:ResourceUseID IDref="Gas"/>
+          <auc:IntervalReading>200</auc:IntervalReading>
+          <auc:IntervalReading>300</auc:IntervalReading>
+        </auc:TimeSeries>
+        <auc:TimeSeries>
+          <auc:IntervalReading>7</auc:IntervalReading>
+          <auc:ResourceUseID IDref="Water"/>
+        </auc:TimeSeries>
+        <auc:TimeSeries>
+          <auc:IntervalReading>8</auc:IntervalReading>
+        </auc:TimeSeries>
+        <auc:TimeSeries>
+          <auc:ReadingType>Cost</auc:ReadingType>
+          <auc:IntervalReading>12.5</auc:IntervalReading>
+          <auc:ResourceUseID IDref="Electricity"/>
+        </auc:TimeSeries>
+        <auc:TimeSeries>
+          <auc:ReadingType>Peak</auc:ReadingType>
+          <auc:IntervalReading>34.12</auc:IntervalReading>
+          <auc:ResourceUseID IDref="Electricity"/>
+        </auc:TimeSeries>
+      </auc:TimeSeriesData>
+    </auc:Scenario>
+  </auc:Scenarios></auc:Report></auc:Reports></auc:Facility></auc:Facilities>
+  <auc:ResourceUses>
+    <auc:ResourceUse ID="Outside">
+      <auc:EnergyResource>Electricity</auc:EnergyResource>
+      <auc:ResourceUnits>kBtu</auc:ResourceUnits>
+      <auc:AnnualFuelUseNativeUnits>9</auc:AnnualFuelUseNativeUnits>
+    </auc:ResourceUse>
+  </auc:ResourceUses>
+</auc:BuildingSync>
+'''
+
+EXPECTED = {
+    'AnnualSavingsNativeUnits': [('kWh', 1000.0), ('therms', 5.0)],
+    'AnnualFuelUseNativeUnits': [('kWh', 10.0), ('therms', 10.0), ('kBtu', 7.0), ('kBtu', 9.0)],
+    'IntervalReading': [2.0, 2.0, 3.0, 7.0, 8.0, 12.5, 10.0],
+}
+
+
+def _values(tree):
+    def value(element):
+        return pytest.approx(float(element.text))
+
+    values = {}
+    for tag in ('AnnualSavingsNativeUnits', 'AnnualFuelUseNativeUnits'):
+        values[tag] = [
+            (element.getparent().findtext('auc:ResourceUnits', namespaces=NAMESPACES), value(element))
+            for element in tree.iterfind(f'.//auc:{tag}', namespaces=NAMESPACES)
+        ]
+    values['IntervalReading'] = [value(element) for element in tree.iterfind('.//auc:IntervalReading', namespaces=NAMESPACES)]
+    return values
+
+
+def test_convert_units():
+    tree = etree.ElementTree(etree.fromstring(DOCUMENT))
+    assert units.convert_units(tree) == 8
+    assert _values(tree) == EXPECTED
+
+
+def test_spooled_conversion_matches_tree(tmp_path):
+    source = tmp_path / 'source.xml'
+    source.write_bytes(DOCUMENT)
+    with streaming.Spool(transform=units.SpooledUnitConverter()) as spool:
+        tree = streaming.parse(str(source), spool)
+        units.convert_units(tree)
+        with open(tmp_path / 'streamed.xml', 'wb') as output:
+            streaming.write(tree, output, spool)
+    assert _values(etree.parse(str(tmp_path / 'streamed.xml'))) == EXPECTED
+
+
+def test_format_number_is_decimal():
+    assert units.format_number(1e-05) == '0.00001'
+    assert units.format_number(2.5) == '2.5'
@@ -0,0 +1,25 @@
+from lxml import etree
+from xmlschema import XMLSchema
+
+from utils import SchemaIndex, sort_element
+
+# the wildcard and the repeated a take positions, so b is at position 3 of 2 children
+SCHEMA = '''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:element name="root">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:any namespace="##other" minOccurs="0"/>
+        <xs:element name="a"/>
+        <xs:element name="a" minOccurs="0"/>
+        <xs:element name="b" minOccurs="0"/>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>'''
+
+
+def test_sort_element_puts_comments_last():
+    schema_index = SchemaIndex(XMLSchema(SCHEMA))
+    root = etree.fromstring('<root><!-- note --><b/><a/></root>')
+    sort_element(schema_index, etree.ElementTree(root), root)
+    assert [child.tag for child in root] == ['a', 'b', etree.Comment]
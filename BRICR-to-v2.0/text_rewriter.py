@@ -0,0 +1,352 @@
+"""Single pass rewriting of the markup of a file, without parsing it into a tree
+
+For fixes which only rename elements, change the text of specific elements or set
+attributes of the root element, scanning the file's markup is much faster than
+parsing it, and only needs a buffer of about chunk_size bytes regardless of the size
+of the file. Everything that isn't rewritten is copied byte for byte, including the
+formatting of the file.
+
+After the root's start tag, only the tags which have to be rewritten (and comments,
+CDATA sections and PIs, which are skipped) are looked at. They are found with
+bytes.find, tags seen before are renamed with bytes.replace, and everything in
+between is copied as is. The rewriter doesn't check that the file is well formed. It
+raises UnsupportedDocument for files using XML features it doesn't handle (DOCTYPEs,
+encodings which aren't ASCII compatible, namespace declarations below the root,
+entities or CDATA in text it has to rewrite, ...); such files should be fixed with a
+tree instead.
+"""
+import re
+
+CHUNK_SIZE = 1 << 20
+
+_START, _EMPTY, _END, _CDATA, _OTHER = range(5)
+
+# the rest of a start tag after the '<', attribute values may contain '>'. Written so
+# that it can't backtrack, since it's tried on incomplete tags at the end of the buffer
+_START_TAG_RE = re.compile(rb'[^>"\']*(?:(?:"[^"]*"|\'[^\']*\')[^>"\']*)*>')
+_NAME_RE = re.compile(rb'<([^\s/>]+)')
+_ATTRIBUTE_RE = re.compile(rb'([^\s=/>]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+# the part of a tag's name before and after a string to rename
+_NAME_START_RE = re.compile(rb'/?(?:[^\s/<>:]+:)?[^\s/<>:]*')
+_NAME_END_RE = re.compile(rb'[^\s/<>]*')
+# comments, CDATA sections, PIs and declarations
+_MARKUP_STARTS = (b'<!', b'<?')
+# the name of a start tag, groups for the prefix with its colon and the local name
+_TAG_NAME_RE = re.compile(rb'<((?:[^\s/<>:]+:)?)([^\s/<>:]*)')
+_ENCODING_RE = re.compile(rb'^<\?xml[^>]*encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+
+# encodings which aren't ASCII compatible
+_UNSUPPORTED_ENCODINGS = ('utf-16', 'utf16', 'utf-32', 'utf32', 'ucs-2', 'ucs2', 'ucs-4', 'ucs4', 'ebcdic', 'cp037')
+
+
+class UnsupportedDocument(Exception):
+    """Raised when a file can't be rewritten, it should be fixed with a tree instead"""
+
+
+def _find_markup_end(buffer, start):
+    """Returns (end, kind) of the markup starting at buffer[start] == '<', or (-1, None)
+    if the buffer ends before the markup does"""
+    if buffer.startswith(b'<!--', start):
+        end = buffer.find(b'-->', start + 4)
+        return (end + 3, _OTHER) if end != -1 else (-1, None)
+    if buffer.startswith(b'<![CDATA[', start):
+        end = buffer.find(b']]>', start + 9)
+        return (end + 3, _CDATA) if end != -1 else (-1, None)
+    if buffer.startswith(b'<?', start):
+        end = buffer.find(b'?>', start + 2)
+        return (end + 2, _OTHER) if end != -1 else (-1, None)
+    if buffer.startswith(b'</', start):
+        end = buffer.find(b'>', start + 2)
+        return (end + 1, _END) if end != -1 else (-1, None)
+    if len(buffer) - start < 9:
+        # not enough to tell the kind of markup
+        return -1, None
+    if buffer.startswith(b'<!', start):
+        raise UnsupportedDocument(f'Unsupported markup: {buffer[start:start + 9]!r}')
+
+    match = _START_TAG_RE.match(buffer, start + 1)
+    if match is None:
+        return -1, None
+    end = match.end()
+    return end, _EMPTY if buffer[end - 2:end] == b'/>' else _START
+
+
+def _escape_attribute(value):
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').encode('utf-8')
+
+
+def _set_attribute(token, nsmap, name, value):
+    """Sets the attribute with the qualified name in a start tag, replacing its value if
+    it is already set and adding it after the other attributes otherwise"""
+    uri, _, local_name = name[1:].partition('}')
+    uri, local_name = uri.encode(), local_name.encode()
+    close = len(token) - (2 if token.endswith(b'/>') else 1)
+    for match in _ATTRIBUTE_RE.finditer(token, _NAME_RE.match(token).end(), close):
+        prefix, _, attribute_local_name = match.group(1).rpartition(b':')
+        if prefix and prefix != b'xmlns' and nsmap.get(prefix) == uri and attribute_local_name == local_name:
+            group = 2 if match.group(2) is not None else 3
+            return token[:match.start(group)] + _escape_attribute(value) + token[match.end(group):]
+
+    prefixes = [prefix for prefix, prefix_uri in nsmap.items() if prefix is not None and prefix_uri == uri]
+    if not prefixes:
+        raise UnsupportedDocument(f'The root element does not declare the namespace {uri.decode()}')
+    attribute = b' ' + prefixes[0] + b':' + local_name + b'="' + _escape_attribute(value) + b'"'
+    return token[:close].rstrip() + attribute + token[close:]
+
+
+class TextRewriter:
+    """Rewrites element names, the text of some elements and attributes of the root element
+
+    :param renames: list, (old, new) tuples, old is replaced by new in the local names
+        of all elements, in order
+    :param text_replacements: dict, (old, new) tuples by qualified tag, old is replaced by
+        new in the text of the elements with that tag
+    :param root_attributes: dict, values of attributes to set on the root element, by
+        qualified name. The namespaces of the attributes must be declared on the root
+    :param root_prefixes: list, namespace prefixes which must be declared on the root
+    :param anchored_renames: list, (old, new) tuples, old is replaced by new at the start
+        of the local names of all elements, after the renames
+    """
+    def __init__(self, renames=(), text_replacements=None, root_attributes=None, root_prefixes=(),
+                 anchored_renames=()):
+        self.renames = [(old.encode(), new.encode()) for old, new in renames]
+        self.anchored_renames = [(old.encode(), new.encode()) for old, new in anchored_renames]
+        # the strings to look for in the names of tags
+        self.all_renames = self.renames + self.anchored_renames
+        self.text_replacements = {
+            tag: [(old.encode(), new.encode()) for old, new in replacements]
+            for tag, replacements in (text_replacements or {}).items()
+        }
+        self.text_replacement_local_names = {tag.rpartition('}')[2].encode() for tag in self.text_replacements}
+        self.root_attributes = root_attributes or {}
+        self.root_prefixes = [prefix.encode() for prefix in root_prefixes]
+        self.stop_markers = _MARKUP_STARTS + tuple(self.text_replacement_local_names)
+
+    def _rename(self, local_name):
+        for old, new in self.renames:
+            if old in local_name:
+                local_name = local_name.replace(old, new)
+        for old, new in self.anchored_renames:
+            if local_name.startswith(old):
+                local_name = new + local_name[len(old):]
+        return local_name
+
+    def _rewrite_root(self, token, nsmap):
+        for prefix in self.root_prefixes:
+            if prefix not in nsmap:
+                raise UnsupportedDocument(f'The root element does not declare the namespace prefix {prefix.decode()}')
+        for name, value in self.root_attributes.items():
+            token = _set_attribute(token, nsmap, name, value)
+        return token
+
+    def _rename_pattern(self):
+        """Returns the regex finding the strings to rename, or None if nothing is renamed"""
+        if not self.all_renames:
+            return None
+        return re.compile(b'|'.join(re.escape(old) for old, _ in self.all_renames))
+
+    def _find_stop(self, buffer, start, limit):
+        """Returns the position of the first markup the rewriter has to stop at in
+        buffer[start:limit], or -1: comments, CDATA, PIs and declarations, and the start
+        tags of elements whose text may have to be replaced, for which the match of
+        _TAG_NAME_RE is returned too
+
+        The start tags are found by searching for their local names, bytes.find is much
+        faster than searching for any of several strings with a regex.
+        """
+        while True:
+            found = [(buffer.find(marker, start, limit), marker) for marker in self.stop_markers]
+            found = [(index, marker) for index, marker in found if index != -1]
+            if not found:
+                return -1, None
+            index, marker = min(found)
+            if marker in _MARKUP_STARTS:
+                return index, None
+            # skip the matches which aren't in the name of a start tag
+            lt = buffer.rfind(b'<', start, index)
+            if lt != -1:
+                name = _TAG_NAME_RE.match(buffer, lt)
+                if name.end() >= index + len(marker):
+                    return lt, name
+            start = index + len(marker)
+
+    def _renamer(self, pattern):
+        """Returns a function renaming the tags in a part of the file"""
+        if pattern is None:
+            return lambda part: part
+        # renamed names, and the renamed tags with the character following their name
+        # (e.g. b'</auc:Subsection>'), by original name or tag. Tags repeat a lot, so the
+        # tags seen before are renamed with bytes.replace, which can only be used if
+        # renaming doesn't create strings to rename
+        renamed = {}
+        tags = {}
+        replace_tags = not any(pattern.search(new) for _, new in self.all_renames)
+
+        def rename_matches(part):
+            pieces = []
+            copied = 0
+            for match in pattern.finditer(part):
+                start = match.start()
+                if start < copied:
+                    continue
+                # skip the matches which aren't in the name of a tag
+                lt = part.rfind(b'<', copied, start)
+                if lt == -1 or _NAME_START_RE.fullmatch(part, lt + 1, start) is None:
+                    continue
+                name_end = _NAME_END_RE.match(part, match.end()).end()
+                name = part[lt + 1:name_end]
+                new_name = renamed.get(name)
+                if new_name is None:
+                    head, colon, local_name = name.rpartition(b':')
+                    new_name = renamed[name] = head + colon + self._rename(local_name)
+                if name_end < len(part):
+                    following = part[name_end:name_end + 1]
+                    tags[b'<' + name + following] = b'<' + new_name + following
+                pieces.append(part[copied:lt + 1])
+                pieces.append(new_name)
+                copied = name_end
+            if not pieces:
+                return part
+            pieces.append(part[copied:])
+            return b''.join(pieces)
+
+        def rename(part):
+            if replace_tags:
+                for tag, new_tag in tags.items():
+                    part = part.replace(tag, new_tag)
+            if not any(old in part for old, _ in self.all_renames):
+                return part
+            return rename_matches(part)
+
+        return rename
+
+    def rewrite(self, source, output, chunk_size=CHUNK_SIZE):
+        """Rewrites a file
+
+        :param source: file, opened in binary mode
+        :param output: file, opened in binary mode
+        :param chunk_size: int, number of bytes read at a time
+        """
+        write = output.write
+        buffer = source.read(chunk_size)
+        eof = not buffer
+        if buffer.startswith((b'\xff\xfe', b'\xfe\xff')) or b'\x00' in buffer[:4]:
+            raise UnsupportedDocument('The encoding of the file is not ASCII compatible')
+        encoding = _ENCODING_RE.match(buffer)
+        if encoding is not None and encoding.group(1).decode().lower().startswith(_UNSUPPORTED_ENCODINGS):
+            raise UnsupportedDocument(f'Unsupported encoding: {encoding.group(1).decode()}')
+
+        def read_more():
+            nonlocal buffer, eof
+            chunk = source.read(chunk_size)
+            buffer += chunk
+            eof = not chunk
+            return not eof
+
+        def find(sub, start):
+            index = buffer.find(sub, start)
+            while index == -1 and read_more():
+                index = buffer.find(sub, start)
+            return index
+
+        def markup_end(start):
+            end, kind = _find_markup_end(buffer, start)
+            while end == -1:
+                if not read_more():
+                    raise UnsupportedDocument('The file ends in the middle of markup')
+                end, kind = _find_markup_end(buffer, start)
+            return end, kind
+
+        # copy the prolog, then rewrite the root's start tag
+        pos = 0
+        while True:
+            lt = find(b'<', pos)
+            if lt == -1:
+                raise UnsupportedDocument('The file has no root element')
+            end, kind = markup_end(lt)
+            if kind in (_START, _EMPTY):
+                break
+            if kind != _OTHER:
+                raise UnsupportedDocument('Unexpected markup before the root element')
+            write(buffer[pos:end])
+            pos = end
+        write(buffer[pos:lt])
+        root = buffer[lt:end]
+        pos = end
+
+        name_match = _NAME_RE.match(root)
+        nsmap = {}
+        for match in _ATTRIBUTE_RE.finditer(root, name_match.end()):
+            attribute = match.group(1)
+            if attribute == b'xmlns' or attribute.startswith(b'xmlns:'):
+                value = match.group(2) if match.group(2) is not None else match.group(3)
+                nsmap[attribute[6:] or None] = value
+        prefix, colon, local_name = name_match.group(1).rpartition(b':')
+        root = b'<' + prefix + colon + self._rename(local_name) + root[name_match.end():]
+        if self.root_attributes or self.root_prefixes:
+            root = self._rewrite_root(root, nsmap)
+        write(root)
+
+        # only the markup found by _find_stop is looked at, tags are renamed in the parts
+        # in between and everything else is copied
+        rename = self._renamer(self._rename_pattern())
+        while True:
+            # tags before the last '<' in the buffer are complete
+            limit = len(buffer) if eof else buffer.rfind(b'<', pos)
+            if limit == -1:
+                limit = len(buffer)
+            stop, name = self._find_stop(buffer, pos, limit)
+            end = stop if stop != -1 else limit
+            if buffer.find(b'xmlns', pos, end) != -1:
+                raise UnsupportedDocument('Namespace declaration below the root element')
+            write(rename(buffer[pos:end]))
+            pos = end
+
+            if stop == -1:
+                if eof:
+                    break
+                # keep the buffer bounded
+                buffer = buffer[pos:]
+                pos = 0
+                read_more()
+                continue
+
+            if name is None:
+                end, _ = markup_end(pos)
+                write(buffer[pos:end])
+                pos = end
+                continue
+
+            prefix, local_name = name.groups()
+            new_local_name = self._rename(local_name)
+            write(b'<' + prefix + new_local_name)
+            pos = name.end()
+            if new_local_name not in self.text_replacement_local_names:
+                continue
+
+            # the tag's namespace is only looked up for the elements whose text is replaced
+            uri = nsmap.get(prefix[:-1] or None)
+            tag = f'{{{uri.decode()}}}{new_local_name.decode()}' if uri else new_local_name.decode()
+            replacements = self.text_replacements.get(tag)
+            tag_end = _START_TAG_RE.match(buffer, pos)
+            if replacements is None or tag_end is None or buffer[tag_end.end() - 2:tag_end.end()] == b'/>':
+                continue
+            end = tag_end.end()
+            if buffer.find(b'xmlns', pos, end) != -1:
+                raise UnsupportedDocument('Namespace declaration below the root element')
+            write(buffer[pos:end])
+            pos = end
+            lt = find(b'<', pos)
+            if lt == -1:
+                raise UnsupportedDocument('The file ends before the root element does')
+            text = buffer[pos:lt]
+            if b'&' in text:
+                raise UnsupportedDocument('Entity or character reference in text to rewrite')
+            while len(buffer) < lt + 9 and read_more():
+                pass
+            if buffer.startswith(b'<![CDATA[', lt):
+                raise UnsupportedDocument('CDATA in text to rewrite')
+            for old, new in replacements:
+                text = text.replace(old, new)
+            write(text)
+            pos = lt
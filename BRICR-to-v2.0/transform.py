@@ -0,0 +1,201 @@
+"""Library API of the transformations, for converting documents in memory
+
+The scripts work on directories of files. These functions transform a single document
+without touching the disk, so documents can be converted from another program without
+subprocesses or temporary directories, e.g.
+
+    import transform
+
+    transform.init('schema_2_0.xsd')
+    errors = transform.validate(data)
+    converted = transform.convert(data)
+
+Each transformation takes a document either as bytes or as an lxml ElementTree, and
+returns the transformed document in the same form. Trees are transformed in place, but
+use the returned tree since fix_2_0 returns a new tree if it had to fix the namespaces.
+Documents given as bytes are serialized the same way the scripts write them.
+
+The schema is loaded by init, which is called with SCHEMA_PATH on first use if it
+hasn't been called. Like the scripts, the functions raise an Exception for documents
+they can't transform.
+"""
+from io import BytesIO
+
+from lxml import etree
+
+import detectors
+import fix_2_0 as fix_2_0_module
+import fix_ATT
+import validate as validate_module
+from required_ids import add_missing_ids, index_elements_requiring_ids, load_elements_requiring_ids
+
+SCHEMA_PATH = 'schema_2_0.xsd'
+
+_initialized = False
+# index of the elements requiring IDs, for add_ids
+_ids_index = None
+
+
+def init(schema_path=SCHEMA_PATH):
+    """Loads the schema and compiles the validator for the current process
+
+    :param schema_path: str, path to the v2.0 XSD
+    """
+    global _initialized, _ids_index
+    validate_module.init_worker(schema_path, None)
+    fix_2_0_module.init_worker(schema_path)
+    fix_ATT.init_worker(schema_path)
+    _ids_index = index_elements_requiring_ids(load_elements_requiring_ids(schema_path))
+    _initialized = True
+
+
+def _ensure_initialized():
+    if not _initialized:
+        init()
+
+
+def parse(data, remove_blank_text=False):
+    """Parses a document
+
+    :param data: bytes
+    :param remove_blank_text: bool, remove the whitespace between elements, so the
+        document is indented when it is serialized with pretty_print
+    :return: ElementTree
+    """
+    return etree.parse(BytesIO(data), etree.XMLParser(remove_blank_text=remove_blank_text))
+
+
+def validate(document):
+    """Validates a document against the schema
+
+    :param document: bytes or ElementTree
+    :return: list, a dict for each error with its line, element (local name of the
+        element it is about, or None), kind and message. Empty if the document is valid
+    """
+    _ensure_initialized()
+    if isinstance(document, bytes):
+        parser = etree.XMLParser()
+        try:
+            document = etree.fromstring(document, parser)
+        except etree.XMLSyntaxError:
+            return _error_dicts(validate_module.collect_errors(parser.error_log))
+
+    schema = validate_module.schema
+    if schema.validate(document):
+        return []
+    return _error_dicts(validate_module.collect_errors(schema.error_log))
+
+
+def _error_dicts(errors):
+    return [
+        {'line': line, 'element': element_name, 'kind': kind, 'message': message}
+        for line, element_name, kind, message in errors
+    ]
+
+
+def fix_2_0(document, fixer_keys=None):
+    """Fixes a document to v2.0, see fix_2_0.py
+
+    :param document: bytes or ElementTree
+    :param fixer_keys: iterable, keys of the fixes in fix_2_0.error_fixes_map to apply, e.g.
+        from detect_fixes. If None, the fixes are found by validating the document, see
+        fix_validation_errors
+    :return: the fixed document, bytes or ElementTree
+    """
+    if fixer_keys is None:
+        return fix_validation_errors(document)[0]
+    _ensure_initialized()
+    return _apply_fixes(document, fix_2_0_module.get_rules(set(fixer_keys)))
+
+
+def detect_fixes(document):
+    """Returns the keys of the fixes a document needs, found without validating it, see detectors.py
+
+    :param document: bytes or ElementTree
+    :return: set
+    """
+    _ensure_initialized()
+    return detectors.detect(document, fix_2_0_module.schema_2_0_index)
+
+
+def _apply_fixes(document, rules):
+    if isinstance(document, bytes):
+        # files which only need renames are rewritten without being parsed
+        return fix_2_0_module.fix_data(document, rules)
+    return fix_2_0_module.fix_tree(document, rules)
+
+
+def fix_validation_errors(document):
+    """Applies the fixes for the schema validity errors of a document until no new ones apply
+
+    Validation errors can hide the errors of the elements they contain (e.g. the errors
+    below a Report which isn't in Reports), so the fixed document is validated again and
+    the fixes for its new errors are applied to it, until none of its errors can be fixed.
+    The schemaLocation is fixed even if the document has no errors.
+
+    :param document: bytes or ElementTree
+    :return: tuple, (fixed document, list of the Rules applied, errors of the fixed
+        document, see validate)
+    """
+    errors = validate(document)
+    if any(error['kind'] != validate_module.ERROR_KINDS['SCHEMASV'] for error in errors):
+        raise Exception(f'Failed to parse the document: {errors[0]["message"]}')
+
+    result = None
+    fixer_keys = set()
+    applied = []
+    while True:
+        new_fixer_keys = {
+            error['element'].lower() for error in errors
+            if error['element'] is not None and error['element'].lower() in fix_2_0_module.error_fixes_map
+        } - fixer_keys
+        if not new_fixer_keys and result is not None:
+            return result, applied, errors
+        fixer_keys |= new_fixer_keys
+        rules = fix_2_0_module.get_rules(new_fixer_keys)
+        result = _apply_fixes(result if result is not None else document, rules)
+        applied.extend(rules)
+        errors = validate(result)
+
+
+def fix_att(document):
+    """Applies the Audit Template Tool fixes to a v2.0 document, see fix_ATT.py
+
+    Documents given as bytes are pretty printed. Trees are only indented if they were
+    parsed with remove_blank_text
+
+    :param document: bytes or ElementTree
+    :return: the fixed document, bytes or ElementTree
+    """
+    _ensure_initialized()
+    if isinstance(document, bytes):
+        return fix_ATT.fix_data(document)
+    fix_ATT.fix_tree(document)
+    return document
+
+
+def add_ids(document):
+    """Adds an ID to each element which requires one and doesn't have one, with the
+    implementation add-required-ids uses
+
+    :param document: bytes or ElementTree
+    :return: tuple, (document, number of IDs added)
+    """
+    _ensure_initialized()
+    if not isinstance(document, bytes):
+        return document, add_missing_ids(document, _ids_index)
+    tree = parse(document, remove_blank_text=True)
+    n_added = add_missing_ids(tree, _ids_index)
+    return etree.tostring(tree, pretty_print=True, xml_declaration=True, encoding='UTF-8'), n_added
+
+
+def convert(document):
+    """Converts a BRICR document for Audit Template Tool, i.e. fix_2_0 followed by fix_att
+
+    For documents given as bytes, the result is the same as the file written by
+    fix_ATT.py from the file written by fix_2_0.py
+
+    :param document: bytes or ElementTree
+    :return: the converted document, bytes or ElementTree
+    """
+    return fix_att(fix_2_0(document))
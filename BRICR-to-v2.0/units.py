@@ -0,0 +1,190 @@
+"""Conversion of the energy values of a document to the units Audit Template Tool expects
+
+The values in the units of a ResourceUnits are:
+- AnnualSavingsByFuel/AnnualSavingsNativeUnits, in the units of the AnnualSavingsByFuel
+- ResourceUse/AnnualFuelUseNativeUnits, in the units of the ResourceUse
+- TimeSeries/IntervalReading, in the units of the ResourceUse its ResourceUseID refers to,
+  unless its ReadingType or TimeSeriesReadingQuantity isn't an amount of energy (e.g. a
+  Cost or a Load factor), see SCALED_READING_TYPES
+
+Only the ResourceUses and TimeSeries of Scenarios are converted, and a TimeSeries only
+if the ResourceUse it refers to comes before it in the document, as streaming requires.
+
+convert_units collects all of the values of a tree which need converting, with the
+factor of their conversion in CONVERSIONS, and multiplies them in a single NumPy
+operation, so a Scenario with hourly TimeSeriesData (8760 readings per resource) costs
+little more than one without. Only reading and setting the text of each value is done
+per element.
+"""
+import numpy as np
+
+import instrumentation
+import xpaths
+from utils import BUILDINGSYNC_URI
+
+# (EnergyResource, ResourceUnits) -> (new ResourceUnits, factor the values are multiplied by)
+CONVERSIONS = {
+    # 1 kWh = 3.412 kBtu
+    ('Electricity', 'kBtu'): ('kWh', 1 / 3.412),
+    # 1 therm = 100 kBtu
+    ('Natural gas', 'kBtu'): ('therms', 0.01),
+}
+
+# ReadingTypes and TimeSeriesReadingQuantities of the TimeSeries whose readings are in
+# the units of their ResourceUse. The readings of the others (e.g. Cost) aren't
+# converted, those of TimeSeries without either element are
+SCALED_READING_TYPES = {'Point', 'Median', 'Average', 'Total', 'Peak', 'Minimum'}
+SCALED_READING_QUANTITIES = {'Energy', 'Demand'}
+
+
+def _tag(name):
+    return f'{{{BUILDINGSYNC_URI}}}{name}'
+
+
+ANNUAL_SAVINGS_BY_FUEL_TAG = _tag('AnnualSavingsByFuel')
+RESOURCE_USE_TAG = _tag('ResourceUse')
+TIME_SERIES_TAG = _tag('TimeSeries')
+INTERVAL_READING_TAG = _tag('IntervalReading')
+RESOURCE_USE_ID_TAG = _tag('ResourceUseID')
+READING_TYPE_TAG = _tag('ReadingType')
+READING_QUANTITY_TAG = _tag('TimeSeriesReadingQuantity')
+# tags of the ancestors of the ResourceUses and TimeSeries which are converted, from the root
+SCENARIO_TAGS = tuple(
+    _tag(name) for name in ('BuildingSync', 'Facilities', 'Facility', 'Reports', 'Report', 'Scenarios', 'Scenario')
+)
+CONTAINER_TAGS = {RESOURCE_USE_TAG: _tag('ResourceUses'), TIME_SERIES_TAG: _tag('TimeSeriesData')}
+
+
+def format_number(value):
+    """Returns the text of a converted value, as str(float) unless that is in
+    exponent notation, which isn't a valid xs:decimal
+    """
+    text = str(value)
+    if 'e' in text:
+        return np.format_float_positional(value, trim='-')
+    return text
+
+
+def scale(elements, factors):
+    """Multiplies the numbers in the text of elements by factors in one operation
+
+    :param elements: list, Elements whose text is a number
+    :param factors: list, factor of each element
+    """
+    if not elements:
+        return
+    values = np.array([element.text for element in elements], dtype=np.float64) * np.array(factors)
+    for element, value, text in zip(elements, values.tolist(), map(str, values.tolist())):
+        element.text = text if 'e' not in text else format_number(value)
+
+
+def is_in_scenario(element):
+    """Returns True if a ResourceUse or TimeSeries is in the ResourceUses or TimeSeriesData
+    of a Scenario, i.e. at the paths convert_units converts
+    """
+    tags = [ancestor.tag for ancestor in element.iterancestors()][::-1]
+    return tags[:-1] == list(SCENARIO_TAGS) and tags[-1:] == [CONTAINER_TAGS.get(element.tag)]
+
+
+class UnitConversions:
+    """The values to convert and their factors, collected from elements in document order"""
+    def __init__(self):
+        self.elements = []
+        self.factors = []
+        # ID of a converted ResourceUse -> factor of its conversion
+        self.resource_use_factors = {}
+
+    def _add_resource_units(self, element, value_xpath):
+        resource = xpaths.ENERGY_RESOURCE(element)
+        resource_units = xpaths.RESOURCE_UNITS(element)
+        if not resource or not resource_units:
+            return None
+        conversion = CONVERSIONS.get((resource[0].text, resource_units[0].text))
+        if conversion is None:
+            return None
+        resource_units[0].text, factor = conversion
+        values = value_xpath(element)
+        self.elements.extend(values)
+        self.factors.extend([factor] * len(values))
+        return factor
+
+    def add(self, element):
+        """Sets the units of an AnnualSavingsByFuel, ResourceUse or TimeSeries, and collects
+        its values to be scaled
+
+        :return: bool, True if the element's values are converted
+        """
+        if element.tag == ANNUAL_SAVINGS_BY_FUEL_TAG:
+            return self._add_resource_units(element, xpaths.ANNUAL_SAVINGS_NATIVE_UNITS) is not None
+        if element.tag == RESOURCE_USE_TAG:
+            factor = self._add_resource_units(element, xpaths.ANNUAL_FUEL_USE_NATIVE_UNITS)
+            if factor is not None and element.get('ID') is not None:
+                self.resource_use_factors[element.get('ID')] = factor
+            return factor is not None
+        if element.tag == TIME_SERIES_TAG:
+            readings = []
+            factor = None
+            for child in element:
+                if child.tag == INTERVAL_READING_TAG:
+                    readings.append(child)
+                elif child.tag == RESOURCE_USE_ID_TAG:
+                    factor = self.resource_use_factors.get(child.get('IDref'))
+                elif child.tag == READING_TYPE_TAG and child.text not in SCALED_READING_TYPES:
+                    return False
+                elif child.tag == READING_QUANTITY_TAG and child.text not in SCALED_READING_QUANTITIES:
+                    return False
+            if factor is None:
+                return False
+            self.elements.extend(readings)
+            self.factors.extend([factor] * len(readings))
+            return True
+        return False
+
+    def scale(self):
+        """Scales the values collected so far
+
+        :return: int, number of values scaled
+        """
+        n_values = len(self.elements)
+        scale(self.elements, self.factors)
+        self.elements = []
+        self.factors = []
+        return n_values
+
+
+@instrumentation.timed('units.convert_units')
+def convert_units(tree, changes=None):
+    """Converts the values of the tree to the units in CONVERSIONS, see the module docstring
+
+    :param tree: ElementTree
+    :param changes: ChangeTracker, optional, records the AnnualSavingsByFuels and
+        ResourceUses which were converted. The TimeSeries aren't recorded since there
+        can be tens of thousands of them and their readings stay decimals
+    :return: int, number of values converted
+    """
+    conversions = UnitConversions()
+    converted = [by_fuel for by_fuel in xpaths.ALL_SAVINGS_BY_FUEL(tree) if conversions.add(by_fuel)]
+    for element in xpaths.ALL_RESOURCE_USES_AND_TIME_SERIES(tree):
+        if conversions.add(element) and element.tag == RESOURCE_USE_TAG:
+            converted.append(element)
+    n_values = conversions.scale()
+    if changes is not None:
+        for element in converted:
+            changes.subtree_changed(element)
+    return n_values
+
+
+class SpooledUnitConverter:
+    """Converts the ResourceUses and TimeSeries of a file parsed by streaming.parse as they
+    are spooled, since convert_units only finds the ones in the skeleton. Use it as the
+    transform of the streaming.Spool
+
+    The same elements are converted as by convert_units, but each element's values are
+    scaled on their own rather than in one operation for the file.
+    """
+    def __init__(self):
+        self.conversions = UnitConversions()
+
+    def __call__(self, element):
+        if element.tag in CONTAINER_TAGS and is_in_scenario(element) and self.conversions.add(element):
+            self.conversions.scale()
@@ -1,54 +1,130 @@
+import bisect
 from io import StringIO
 
 from lxml import etree
 
+import instrumentation
+
 BUILDINGSYNC_URI = 'http://buildingsync.net/schemas/bedes-auc/2019'
 NAMESPACES = {
     'auc': BUILDINGSYNC_URI
 }
 
-def children_sorter_factory(schema, tree, element):
+UDF_CONTAINER_XPATH = etree.XPath('auc:UserDefinedFields', namespaces=NAMESPACES)
+# variables: name, the FieldName of the UserDefinedField
+UDF_VALUE_XPATH = etree.XPath('auc:UserDefinedField[auc:FieldName=$name]/auc:FieldValue', namespaces=NAMESPACES)
+
+class SchemaIndex:
+    """Precomputed child ordering of the elements in a schema
+
+    Every XSD type reachable from the schema's global elements is given an integer id.
+    For each type, the index stores a dict mapping the qualified tags of the allowed
+    children to their position in the type's sequence (choice and sequence groups are
+    flattened in schema order) and to the child's type id. Finding the type of an
+    element and the sort key of a child are then just dict lookups.
+
+    :param schema: xmlschema.XmlSchema, the schema to index
+    """
+    def __init__(self, schema):
+        # global element tag -> type id
+        self.root_types = {}
+        # type id -> {child tag: (position, child type id)}
+        self.children = []
+
+        type_ids = {}
+        to_visit = []
+
+        def get_type_id(xsd_element):
+            xsd_type = xsd_element.type
+            if xsd_type not in type_ids:
+                type_ids[xsd_type] = len(self.children)
+                self.children.append({})
+                to_visit.append(xsd_element)
+            return type_ids[xsd_type]
+
+        for xsd_element in schema.elements.values():
+            self.root_types[xsd_element.name] = get_type_id(xsd_element)
+
+        while to_visit:
+            xsd_element = to_visit.pop()
+            type_id = type_ids[xsd_element.type]
+            children = self.children[type_id]
+            for position, xsd_child in enumerate(xsd_element.iterchildren()):
+                # skip wildcards, and keep the first position if a tag is repeated
+                if xsd_child.name is None or xsd_child.name in children:
+                    continue
+                children[xsd_child.name] = (position, get_type_id(xsd_child))
+
+    def get_type_id(self, element):
+        """Returns the type id of an element, or None if its path isn't in the schema
+
+        :param element: Element
+        """
+        tags = [ancestor.tag for ancestor in element.iterancestors()][::-1] + [element.tag]
+        return self.get_path_type_id(tags)
+
+    def get_path_type_id(self, tags):
+        """Returns the type id of the element at a path, or None if the path isn't in the schema
+
+        :param tags: list, qualified tags of the elements from the root down to the element
+        """
+        type_id = self.root_types.get(tags[0])
+        for tag in tags[1:]:
+            if type_id is None:
+                break
+            child = self.children[type_id].get(tag)
+            type_id = child[1] if child is not None else None
+        return type_id
+
+
+def children_sorter_factory(schema_index, tree, element):
     """returns a function for getting a key value for sorting elements
 
     Used to sort an elements children after inserting a new element to ensure
     it meets the schema sequence specification
 
-    :param schema: xmlschema.XmlSchema, the schema to follow
+    :param schema_index: SchemaIndex, the index of the schema to follow
     :param tree: ElementTree, the tree from which the element came from
     :param element: Element, the element whose children are to be sorted
     """
-    # get the element from the schema
-    element_path = tree.getpath(element)
-    schema_element = schema.find(element_path)
-    if schema_element is None:
-        raise Exception(f'Unable to find path in schema: "{element_path}"')
+    # get the element's type from the schema
+    type_id = schema_index.get_type_id(element)
+    if type_id is None:
+        raise Exception(f'Unable to find path in schema: "{tree.getpath(element)}"')
 
-    ordered_children = [child.name for child in schema_element.iterchildren()]
+    ordered_children = schema_index.children[type_id]
+    # greater than the position of every child. Positions count the wildcards and repeated
+    # tags of the sequence, so they can reach the number of children
+    comment_key = max((position for position, _ in ordered_children.values()), default=-1) + 1
 
     # construct a function for sorting an element's children by returning the index of the
     # child according to the ordering of the schema
     def _getkey(element):
         if isinstance(element, etree._Comment):
             # put comments at the end
-            return 100
+            return comment_key
         elif not isinstance(element, etree._Element):
             raise Exception(f'Unknown type while sorting: "{type(element)}"')
 
-        if element.tag not in ordered_children:
-            # a more helpful exception that the one raised by .index()
-            raise Exception(f'Failed to find "{element.tag}" in {ordered_children}')
+        child = ordered_children.get(element.tag)
+        if child is None:
+            # a more helpful exception than a KeyError
+            ordered_tags = sorted(ordered_children, key=lambda tag: ordered_children[tag][0])
+            raise Exception(f'Failed to find "{element.tag}" in {ordered_tags}')
 
-        return ordered_children.index(element.tag)
+        return child[0]
 
     return _getkey
 
 
-def sort_element(schema, tree, element):
+@instrumentation.timed('utils.sort_element')
+def sort_element(schema_index, tree, element):
     """Sorts an element's children in place"""
-    getter = children_sorter_factory(schema, tree, element)
+    getter = children_sorter_factory(schema_index, tree, element)
     element[:] = sorted(element, key=getter)
 
 
+@instrumentation.timed('utils.remove_dupes')
 def remove_dupes(element):
     """Removes duplicate children
     !! assumes that element's children are already in sorted order
@@ -72,6 +148,7 @@ def remove_dupes(element):
         prev_child = child
 
 
+@instrumentation.timed('utils.fix_namespaces')
 def fix_namespaces(tree):
     """This method should be called when then namespace map is not correct.
     It will clone the tree, ensuring all nodes have the proper namespace prefixes
@@ -104,14 +181,47 @@ def fix_namespaces(tree):
     return new_tree
 
 
-def add_child_to_element(element, child, tree, schema):
-    element.append(child)
-    sort_element(schema, tree, element)
+@instrumentation.timed('utils.add_child_to_element')
+def add_child_to_element(element, child, tree, schema_index):
+    """Inserts child into element at the position required by the schema
+
+    The child goes after the existing children which come before it or with it in the
+    schema's sequence, which is found with a binary search over the sort keys of the
+    existing children. If those aren't in schema order they are sorted along with the
+    child, so the result is the same as appending the child and sorting the element.
+    """
+    getter = children_sorter_factory(schema_index, tree, element)
+    keys = [getter(existing_child) for existing_child in element]
+    if any(key > next_key for key, next_key in zip(keys, keys[1:])):
+        element.append(child)
+        element[:] = sorted(element, key=getter)
+        return
+    element.insert(bisect.bisect_right(keys, getter(child)), child)
+
+
+@instrumentation.timed('utils.add_children_to_element')
+def add_children_to_element(element, children, tree, schema_index):
+    """Inserts children into element at the positions required by the schema
 
+    Same as calling add_child_to_element for each child in turn, but the element's
+    children are only ordered once
+    """
+    if not children:
+        return
+    getter = children_sorter_factory(schema_index, tree, element)
+    element.extend(children)
+    element[:] = sorted(element, key=getter)
 
+
+@instrumentation.timed('utils.add_udfs')
 def add_udfs(element, udfs):
+    """Sets the UserDefinedFields of an element, adding those which don't exist
+
+    :param udfs: list, [field name, value] pairs
+    :return: Element, the UserDefinedFields container
+    """
     # get or create the udf container
-    udf_container = element.xpath('auc:UserDefinedFields', namespaces=NAMESPACES)
+    udf_container = UDF_CONTAINER_XPATH(element)
     if udf_container:
         udf_container = udf_container[0]
     else:
@@ -119,7 +229,7 @@ def add_udfs(element, udfs):
     # add the fields
     for udf_raw in udfs:
         # first check if the udf field is already defined (in this case just update the value)
-        existing_udf_value = udf_container.xpath(f'auc:UserDefinedField[auc:FieldName="{udf_raw[0]}"]/auc:FieldValue', namespaces=NAMESPACES)
+        existing_udf_value = UDF_VALUE_XPATH(udf_container, name=udf_raw[0])
         if existing_udf_value:
             existing_udf_value[0].text = udf_raw[1]
         else:
@@ -127,3 +237,4 @@ def add_udfs(element, udfs):
             udf_elem = etree.SubElement(udf_container, f'{{{BUILDINGSYNC_URI}}}UserDefinedField')
             etree.SubElement(udf_elem, f'{{{BUILDINGSYNC_URI}}}FieldName').text = udf_raw[0]
             etree.SubElement(udf_elem, f'{{{BUILDINGSYNC_URI}}}FieldValue').text = udf_raw[1]
+    return udf_container
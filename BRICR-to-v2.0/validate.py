@@ -0,0 +1,211 @@
+import os
+import argparse
+import hashlib
+import json
+import sqlite3
+from multiprocessing import Pool
+
+from lxml import etree
+
+from schema_cache import file_digest, get_cache_dir
+
+# compiled once per process by init_worker
+schema = None
+# opened once per process by init_worker if caching is enabled
+validation_cache = None
+
+# error kinds as worded by xmllint, which parse_errors expects
+ERROR_KINDS = {
+    'SCHEMASV': 'Schemas validity error',
+    'PARSER': 'parser error',
+}
+
+
+class ValidationCache:
+    """Validation results stored in SQLite, keyed by the sha256 of the file's content
+    and of the schema's content
+
+    SQLite handles locking, so the cache can be shared by workers and concurrent runs.
+
+    :param db_path: str, path to the SQLite database
+    :param schema_digest: str, sha256 of the schema the results are for
+    """
+    def __init__(self, db_path, schema_digest):
+        self.schema_digest = schema_digest
+        self.connection = sqlite3.connect(db_path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS validations ('
+            'file_digest TEXT NOT NULL, '
+            'schema_digest TEXT NOT NULL, '
+            'errors TEXT, '
+            'PRIMARY KEY (file_digest, schema_digest))'
+        )
+        self.connection.commit()
+
+    def get(self, digest):
+        """Returns (True, errors) if the result for the file digest is cached, else (False, None)"""
+        row = self.connection.execute(
+            'SELECT errors FROM validations WHERE file_digest = ? AND schema_digest = ?',
+            (digest, self.schema_digest)
+        ).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0]) if row[0] is not None else None
+
+    def put_many(self, results):
+        """Stores results
+
+        :param results: list, tuples of (file digest, errors) where errors is None if the file is valid
+        """
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO validations (file_digest, schema_digest, errors) VALUES (?, ?, ?)',
+                [
+                    (digest, self.schema_digest, json.dumps(errors) if errors is not None else None)
+                    for digest, errors in results
+                ]
+            )
+
+
+def init_worker(schema_path, cache_path=None):
+    """Compiles the schema and opens the validation cache for the current process
+
+    Used as the initializer for pool workers so the schema is only compiled once per worker
+    """
+    global schema, validation_cache
+    schema = etree.XMLSchema(etree.parse(schema_path))
+    if cache_path is not None:
+        validation_cache = ValidationCache(cache_path, file_digest(schema_path))
+
+
+def get_element_name(error):
+    """Returns the local name of the element an error is about, or None"""
+    if not error.path:
+        return None
+    # the last step of the path looks like auc:Report or auc:Scenario[2]
+    return error.path.split('/')[-1].split(':')[-1].split('[')[0]
+
+
+def collect_errors(error_log):
+    """Returns the errors in an lxml error log as a list of tuples
+
+    :return: list, tuples of (line, element name or None, error kind, message)
+    """
+    return [
+        (
+            error.line,
+            get_element_name(error) if error.domain_name == 'SCHEMASV' else None,
+            ERROR_KINDS.get(error.domain_name, f'{error.domain_name.lower()} error'),
+            error.message,
+        )
+        for error in error_log
+    ]
+
+
+def validate_file(path):
+    """Validates a file against the schema, using the cached result if there is one
+
+    :param path: str, path to the file
+    :return: tuple, (path, errors, digest, cached) where errors is None if the file is
+        valid, otherwise a list from collect_errors; digest is the sha256 of the file's
+        content and cached is True if the result came from the cache
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+
+    if validation_cache is not None:
+        cached, errors = validation_cache.get(digest)
+        if cached:
+            return path, errors, digest, True
+
+    parser = etree.XMLParser()
+    try:
+        root = etree.fromstring(data, parser, base_url=path)
+    except etree.XMLSyntaxError:
+        return path, collect_errors(parser.error_log), digest, False
+
+    if schema.validate(root):
+        return path, None, digest, False
+    return path, collect_errors(schema.error_log), digest, False
+
+
+def format_errors(path, errors):
+    """Formats errors the same way xmllint does so they can be read by parse_errors
+
+    :param path: str, path to the file the errors came from
+    :param errors: list, from collect_errors
+    :return: str
+    """
+    lines = []
+    for line, element_name, kind, message in errors:
+        if element_name is not None:
+            lines.append(f'{path}:{line}: element {element_name}: {kind} : {message}\n')
+        else:
+            lines.append(f'{path}:{line}: {kind} : {message}\n')
+    lines.append(f'{path} fails to validate\n')
+    return ''.join(lines)
+
+
+def validate_files(paths, schema_path, jobs=1, cache_path=None):
+    """Validates files, distributing them across a pool of jobs processes if jobs > 1
+
+    :param paths: list, paths to the files to validate
+    :param schema_path: str, path to the XSD
+    :param jobs: int, number of worker processes
+    :param cache_path: str, path to the validation cache database, or None to disable caching
+    :return: iterator, (path, errors, digest, cached) for each file in the order of paths,
+        see validate_file
+    """
+    if jobs > 1:
+        with Pool(jobs, initializer=init_worker, initargs=(schema_path, cache_path)) as pool:
+            yield from pool.imap(validate_file, paths, chunksize=16)
+    else:
+        init_worker(schema_path, cache_path)
+        for path in paths:
+            yield validate_file(path)
+
+
+if __name__ == '__main__':
+    # stdin: line separated paths to files to validate
+    # output:
+    #   the names of files that failed validation are put in failed_<label>.txt
+    #   errors for failed files are found in <label>_errors directory
+    arg_parser = argparse.ArgumentParser(description='Validate files against a schema')
+    arg_parser.add_argument('label', help='label for this validation run - e.g. initial_validation')
+    arg_parser.add_argument('schema', help='path to the local xsd')
+    arg_parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='number of worker processes to use')
+    arg_parser.add_argument(
+        '--cache', default=os.path.join(get_cache_dir(), 'validation_cache.sqlite'),
+        help='path to the validation cache database'
+    )
+    arg_parser.add_argument('--no-cache', action='store_true', help='validate every file, ignoring the cache')
+    args = arg_parser.parse_args()
+    cache_path = None if args.no_cache else args.cache
+
+    failure_file = f'failed_{args.label}.txt'
+    errors_dir = f'{args.label}_errors'
+    os.makedirs(errors_dir, exist_ok=True)
+
+    paths = [line.strip() for line in os.sys.stdin if line.strip()]
+    n_failed = 0
+    n_hits = 0
+    new_results = []
+    with open(failure_file, 'a') as failures:
+        for path, errors, digest, cached in validate_files(paths, args.schema, jobs=args.jobs, cache_path=cache_path):
+            if cached:
+                n_hits += 1
+            else:
+                new_results.append((digest, errors))
+            if errors is None:
+                continue
+            n_failed += 1
+            failures.write(f'{path}\n')
+            with open(os.path.join(errors_dir, os.path.basename(path)), 'w') as f:
+                f.write(format_errors(path, errors))
+
+    print(f'Validated {len(paths)} files, {n_failed} failed')
+    if cache_path is not None:
+        ValidationCache(cache_path, file_digest(args.schema)).put_many(new_results)
+        print(f'Validation cache: {n_hits} hits, {len(paths) - n_hits} misses')
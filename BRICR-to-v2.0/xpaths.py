@@ -0,0 +1,110 @@
+"""XPaths used by the transformations, compiled once at import
+
+lxml recompiles XPath strings passed to .xpath() on every call, so the
+transformations use these etree.XPath objects instead. Call them with a tree or
+an element, e.g. MEASURES(tree), and pass XPath variables as keyword arguments,
+e.g. ALL_PREMISES_IDENTIFIERS_WITH_LABEL(tree, label='Assessor parcel number').
+"""
+from lxml import etree
+
+import instrumentation
+from utils import NAMESPACES
+
+
+def compile_xpath(path):
+    # all evaluations are recorded as a single step when instrumentation is enabled
+    return instrumentation.timed('xpath')(etree.XPath(path, namespaces=NAMESPACES))
+
+
+FACILITY_PATH = '/auc:BuildingSync/auc:Facilities/auc:Facility'
+SITE_PATH = f'{FACILITY_PATH}/auc:Sites/auc:Site'
+BUILDING_PATH = f'{SITE_PATH}/auc:Buildings/auc:Building'
+REPORT_PATH = f'{FACILITY_PATH}/auc:Reports/auc:Report'
+SCENARIO_PATH = f'{REPORT_PATH}/auc:Scenarios/auc:Scenario'
+PACKAGE_OF_MEASURES_PATH = f'{SCENARIO_PATH}/auc:ScenarioType/auc:PackageOfMeasures'
+
+# -- anchors, see Anchors. Absolute, so that the first match in the document is found
+# even if it isn't under the first match of its parent's path
+FACILITY = compile_xpath(FACILITY_PATH)
+SITE = compile_xpath(SITE_PATH)
+REPORT = compile_xpath(REPORT_PATH)
+BUILDING = compile_xpath(BUILDING_PATH)
+SCENARIOS = compile_xpath(f'{REPORT_PATH}/auc:Scenarios')
+
+# -- absolute paths matching all elements in the document
+ALL_BUILDING_ADDRESSES = compile_xpath(f'{BUILDING_PATH}/auc:Address')
+ALL_SITE_ADDRESSES = compile_xpath(f'{SITE_PATH}/auc:Address')
+ALL_FLOORS_ABOVE_GRADE = compile_xpath(f'{BUILDING_PATH}/auc:FloorsAboveGrade')
+ALL_FLOORS_BELOW_GRADE = compile_xpath(f'{BUILDING_PATH}/auc:FloorsBelowGrade')
+ALL_SECTIONS = compile_xpath(f'{BUILDING_PATH}/auc:Sections/auc:Section')
+# variables: label
+ALL_PREMISES_IDENTIFIERS_WITH_LABEL = compile_xpath(
+    f'{BUILDING_PATH}/auc:PremisesIdentifiers/auc:PremisesIdentifier[auc:IdentifierLabel=$label]'
+)
+# variables: name
+ALL_PREMISES_IDENTIFIERS_WITH_CUSTOM_NAME = compile_xpath(
+    f'{BUILDING_PATH}/auc:PremisesIdentifiers/auc:PremisesIdentifier[auc:IdentifierCustomName=$name]'
+)
+ALL_LINKED_PREMISES_OR_SYSTEMS = compile_xpath(f'{REPORT_PATH}/auc:LinkedPremisesOrSystem')
+ALL_MEASURES = compile_xpath(f'{FACILITY_PATH}/auc:Measures/auc:Measure')
+ALL_SCENARIOS = compile_xpath(SCENARIO_PATH)
+ALL_IDREFS = compile_xpath('//*[@IDref]')
+ALL_PACKAGES_OF_MEASURES = compile_xpath(PACKAGE_OF_MEASURES_PATH)
+ALL_ANNUAL_SAVINGS_COSTS = compile_xpath(f'{PACKAGE_OF_MEASURES_PATH}/auc:AnnualSavingsCost')
+ALL_SAVINGS_UNITS = compile_xpath(
+    f'{PACKAGE_OF_MEASURES_PATH}/auc:AnnualSavingsByFuels/auc:AnnualSavingsByFuel/auc:ResourceUnits'
+)
+ALL_SAVINGS_BY_FUEL = compile_xpath(f'{PACKAGE_OF_MEASURES_PATH}/auc:AnnualSavingsByFuels/auc:AnnualSavingsByFuel')
+# the ResourceUses and TimeSeries of the Scenarios, in document order
+ALL_RESOURCE_USES_AND_TIME_SERIES = compile_xpath(
+    f'{SCENARIO_PATH}/auc:ResourceUses/auc:ResourceUse | {SCENARIO_PATH}/auc:TimeSeriesData/auc:TimeSeries'
+)
+
+# -- relative paths
+PACKAGE_OF_MEASURES = compile_xpath('auc:ScenarioType/auc:PackageOfMeasures')
+ANNUAL_SAVINGS_NATIVE_UNITS = compile_xpath('auc:AnnualSavingsNativeUnits')
+ANNUAL_FUEL_USE_NATIVE_UNITS = compile_xpath('auc:AnnualFuelUseNativeUnits')
+ENERGY_RESOURCE = compile_xpath('auc:EnergyResource')
+RESOURCE_UNITS = compile_xpath('auc:ResourceUnits')
+IDENTIFIER_LABEL = compile_xpath('auc:IdentifierLabel')
+IDENTIFIER_VALUE = compile_xpath('auc:IdentifierValue')
+SECTION_TYPE = compile_xpath('auc:SectionType')
+
+
+class Anchors:
+    """Memoized anchor elements of a tree which the transformations navigate from
+
+    Each anchor is the first match in the document, and is only looked up once per
+    tree. Accessing an anchor that doesn't exist raises an IndexError. Don't use
+    an Anchors after replacing or removing one of the anchor elements.
+
+    :param tree: ElementTree
+    """
+    def __init__(self, tree):
+        self.tree = tree
+        self._anchors = {}
+
+    def _get(self, name, find):
+        if name not in self._anchors:
+            self._anchors[name] = find()
+        return self._anchors[name]
+
+    @property
+    def facility(self):
+        return self._get('facility', lambda: FACILITY(self.tree)[0])
+
+    @property
+    def site(self):
+        return self._get('site', lambda: SITE(self.tree)[0])
+
+    @property
+    def building(self):
+        return self._get('building', lambda: BUILDING(self.tree)[0])
+
+    @property
+    def report(self):
+        return self._get('report', lambda: REPORT(self.tree)[0])
+
+    @property
+    def scenarios(self):
+        return self._get('scenarios', lambda: SCENARIOS(self.tree)[0])
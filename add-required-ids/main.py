@@ -1,11 +1,17 @@
 import os
 import sys
+import argparse
 
 import urllib
-from uuid import uuid4
+from multiprocessing import Pool
 
 from lxml import etree
-from xmlschema import XMLSchema
+
+# share the schema cache, instrumentation, atomic writes and ID assignment of the transformations
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'BRICR-to-v2.0'))
+import instrumentation  # noqa: E402
+from file_io import write_atomic  # noqa: E402
+from required_ids import add_missing_ids, index_elements_requiring_ids, load_elements_requiring_ids  # noqa: E402
 
 
 BUILDINGSYNC_URI = 'http://buildingsync.net/schemas/bedes-auc/2019'
@@ -13,31 +19,54 @@ NAMESPACES = {
     'auc': BUILDINGSYNC_URI
 }
 
-def add_ids(file_name, elements_requiring_ids):
+
+def add_ids(file_name, ids_index):
     """
-    Parse file and add unique ID attributes to all elements not containing one
+    Parse file and add unique ID attributes to all elements not containing one, see
+    required_ids.add_missing_ids
 
     :param file_name: Path of BSync XML file to read in
-    :param elements_requiring_ids: [xmlschema.validators.elements.XsdElement] Schema elements that have ID attributes
+    :param ids_index: {str: [([str], str)]} from index_elements_requiring_ids
     :return:
     """
+    lap = instrumentation.laps()
     tree = etree.parse(file_name)
-    for el in elements_requiring_ids:
-        # A nice method to return the full path to an element, so as to avoid
-        # finding elements such as auc:LinkedPremises/auc:Building
-        xp = "//" + el.get_path().replace(f"{{{BUILDINGSYNC_URI}}}", 'auc:')
-        elements_in_file = tree.xpath(xp, namespaces=NAMESPACES)
-        for el2 in elements_in_file:
-            if not 'ID' in el2.attrib.keys():
-                el2.set('ID', f"{el.local_name}-{uuid4()}")
+    lap('parse')
+    add_missing_ids(tree, ids_index)
+    lap('walk')
+
+    result = etree.tostring(tree.getroot(), pretty_print=True, xml_declaration=True, encoding="UTF-8")
+    lap('serialize')
+    write_atomic(file_name, result)
+    lap('write')
 
-    with open(file_name, 'w') as f:
-        f.write(etree.tostring(tree.getroot(), pretty_print=True, xml_declaration=True, encoding="UTF-8").decode())
+
+def init_worker(ids_index, profile=False):
+    """Set up the parser and the IDs index for the current process, and the instrumentation if profiling"""
+    global worker_ids_index
+    worker_ids_index = ids_index
+    if profile:
+        instrumentation.enable()
+    etree.set_default_parser(etree.XMLParser(remove_blank_text=True))
+    etree.register_namespace('auc', BUILDINGSYNC_URI)
+
+
+def add_ids_in_worker(file_name):
+    with instrumentation.timed_file(file_name):
+        add_ids(file_name, worker_ids_index)
+    # send the timings back with each result
+    return file_name, instrumentation.collect()
 
 
 if __name__ == "__main__":
-    assert len(sys.argv) == 2, "Specify path to directory with XML files to update as argument, like so: python main.py ../path/to/files"
-    source = sys.argv[1]
+    arg_parser = argparse.ArgumentParser(
+        description="Add IDs to elements that require them, e.g. python main.py ../path/to/files"
+    )
+    arg_parser.add_argument('source', help="path to directory with XML files to update, or to a single file")
+    arg_parser.add_argument('--jobs', type=int, default=1, help="number of worker processes to use for directories")
+    arg_parser.add_argument('--profile', help="record the time taken by each step and file, and write them to this json file")
+    args = arg_parser.parse_args()
+    source = args.source
     files = [source]
     if os.path.isdir(source):
         files = [os.path.join(source, f) for f in os.listdir(source) if f.endswith('.xml')]
@@ -45,16 +74,27 @@ if __name__ == "__main__":
     # Load in schema and get location to example files
     schema_path = os.path.realpath("../../schema")
     assert os.path.isdir(schema_path), "The 'schema' directory must exist at the same level as the 'transformations' directory, i.e. parent_dir/schema; parent_dir/transformations"
-    schema = XMLSchema(os.path.join(schema_path, "BuildingSync.xsd"))
+    elements_requiring_ids = load_elements_requiring_ids(os.path.join(schema_path, "BuildingSync.xsd"))
+    ids_index = index_elements_requiring_ids(elements_requiring_ids)
 
-    # very nice function - XPath in Schema file
-    elements_requiring_ids = schema.findall("//*[@ID]")
-
-    # Setup parse
-    parser = etree.XMLParser(remove_blank_text=True)
-    etree.set_default_parser(parser)
-    etree.register_namespace('auc', BUILDINGSYNC_URI)
+    profile = args.profile is not None
+    if args.jobs > 1:
+        recorder = instrumentation.Recorder()
+        with Pool(args.jobs, initializer=init_worker, initargs=(ids_index, profile)) as pool:
+            for file_name, worker_timings in pool.imap_unordered(add_ids_in_worker, files):
+                if worker_timings is not None:
+                    recorder.merge(worker_timings)
+                print(f"Processed: {os.path.realpath(file_name)}")
+    else:
+        # Setup parse
+        init_worker(ids_index, profile)
+        recorder = instrumentation.enable() if profile else None
+        for file_name in files:
+            print(f"Processing: {os.path.realpath(file_name)}")
+            with instrumentation.timed_file(file_name):
+                add_ids(file_name, ids_index)
 
-    for file_name in files:
-        print(f"Processing: {os.path.realpath(file_name)}")
-        add_ids(file_name, elements_requiring_ids)
+    if profile:
+        print(instrumentation.format_report(recorder))
+        instrumentation.write_report(recorder, args.profile)
+        print(f"Profile saved to {args.profile}")